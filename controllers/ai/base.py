@@ -1,6 +1,8 @@
 from abc import ABC
 from abc import abstractmethod
-from typing import Dict, Any
+from typing import Dict, Any, Iterator, Optional
+
+from controllers.ai.context import GenerationContext
 
 
 class BaseAIController(ABC):
@@ -13,6 +15,9 @@ class BaseAIController(ABC):
             user_prompt: str,
             system_prompt: str,
             ignore_defaults_params: bool = False,
+            context: Optional[GenerationContext] = None,
+            response_tool: Optional[Dict[str, Any]] = None,
+            prefill: Optional[str] = None,
             **kwargs
     ) -> str:
         """
@@ -22,6 +27,10 @@ class BaseAIController(ABC):
             user_prompt: Input text prompt
             system_prompt: System prompt
             ignore_defaults_params: Ignore default parameters (all params required by the service must be passed in)
+            context: Per-request context; the generation is aborted when it is cancelled
+            response_tool: Tool definition (``name``, ``description``, ``input_schema``) the model is
+                forced to call; the tool's JSON input is returned instead of text
+            prefill: Text the assistant turn starts with; it is included in the returned text
             **kwargs: Service-specific parameters (e.g., temperature, max_tokens)
 
         Returns:
@@ -30,4 +39,26 @@ class BaseAIController(ABC):
             :param system_prompt:
             :param ignore_defaults_params:
         """
-        raise NotImplementedError
\ No newline at end of file
+        raise NotImplementedError
+
+    def stream_response(
+            self,
+            user_prompt: str,
+            system_prompt: str,
+            ignore_defaults_params: bool = False,
+            context: Optional[GenerationContext] = None,
+            response_tool: Optional[Dict[str, Any]] = None,
+            prefill: Optional[str] = None,
+            **kwargs
+    ) -> Iterator[str]:
+        """
+        Generate AI response, yielding the text as it is produced.
+
+        Takes the same arguments as ``generate_response``; joining the yielded
+        pieces gives the text ``generate_response`` returns. Closing the
+        iterator early ends the model call.
+
+        Returns:
+            Iterator over pieces of the generated text
+        """
+        raise NotImplementedError
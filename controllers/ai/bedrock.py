@@ -1,10 +1,56 @@
 import json
+import threading
+import time
 from typing import Any
 from typing import Dict
-
-import boto3
+from typing import Iterator
+from typing import Optional
 
 from controllers.ai.base import BaseAIController
+from controllers.ai.context import Deadline
+from controllers.ai.context import DeadlineExceeded
+from controllers.ai.context import GenerationCancelled
+from controllers.ai.context import GenerationContext
+from controllers.ai.regions import NoRegionAvailable
+from controllers.ai.regions import RegionPool
+from controllers.ai.regions import is_regional_failure
+from services.metrics import metrics
+from services.prompt.tokens import estimate_tokens
+from services.usage import BudgetExceeded
+from services.usage import Usage
+from services.usage import UsageLedger
+
+# Client defaults, overridden by the matching controller config keys.
+CLIENT_DEFAULTS = dict(
+    connect_timeout=10,
+    read_timeout=280,
+    retry_mode="standard",
+    max_attempts=3,
+    max_pool_connections=50,
+    retry_min_budget_seconds=10,
+)
+
+# Deadline of the call running on the current thread, read by the retry hook.
+_call_state = threading.local()
+
+
+def _check_retry_budget(request, **kwargs):
+    """botocore ``request-created`` hook: refuse retries the deadline cannot afford.
+
+    The first attempt always goes out; a retry is only sent while more than
+    the client's minimum budget remains, otherwise the call fails fast with
+    DeadlineExceeded instead of starting an attempt that cannot finish.
+    """
+    deadline: Optional[Deadline] = getattr(_call_state, "deadline", None)
+    if deadline is None:
+        return None
+    attempt = request.context.get("retries", {}).get("attempt", 1)
+    if attempt > 1:
+        if deadline.remaining() < getattr(_call_state, "min_budget", 0):
+            metrics.incr("bedrock.retries_skipped")
+            raise DeadlineExceeded("Not enough time left before the request deadline to retry")
+        metrics.incr("bedrock.retries")
+    return None
 
 
 class AWSBedrockService(BaseAIController):
@@ -17,16 +63,57 @@ class AWSBedrockService(BaseAIController):
             model_id: Bedrock model ID (i.e. 'anthropic.claude-3-sonnet-20240229-v1:0')
             aws_access_key_id: AWS access key ID (optional)
             aws_secret_access_key: AWS secret access key (optional)
+            client: Pre-built ``bedrock-runtime`` client to reuse (optional)
+            region_pool: RegionPool routing calls across regions; takes
+                precedence over ``client`` and ``region_name`` (optional)
+            connect_timeout: Seconds to establish a connection (optional)
+            read_timeout: Seconds to wait for the next bytes of a response (optional)
+            retry_mode: botocore retry mode, 'standard' or 'adaptive' (optional)
+            max_attempts: Attempts per call, including the first (optional)
+            max_pool_connections: Size of the client's connection pool (optional)
+            retry_min_budget_seconds: Deadline budget below which retries are skipped (optional)
+            usage_ledger: UsageLedger recording token usage and enforcing budgets (optional)
         """
-        client_kwargs = {"region_name": config["region_name"]}
+        self.region_pool: Optional[RegionPool] = config.get("region_pool")
+        if self.region_pool is None:
+            self.client = config.get("client") or self.create_client(config)
+        else:
+            self.client = None
+        self.model_id = config["model_id"]
+        self.usage_ledger: Optional[UsageLedger] = config.get("usage_ledger")
+        self.retry_min_budget_seconds = config.get(
+            "retry_min_budget_seconds", CLIENT_DEFAULTS["retry_min_budget_seconds"]
+        )
+
+    @staticmethod
+    def create_client(config: Dict[str, Any]):
+        """Build a ``bedrock-runtime`` client from the controller config.
+
+        boto3 is imported lazily so that importing the controller is cheap and
+        clients are only ever created inside the process that uses them.
+        """
+        import boto3
+        from botocore.config import Config
+
+        options = {**CLIENT_DEFAULTS, **{k: v for k, v in config.items() if k in CLIENT_DEFAULTS}}
+        client_kwargs = {
+            "region_name": config["region_name"],
+            "config": Config(
+                connect_timeout=options["connect_timeout"],
+                read_timeout=options["read_timeout"],
+                retries={"mode": options["retry_mode"], "total_max_attempts": options["max_attempts"]},
+                max_pool_connections=options["max_pool_connections"],
+            ),
+        }
 
         # Add API key credentials if provided
-        if "aws_access_key_id" in config and "aws_secret_access_key" in config:
+        if config.get("aws_access_key_id") and config.get("aws_secret_access_key"):
             client_kwargs["aws_access_key_id"] = config["aws_access_key_id"]
             client_kwargs["aws_secret_access_key"] = config["aws_secret_access_key"]
 
-        self.client = boto3.client("bedrock-runtime", **client_kwargs)
-        self.model_id = config["model_id"]
+        client = boto3.client("bedrock-runtime", **client_kwargs)
+        client.meta.events.register("request-created.bedrock-runtime", _check_retry_budget)
+        return client
 
     @staticmethod
     def _default_params(system_prompt: str, user_prompt) -> dict:
@@ -48,8 +135,31 @@ class AWSBedrockService(BaseAIController):
             user_prompt: str,
             system_prompt: str,
             ignore_defaults_params: bool = False,
+            context: Optional[GenerationContext] = None,
+            response_tool: Optional[Dict[str, Any]] = None,
+            prefill: Optional[str] = None,
             **kwargs
     ) -> str:
+        return "".join(self.stream_response(
+            user_prompt,
+            system_prompt,
+            ignore_defaults_params=ignore_defaults_params,
+            context=context,
+            response_tool=response_tool,
+            prefill=prefill,
+            **kwargs
+        ))
+
+    def stream_response(
+            self,
+            user_prompt: str,
+            system_prompt: str,
+            ignore_defaults_params: bool = False,
+            context: Optional[GenerationContext] = None,
+            response_tool: Optional[Dict[str, Any]] = None,
+            prefill: Optional[str] = None,
+            **kwargs
+    ) -> Iterator[str]:
         # Use Default parameters initially if not set to ignore.
         # Specific params can be overwritten or added through kwargs
         if ignore_defaults_params:
@@ -57,27 +167,168 @@ class AWSBedrockService(BaseAIController):
         else:
             params = self._default_params(system_prompt, user_prompt)
 
+        if response_tool is not None:
+            # Forcing the tool makes the response its JSON input.
+            params["tools"] = [response_tool]
+            params["tool_choice"] = {"type": "tool", "name": response_tool["name"]}
+        elif prefill:
+            params["messages"] = params.get("messages", []) + [
+                {"role": "assistant", "content": [{"type": "text", "text": prefill}]}
+            ]
+
         # Params can be overwritten by the kwargs being passed in
         body = json.dumps({**params, **kwargs})
+        context = context or GenerationContext()
+        started = time.perf_counter()
+        string_response = "" if response_tool is not None else prefill or ""
+        usage: Optional[Usage] = None
+        usage_final = False
 
         # Invoke Bedrock model
         try:
-            response = self.client.invoke_model_with_response_stream(
-                modelId=self.model_id,
-                body=body,
-                contentType="application/json"
-            )
-            stream = response.get('body')
-            string_response = ""
-            if stream:
-                for event in stream:
-                    chunk = json.loads(event['chunk']['bytes'])
-                    if chunk['type'] == 'content_block_delta':
-                        string_response += chunk['delta']['text']
-                        print(chunk['delta']['text'], end="", flush=True)
-            return string_response
-
-        # TODO: explor more specific Exceptions
+            context.raise_if_cancelled()
+            if self.usage_ledger is not None:
+                # Rejected before the call, so an exhausted budget costs nothing.
+                self.usage_ledger.check(context.project, estimate_tokens(body))
+            usage = Usage()
+            stream, region, call_started = self._invoke_stream(body, context)
+            # The region's health is judged on the time to the first event.
+            pending_region = region
+            try:
+                if string_response:
+                    yield string_response
+                if stream:
+                    # Closing the stream from the cancelling thread unblocks a
+                    # read that is waiting on the next event.
+                    unregister = context.on_cancel(stream.close)
+                    finished = False
+                    try:
+                        for event in stream:
+                            if pending_region is not None:
+                                self.region_pool.record_success(pending_region, time.perf_counter() - call_started)
+                                pending_region = None
+                            context.raise_if_cancelled()
+                            chunk = json.loads(event['chunk']['bytes'])
+                            if chunk['type'] == 'message_start':
+                                usage.update(chunk['message'].get('usage', {}))
+                            elif chunk['type'] == 'message_delta':
+                                usage.update(chunk.get('usage', {}))
+                                usage_final = True
+                            elif chunk['type'] == 'content_block_delta':
+                                delta = chunk['delta']
+                                if delta.get('type') == 'input_json_delta':
+                                    text = delta['partial_json']
+                                elif response_tool is None:
+                                    text = delta.get('text', "")
+                                else:
+                                    continue
+                                string_response += text
+                                yield text
+                        finished = True
+                    finally:
+                        unregister()
+                        if not finished:
+                            # Also covers a consumer that stopped reading early.
+                            stream.close()
+            except Exception as e:
+                if pending_region is not None:
+                    if context.cancelled:
+                        self.region_pool.release(pending_region)
+                    else:
+                        self.region_pool.record_failure(pending_region, e)
+                raise
+            if pending_region is not None:
+                self.region_pool.record_success(pending_region, time.perf_counter() - call_started)
+            context.raise_if_cancelled()
+            metrics.observe("bedrock.generation_seconds", time.perf_counter() - started)
+            metrics.observe("bedrock.output_tokens", estimate_tokens(string_response))
+
+        except BudgetExceeded:
+            raise
+        except DeadlineExceeded:
+            context.cancel(DeadlineExceeded)
+            self._record_abort(started, string_response, reason="deadline")
+            raise
         except Exception as e:
-            # Handle errors appropriately
-            raise RuntimeError(f"Bedrock API error: {str(e)}") from e
\ No newline at end of file
+            if context.cancelled:
+                error = context.error()
+                self._record_abort(
+                    started, string_response,
+                    reason="deadline" if isinstance(error, DeadlineExceeded) else "disconnect",
+                )
+                raise error from e
+            from botocore.exceptions import BotoCoreError
+            from botocore.exceptions import ClientError
+
+            # Failures of Bedrock or of the connection to it are API errors;
+            # anything else is a bug here and is raised as it is.
+            if isinstance(e, (ClientError, BotoCoreError, NoRegionAvailable)):
+                raise RuntimeError(f"Bedrock API error: {str(e)}") from e
+            raise
+        finally:
+            if usage is not None:
+                if not usage_final:
+                    # An aborted stream never reports its output; count what arrived.
+                    usage.output_tokens = max(usage.output_tokens, estimate_tokens(string_response))
+                context.usage.append(usage)
+                if self.usage_ledger is not None and usage.total:
+                    self.usage_ledger.record(context.project, context.operation, self.model_id, usage)
+
+    def _invoke_stream(self, body: str, context: GenerationContext):
+        """Start a streamed invocation, failing over between regions.
+
+        Without a region pool the controller's own client is used. With one,
+        the healthiest allowed region is tried first; a regional failure
+        (throttling, 5xx, connection error) moves on to the next region
+        while the deadline allows.
+
+        Returns:
+            tuple: ``(stream, region, started)``; ``region`` is None without a pool.
+        """
+        tried = []
+        while True:
+            region = self.region_pool.choose(exclude=tried) if self.region_pool else None
+            client = self.region_pool.client(region) if self.region_pool else self.client
+            started = time.perf_counter()
+            _call_state.deadline = context.deadline
+            _call_state.min_budget = self.retry_min_budget_seconds
+            try:
+                response = client.invoke_model_with_response_stream(
+                    modelId=self.model_id,
+                    body=body,
+                    contentType="application/json"
+                )
+                return response.get('body'), region, started
+            except Exception as e:
+                if region is None:
+                    raise
+                if context.cancelled or isinstance(e, GenerationCancelled):
+                    self.region_pool.release(region)
+                    raise
+                self.region_pool.record_failure(region, e)
+                tried.append(region)
+                remaining = context.deadline.remaining() if context.deadline else None
+                if (
+                        not is_regional_failure(e)
+                        or len(tried) == len(self.region_pool.regions)
+                        or (remaining is not None and remaining < self.retry_min_budget_seconds)
+                ):
+                    raise
+                metrics.incr("bedrock.region_failovers", region=region)
+            finally:
+                _call_state.deadline = None
+
+    @staticmethod
+    def _record_abort(started: float, partial_response: str, reason: str = "disconnect"):
+        """Record an aborted generation and estimate what aborting saved.
+
+        Savings are estimated against the average completed generation.
+        """
+        elapsed = time.perf_counter() - started
+        generated = estimate_tokens(partial_response)
+        typical_seconds = metrics.summary("bedrock.generation_seconds")["avg"]
+        typical_tokens = metrics.summary("bedrock.output_tokens")["avg"]
+        metrics.incr("bedrock.aborted", reason=reason)
+        metrics.incr("bedrock.aborted_output_tokens", generated)
+        metrics.incr("bedrock.aborted_tokens_saved", max(0.0, typical_tokens - generated))
+        metrics.incr("bedrock.aborted_seconds_saved", max(0.0, typical_seconds - elapsed))
@@ -0,0 +1,102 @@
+import threading
+import time
+from typing import Any
+from typing import Callable
+from typing import List
+from typing import Optional
+from typing import Type
+
+
+class GenerationCancelled(RuntimeError):
+    """Raised when a generation is aborted because its caller went away."""
+
+
+class DeadlineExceeded(GenerationCancelled):
+    """Raised when a generation cannot finish within the request's deadline."""
+
+
+class Deadline:
+    """Point in time by which a request must be answered."""
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.expires_at = time.monotonic() + timeout
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+
+class GenerationContext:
+    """Per-request state shared between the route and the AI controller.
+
+    The route cancels the context when the HTTP client disconnects or the
+    deadline passes; the controller registers callbacks (e.g. closing the
+    response stream) that run as soon as that happens, even while it is
+    blocked reading from the model.
+
+    ``project`` and ``operation`` attribute the tokens the generation uses;
+    the controller appends the token usage of every model call to ``usage``.
+    """
+
+    def __init__(self, deadline: Optional[Deadline] = None, project: str = "", operation: str = ""):
+        self.deadline = deadline
+        self.project = project
+        self.operation = operation
+        self.usage: List[Any] = []
+        self._cancelled = threading.Event()
+        self._error: Type[GenerationCancelled] = GenerationCancelled
+        self._callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self, error: Type[GenerationCancelled] = GenerationCancelled):
+        """Cancel the generation; ``error`` is raised by the controller."""
+        with self._lock:
+            if self._cancelled.is_set():
+                return
+            self._error = error
+            self._cancelled.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """Register ``callback`` to run on cancellation.
+
+        Runs immediately if the context is already cancelled. Returns a
+        function that unregisters the callback.
+        """
+        with self._lock:
+            if not self._cancelled.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._remove(callback)
+        callback()
+        return lambda: None
+
+    def _remove(self, callback: Callable[[], None]):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def error(self) -> GenerationCancelled:
+        """The exception describing why the generation was cancelled."""
+        if issubclass(self._error, DeadlineExceeded):
+            return self._error("Generation did not finish before the request deadline")
+        return self._error("Generation cancelled by the caller")
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise self.error()
+        if self.deadline is not None and self.deadline.expired:
+            self.cancel(DeadlineExceeded)
+            raise self.error()
@@ -0,0 +1,272 @@
+"""Multi-region routing of Bedrock calls.
+
+A :class:`RegionPool` holds one ``bedrock-runtime`` client per region and
+tracks each region's health: an exponentially weighted moving average of the
+time to first response, the error rate, and a circuit breaker.
+
+- A region is *closed* (healthy) until ``failure_threshold`` consecutive
+  regional failures (throttling, 5xx, connection errors) open its circuit.
+- An *open* region gets no traffic for ``open_seconds``. It then turns
+  *half-open*: a small ``probe_fraction`` of calls is routed to it, one at a
+  time, and a successful probe closes the circuit again.
+- Calls go to the closed region with the best score (latency weighted by
+  error rate). The error rate of a region decays while it gets no traffic,
+  so a region that was failed away from wins its traffic back.
+- A later region in the configured order must beat an earlier one by
+  ``switch_margin`` to take its traffic, so routing does not flap between
+  regions with similar latency.
+
+Only regions on the data-residency allowlist are ever used. Clients are
+created by the supplied factory, so the pool can be exercised with stub
+clients.
+"""
+
+import logging
+import random
+import threading
+import time
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Error codes that say something about the region rather than the request.
+REGIONAL_ERROR_CODES = frozenset({
+    "ThrottlingException",
+    "ServiceUnavailableException",
+    "InternalServerException",
+    "ModelTimeoutException",
+    "ModelNotReadyException",
+    "ServiceQuotaExceededException",
+})
+
+
+class NoRegionAvailable(RuntimeError):
+    """Raised when every allowed region has an open circuit."""
+
+
+def is_regional_failure(error: BaseException) -> bool:
+    """Whether ``error`` counts against the health of the region it came from.
+
+    Throttling, server errors and connection problems do; validation and
+    access errors are the request's fault and do not.
+    """
+    response = getattr(error, "response", None)
+    if isinstance(response, dict):
+        code = response.get("Error", {}).get("Code")
+        status = response.get("ResponseMetadata", {}).get("HTTPStatusCode") or 0
+        return code in REGIONAL_ERROR_CODES or status == 429 or status >= 500
+
+    from botocore.exceptions import ConnectionError as BotoConnectionError
+    from botocore.exceptions import ReadTimeoutError
+
+    return isinstance(error, (BotoConnectionError, ReadTimeoutError, ConnectionError))
+
+
+class RegionHealth:
+    """Rolling health statistics and circuit state of one region."""
+
+    def __init__(self, region: str):
+        self.region = region
+        self.state = CLOSED
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.failed_at = 0.0
+        self.probing = False
+
+    def score(self, now: float, half_life: float) -> float:
+        """Lower is better; regions without samples score last."""
+        if self.latency is None:
+            return float("inf")
+        error_rate = self.error_rate * 0.5 ** ((now - self.failed_at) / half_life)
+        return self.latency * (1 + 10 * error_rate)
+
+    def as_dict(self) -> dict:
+        return dict(
+            state=self.state,
+            latency=self.latency,
+            error_rate=round(self.error_rate, 4),
+            consecutive_failures=self.consecutive_failures,
+        )
+
+
+class RegionPool:
+    """Health-scored, circuit-broken set of per-region Bedrock clients.
+
+    Args:
+        regions: Regions in order of preference.
+        client_factory: Called with a region name to build its client.
+        allowed_regions: Data-residency allowlist; regions outside it are
+            dropped. ``None`` allows every configured region.
+        failure_threshold: Consecutive regional failures that open a circuit.
+        open_seconds: How long an open circuit rejects traffic before probing.
+        probe_fraction: Share of calls sent to a half-open region.
+        ewma_alpha: Weight of the newest sample in the rolling statistics.
+        switch_margin: Relative improvement a later region needs over an
+            earlier one to be preferred.
+        clock: Monotonic clock, replaceable in tests.
+        rng: Random source for probe selection, replaceable in tests.
+
+    Raises:
+        ValueError: If no configured region is on the allowlist.
+    """
+
+    def __init__(
+            self,
+            regions: Iterable[str],
+            client_factory: Callable[[str], object],
+            allowed_regions: Optional[Iterable[str]] = None,
+            failure_threshold: int = 5,
+            open_seconds: float = 30,
+            probe_fraction: float = 0.05,
+            ewma_alpha: float = 0.2,
+            switch_margin: float = 0.2,
+            clock: Callable[[], float] = time.monotonic,
+            rng: Optional[random.Random] = None,
+    ):
+        regions = list(dict.fromkeys(regions))
+        if allowed_regions is not None:
+            allowed = set(allowed_regions)
+            dropped = [region for region in regions if region not in allowed]
+            if dropped:
+                logger.warning("Ignoring Bedrock regions outside the allowlist: %s", ", ".join(dropped))
+            regions = [region for region in regions if region in allowed]
+        if not regions:
+            raise ValueError("No allowed Bedrock region configured")
+
+        self.regions: List[str] = regions
+        self.client_factory = client_factory
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.probe_fraction = probe_fraction
+        self.ewma_alpha = ewma_alpha
+        self.switch_margin = switch_margin
+        self.clock = clock
+        self.rng = rng or random.Random()
+        self.health: Dict[str, RegionHealth] = {region: RegionHealth(region) for region in regions}
+        self._clients: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def primary(self) -> str:
+        return self.regions[0]
+
+    def client(self, region: str):
+        """Return the client for ``region``, creating it on first use."""
+        client = self._clients.get(region)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(region)
+                if client is None:
+                    client = self.client_factory(region)
+                    self._clients[region] = client
+        return client
+
+    def _refresh(self, health: RegionHealth):
+        if health.state == OPEN and self.clock() - health.opened_at >= self.open_seconds:
+            health.state = HALF_OPEN
+            health.probing = False
+
+    def choose(self, exclude: Iterable[str] = ()) -> str:
+        """Pick the region for the next call.
+
+        Args:
+            exclude: Regions already tried for this call.
+
+        Raises:
+            NoRegionAvailable: If no allowed region can take the call.
+        """
+        exclude = set(exclude)
+        with self._lock:
+            closed, probes = [], []
+            for region in self.regions:
+                if region in exclude:
+                    continue
+                health = self.health[region]
+                self._refresh(health)
+                if health.state == CLOSED:
+                    closed.append(health)
+                elif health.state == HALF_OPEN and not health.probing:
+                    probes.append(health)
+
+            if probes and (not closed or self.rng.random() < self.probe_fraction):
+                probe = probes[0]
+                probe.probing = True
+                metrics.incr("bedrock.region_probes", region=probe.region)
+                return probe.region
+            if not closed:
+                raise NoRegionAvailable("All allowed Bedrock regions are unavailable")
+            now = self.clock()
+            best, best_score = closed[0], closed[0].score(now, self.open_seconds)
+            for health in closed[1:]:
+                score = health.score(now, self.open_seconds)
+                if score < best_score * (1 - self.switch_margin):
+                    best, best_score = health, score
+            return best.region
+
+    def _sample(self, current: Optional[float], value: float) -> float:
+        if current is None:
+            return value
+        return current + self.ewma_alpha * (value - current)
+
+    def record_success(self, region: str, latency: float):
+        """Record a call to ``region`` that answered after ``latency`` seconds."""
+        with self._lock:
+            health = self.health[region]
+            health.latency = self._sample(health.latency, latency)
+            health.error_rate = self._sample(health.error_rate, 0.0)
+            health.consecutive_failures = 0
+            if health.state != CLOSED:
+                logger.info("Bedrock region %s recovered", region)
+                metrics.gauge("bedrock.region_available", 1, region=region)
+            health.state = CLOSED
+            health.probing = False
+        metrics.observe("bedrock.region_latency_seconds", latency, region=region)
+
+    def record_failure(self, region: str, error: BaseException):
+        """Record a failed call; regional failures may open the circuit."""
+        if not is_regional_failure(error):
+            self.release(region)
+            return
+        with self._lock:
+            health = self.health[region]
+            health.error_rate = self._sample(health.error_rate, 1.0)
+            health.consecutive_failures += 1
+            health.failed_at = self.clock()
+            if health.state == HALF_OPEN or health.consecutive_failures >= self.failure_threshold:
+                if health.state != OPEN:
+                    logger.warning("Opening circuit for Bedrock region %s after: %s", region, error)
+                    metrics.incr("bedrock.circuit_opened", region=region)
+                    metrics.gauge("bedrock.region_available", 0, region=region)
+                health.state = OPEN
+                health.opened_at = self.clock()
+            health.probing = False
+        metrics.incr("bedrock.region_failures", region=region)
+
+    def release(self, region: str):
+        """End a call that says nothing about the region's health."""
+        with self._lock:
+            self.health[region].probing = False
+
+    def snapshot(self) -> Dict[str, dict]:
+        with self._lock:
+            for health in self.health.values():
+                self._refresh(health)
+            return {region: health.as_dict() for region, health in self.health.items()}
+
+    def close(self):
+        with self._lock:
+            clients, self._clients = list(self._clients.values()), {}
+        for client in clients:
+            client.close()
@@ -5,29 +5,99 @@ Routes include helpers for generating strategic/economic case content, policy
 document discovery, section updates, and a generic Bedrock invocation endpoint.
 """
 
+import asyncio
+import codecs
+import hmac
 import json
+import time
+from contextlib import asynccontextmanager
+from dataclasses import asdict
+from typing import Optional
+
+# Captured before the heavier imports so cold start includes import time.
+PROCESS_STARTED = time.perf_counter()
 
-import boto3
 import requests
-from decouple import config as envconfig
+from fastapi import Depends
 from fastapi import FastAPI
 from fastapi import HTTPException
 from fastapi import Query
 from fastapi import Request
+from fastapi import WebSocket
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
-
+from fastapi.responses import PlainTextResponse
+from fastapi.responses import Response
+from fastapi.responses import StreamingResponse
+
+from controllers.ai.context import DeadlineExceeded
+from controllers.ai.context import GenerationCancelled
+from controllers.ai.context import GenerationContext
+from middleware.compression import CompressionMiddleware
+from middleware.idempotency import IdempotencyMiddleware
+from middleware.shedding import LoadSheddingMiddleware
+from middleware.timing import RequestTimingMiddleware
+
+from models.base import ResponseMode
+from models.bedrock import BedrockBatchRequest
+from models.bedrock import BedrockBatchResponse
+from models.bedrock import BedrockBatchResult
+from models.bedrock import BedrockPrompt
+from models.bedrock import BedrockRequest
+from models.bedrock import BedrockUsage
 from models.cases.economic import EconomicCaseRequest
 from models.cases.economic import EconomicCaseResponse
+from models.cases.economic import EconomicCaseSections
+from models.cases.economic import StructuredEconomicCaseResponse
 from models.cases.section import SectionGeneration
+from models.cases.session import CaseSectionsUpdate
+from models.cases.session import CaseSession
+from models.cases.session import CaseSessionRequest
+from models.cases.session import CaseSessionResponse
+from models.cases.session import CaseSessionSummary
 from models.cases.strategic import StrategicCaseRequest
 from models.cases.strategic import StrategicCaseResponse
+from models.cases.strategic import StrategicCaseSections
+from models.cases.strategic import StructuredStrategicCaseResponse
 from models.cases.strategic import SupplementaryInfo
+from models.cases.supplementary import SupplementaryInfoResponse
+from models.doc import PolicyCatalogueEntry
+from models.doc import PolicyCatalogueResponse
 from models.doc import PolicyDocsRequest
 from models.doc import PolicyDocsResponse
+from models.doc import PolicyDocumentCandidate
+from models.doc import PolicyDocumentPromotion
 from models.section import PromptsRequestModel
-from services.ai import bedrock_economic_prompt_service
-from services.ai import bedrock_prompt_service
+from models.section import SectionModel
+from models.usage import BudgetResponse
+from models.usage import BudgetStatus
+from models.usage import UsageRecord
+from models.usage import UsageResponse
+from services.catalogue import CandidateNotFoundError
+from services.catalogue import PolicyCatalogue
+from services.container import ServiceContainer
+from services.container import startup
+from services.editing import EditSessionHandler
+from services.generation import GenerationRunner
+from services.generation import get_generation
+from services.metrics import metrics
+from services.progressive import FINAL
+from services.progressive import progressive_section
+from services.profiling import MEMORY_GROUPINGS
+from services.profiling import ProfilerBusyError
+from services.prompt.compiler import prompt_report
+from services.prompt.manager import parse_case_sections
+from services.prompt.manager import sanitise_json_string_response
+from services.prompt.summary import ParagraphChunker
+from services.prompt.summary import chunk_text
+from services.prompt.summary import strip_html
+from services.session import CaseNotFoundError
+from services.settings import load_settings
+from services.shedding import LoadShed
+from services.usage import GROUP_COLUMNS
+from services.usage import BudgetExceeded
+from services.usage import Usage
 
 # FastAPI application for AWS Bedrock integration
 #
@@ -37,28 +107,89 @@ from services.ai import bedrock_prompt_service
 # - POST /api/bedrock: Invoke AWS Bedrock models with system and user prompts
 #   Example request:
 #   {
-#     "model_id": "anthropic.claude-v2",
 #     "system_prompt": "You are a helpful AI assistant.",
-#     "user_prompt": "What are the key features of AWS Bedrock?"
+#     "user_prompt": "What are the key features of AWS Bedrock?",
+#     "stream": false
 #   }
+# - POST /api/bedrock/batch: Run many prompts concurrently, e.g.
+#   {"prompts": [{"user_prompt": "..."}, {"user_prompt": "..."}], "concurrency": 4}
 #
 # Note: Ensure AWS credentials are properly configured with access to Bedrock.
-app = FastAPI()
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Build the worker's resources after fork and release them on shutdown.
+
+    Start-up (template loading and Bedrock connection warm-up) completes before
+    the worker starts accepting requests. The event-loop monitor starts first,
+    so blocking during start-up is reported too.
+    """
+    container = ServiceContainer(load_settings())
+    app.state.container = container
+    if container.loop_monitor is not None:
+        container.loop_monitor.start()
+    await run_in_threadpool(startup, container, PROCESS_STARTED)
+    yield
+    container.close()
+
+
+app = FastAPI(lifespan=lifespan)
+
+# Inside idempotency so a retry whose generation is running or done joins it
+# or gets the stored result instead of being shed; a shed 503 is not stored.
+app.add_middleware(LoadSheddingMiddleware)
+# Added early so CORS and compression also apply to replayed responses.
+app.add_middleware(IdempotencyMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
-    allow_methods=["POST", "GET", "OPTIONS"],
+    allow_methods=["POST", "GET", "PATCH", "OPTIONS"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Idempotency-Key", "Idempotency-Replayed", "Retry-After"],
 )
+app.add_middleware(CompressionMiddleware, minimum_size=1024)
+app.add_middleware(RequestTimingMiddleware)
+
+
+def get_container(request: Request) -> ServiceContainer:
+    """FastAPI dependency returning the worker's resource container."""
+    return request.app.state.container
+
+
+@app.exception_handler(GenerationCancelled)
+async def generation_cancelled_handler(request: Request, exc: GenerationCancelled):
+    """Answer aborted generations with 499 (client closed request).
+
+    The client has normally gone by the time this is sent.
+    """
+    return JSONResponse(status_code=499, content={"detail": "Generation cancelled"})
+
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_exceeded_handler(request: Request, exc: DeadlineExceeded):
+    """Answer generations that ran out of time with 504."""
+    return JSONResponse(status_code=504, content={"detail": str(exc)})
 
-bedrock_key = envconfig('BEDROCK_ACCESS_KEY')
-bedrock_secret = envconfig('BEDROCK_SECRET_ACCESS_KEY')
 
-iam = boto3.client('iam')
-# Initialize Bedrock client with a region where the service is available
-# TODO: change region for pilot
-bedrock = boto3.client('bedrock-runtime', region_name='eu-west-2')
+@app.exception_handler(BudgetExceeded)
+async def budget_exceeded_handler(request: Request, exc: BudgetExceeded):
+    """Answer requests of projects that have used up their token budget with 429."""
+    return JSONResponse(status_code=429, content={"detail": str(exc)})
+
+
+@app.exception_handler(LoadShed)
+async def load_shed_handler(request: Request, exc: LoadShed):
+    """Answer generations shed by the overloaded queue with 503."""
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": str(exc.retry_after)})
+
+
+def case_summary(session: CaseSession) -> CaseSessionResponse:
+    return CaseSessionResponse(data=CaseSessionSummary(
+        caseId=session.caseId,
+        version=session.version,
+        sectionIds=list(session.sections),
+    ))
 
 
 @app.get("/")
@@ -75,6 +206,163 @@ async def root():
     return {"message": "Hello World"}
 
 
+@app.get("/metrics")
+async def get_metrics(container: ServiceContainer = Depends(get_container)):
+    """Return a snapshot of this worker's in-process metrics.
+
+    Returns:
+        dict: Counters, gauges and timing summaries, plus the health of each
+        Bedrock region.
+    """
+    return {**metrics.snapshot(), "bedrock_regions": container.region_pool.snapshot()}
+
+
+def require_debug_token(request: Request, container: ServiceContainer = Depends(get_container)):
+    """Allow the debug endpoints only with the configured ``X-Debug-Token``.
+
+    Raises:
+        HTTPException: 404 if ``DEBUG_TOKEN`` is not set, 403 if the header
+            does not match it.
+    """
+    token = container.settings.debug_token
+    if not token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not hmac.compare_digest(request.headers.get("x-debug-token", "").encode(), token.encode()):
+        raise HTTPException(status_code=403, detail="Invalid debug token")
+
+
+@app.get("/debug/loop/blocks", dependencies=[Depends(require_debug_token)])
+async def loop_blocks(container: ServiceContainer = Depends(get_container)):
+    """List the recent blocks of this worker's event loop.
+
+    Returns:
+        dict: For each block, the running task, how long the loop was stalled
+        when it was caught and in total, and the loop thread's stack.
+
+    Raises:
+        HTTPException: 404 if the monitor is disabled.
+    """
+    if container.loop_monitor is None:
+        raise HTTPException(status_code=404, detail="The event loop monitor is disabled")
+    return {"blocks": container.loop_monitor.reports()}
+
+
+@app.get("/debug/profile/cpu", dependencies=[Depends(require_debug_token)], response_class=PlainTextResponse)
+async def profile_cpu(
+        seconds: float = Query(10, gt=0, description="How long to sample; capped by PROFILE_MAX_SECONDS"),
+        interval_ms: float = Query(10, ge=1, le=1000, description="Milliseconds between samples"),
+        idle: bool = Query(False, description="Include threads blocked waiting for work"),
+        container: ServiceContainer = Depends(get_container),
+):
+    """Sample the CPU stacks of every thread in this worker.
+
+    Returns:
+        PlainTextResponse: Folded stacks (``thread;frame;...;frame count``),
+        the input format of flame-graph tools.
+
+    Raises:
+        HTTPException: 409 if a profile is already running.
+    """
+    try:
+        folded = await run_in_threadpool(container.profiler.profile, seconds, interval_ms / 1000, idle)
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(folded)
+
+
+@app.post("/debug/profile/memory/start", dependencies=[Depends(require_debug_token)])
+async def start_memory_profile(
+        frames: int = Query(1, ge=1, le=100, description="Stack frames kept per allocation"),
+        container: ServiceContainer = Depends(get_container),
+):
+    """Start tracing allocations in this worker and take the baseline snapshot.
+
+    Allocation is slower while tracing; stop it when done.
+    """
+    await run_in_threadpool(container.memory_tracer.start, frames)
+    return {"tracing": True, "frames": frames}
+
+
+@app.get("/debug/profile/memory", dependencies=[Depends(require_debug_token)])
+async def memory_profile(
+        limit: int = Query(25, ge=1, le=500, description="Allocation sites listed"),
+        group_by: str = Query("lineno", description=f"One of {', '.join(MEMORY_GROUPINGS)}"),
+        reset: bool = Query(False, description="Make this snapshot the new baseline"),
+        container: ServiceContainer = Depends(get_container),
+):
+    """Report the top allocation sites and the growth since the baseline.
+
+    Returns:
+        dict: Traced and peak bytes, the ``top`` sites and the ``diff``
+        against the baseline.
+
+    Raises:
+        HTTPException: 400 for an unknown grouping, 409 if tracing has not
+            been started.
+    """
+    if group_by not in MEMORY_GROUPINGS:
+        raise HTTPException(status_code=400, detail=f"Unknown grouping: {group_by}")
+    try:
+        return await run_in_threadpool(container.memory_tracer.report, limit, group_by, reset)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@app.post("/debug/profile/memory/stop", dependencies=[Depends(require_debug_token)])
+async def stop_memory_profile(container: ServiceContainer = Depends(get_container)):
+    """Stop tracing allocations and drop the traces."""
+    await run_in_threadpool(container.memory_tracer.stop)
+    return {"tracing": False}
+
+
+@app.get("/api/usage")
+async def get_usage(
+        project: Optional[str] = Query(None, description="Only this project (X-Project-Id)"),
+        operation: Optional[str] = Query(None, description="Only this operation (route path)"),
+        since: Optional[str] = Query(None, description="First UTC day included, YYYY-MM-DD"),
+        until: Optional[str] = Query(None, description="Last UTC day included, YYYY-MM-DD"),
+        group_by: str = Query(",".join(GROUP_COLUMNS), description="Comma-separated: day, project, operation, model"),
+        container: ServiceContainer = Depends(get_container),
+):
+    """Return Bedrock token usage recorded by the usage ledger.
+
+    Returns:
+        UsageResponse: Requests and input, output and cache tokens per group.
+    """
+    rows = await run_in_threadpool(
+        container.usage_ledger.query,
+        project=project,
+        operation=operation,
+        since=since,
+        until=until,
+        group_by=tuple(column.strip() for column in group_by.split(",")),
+    )
+    return UsageResponse(data=[
+        UsageRecord(
+            day=row.get("day"),
+            project=row.get("project"),
+            operation=row.get("operation"),
+            model=row.get("model"),
+            requests=row["requests"],
+            inputTokens=row["input_tokens"],
+            outputTokens=row["output_tokens"],
+            cacheReadTokens=row["cache_read_tokens"],
+            cacheWriteTokens=row["cache_write_tokens"],
+        )
+        for row in rows
+    ])
+
+
+@app.get("/api/usage/budgets")
+async def get_usage_budgets(container: ServiceContainer = Depends(get_container)):
+    """Return each project's token budget and its spend in the current period.
+
+    Returns:
+        BudgetResponse: Budget, spent and remaining tokens per project.
+    """
+    return BudgetResponse(data=[BudgetStatus(**status) for status in container.usage_ledger.budget_status()])
+
+
 @app.post("/user/auth/cognito/callback")
 async def cognito_auth_callback(request: Request):
     """Handle AWS Cognito auth callback.
@@ -101,11 +389,16 @@ async def cognito_auth_callback(request: Request):
 
 
 @app.post("/api/ai/policy-docs")
-async def policy_docs(request: PolicyDocsRequest):
+async def policy_docs(
+        request: PolicyDocsRequest,
+        container: ServiceContainer = Depends(get_container),
+        generation: GenerationRunner = Depends(get_generation),
+):
     """Determine whether referenced policy documents are known/accessible.
 
-    For each provided document title, asks the AI if it can reference and
-    provide a URL to the latest version.
+    Titles in the local policy catalogue are answered straight away; for the
+    others, asks the AI if it can reference and provide a URL to the latest
+    version.
 
     Args:
         request: Payload containing a list of document titles.
@@ -113,75 +406,313 @@ async def policy_docs(request: PolicyDocsRequest):
     Returns:
         PolicyDocsResponse: Per-document accessibility info.
     """
-    service = bedrock_prompt_service(aws_access_key_id=bedrock_key, aws_secret_access_key=bedrock_secret)
+    service = container.prompt_service(context=generation.context)
     policy_docs_response = []
     for doc in request.documents:
-        policy_docs_response.append(service.detect_file_knowledge(doc.title))
+        catalogued = service.catalogued_document(doc.title)
+        if catalogued is None:
+            catalogued = await generation.run(service.ask_file_knowledge, doc.title)
+        policy_docs_response.append(catalogued)
     return PolicyDocsResponse(message=policy_docs_response)
 
 
+@app.get("/api/ai/policy-docs/catalogue", response_model=PolicyCatalogueResponse)
+async def policy_docs_catalogue(container: ServiceContainer = Depends(get_container)):
+    """List the local policy document catalogue and the model answers awaiting promotion.
+
+    Raises:
+        HTTPException: 404 if the catalogue is disabled.
+    """
+    catalogue = require_catalogue(container)
+    return PolicyCatalogueResponse(
+        data=[PolicyCatalogueEntry(**asdict(entry)) for entry in catalogue.entries()],
+        candidates=[PolicyDocumentCandidate(title=title, url=url) for title, url in catalogue.candidates()],
+    )
+
+
+@app.post("/api/ai/policy-docs/catalogue", response_model=PolicyCatalogueEntry)
+async def promote_policy_doc(
+        request: PolicyDocumentPromotion,
+        container: ServiceContainer = Depends(get_container),
+):
+    """Add a document to the local policy catalogue.
+
+    Args:
+        request: The document's title and aliases, and its URL. Without a
+            URL, the URL the model gave for the title is promoted.
+
+    Returns:
+        PolicyCatalogueEntry: The catalogued document.
+
+    Raises:
+        HTTPException: 404 if the catalogue is disabled, or if no URL is given
+        and the model has not answered for the title.
+    """
+    catalogue = require_catalogue(container)
+    try:
+        entry = catalogue.promote(request.title, request.url, request.aliases)
+    except CandidateNotFoundError:
+        raise HTTPException(status_code=404, detail=f"No model answer to promote for: {request.title}")
+    return PolicyCatalogueEntry(**asdict(entry))
+
+
+def require_catalogue(container: ServiceContainer) -> PolicyCatalogue:
+    if container.policy_catalogue is None:
+        raise HTTPException(status_code=404, detail="The policy catalogue is disabled")
+    return container.policy_catalogue
+
+
 @app.post("/api/ai/create/strategic-case")
-async def strategic_case(request: StrategicCaseRequest):
+async def strategic_case(
+        request: StrategicCaseRequest,
+        mode: ResponseMode = Query(ResponseMode.LEGACY, description="Shape of the response body"),
+        container: ServiceContainer = Depends(get_container),
+        generation: GenerationRunner = Depends(get_generation),
+):
     """Generate the Strategic Case content via Bedrock.
 
     Args:
         request: Structured inputs for strategic case generation.
+        mode: ``legacy`` wraps the model's JSON as a string in ``data``;
+            ``structured`` returns the parsed sections; ``raw`` returns the
+            model's JSON as the response body. Every mode, ``raw`` included,
+            is sent once the whole case has been generated and repaired.
 
     Returns:
-        StrategicCaseResponse: AI-generated content wrapped in response model.
+        StrategicCaseResponse | StructuredStrategicCaseResponse | Response:
+        AI-generated content in the requested shape.
     """
-    service = bedrock_prompt_service(aws_access_key_id=bedrock_key, aws_secret_access_key=bedrock_secret)
-    response = service.generate_strategic_response(request)
+    service = container.prompt_service(context=generation.context)
+    response = await generation.run(service.generate_strategic_response, request)
+    if container.economic_prefetcher is not None:
+        container.economic_prefetcher.schedule(request, response, project=generation.context.project)
+    if mode == ResponseMode.RAW:
+        return Response(content=sanitise_json_string_response(response), media_type="application/json")
+    if mode == ResponseMode.STRUCTURED:
+        return parse_case_sections(
+            response, StrategicCaseSections, "strategic", StructuredStrategicCaseResponse,
+            output_mode=container.settings.structured_output,
+        )
     return StrategicCaseResponse(**dict(data=f"{response}"))
 
 
 @app.post("/api/ai/create/economic-case")
-async def economic_case(request: EconomicCaseRequest):
+async def economic_case(
+        request: EconomicCaseRequest,
+        mode: ResponseMode = Query(ResponseMode.LEGACY, description="Shape of the response body"),
+        container: ServiceContainer = Depends(get_container),
+        generation: GenerationRunner = Depends(get_generation),
+):
     """Generate the Economic Case content via Bedrock.
 
     Args:
         request: Structured inputs for economic case generation.
+        mode: ``legacy``, ``structured`` or ``raw``; see ``strategic_case``.
 
     Returns:
-        EconomicCaseResponse: AI-generated content wrapped in response model.
+        EconomicCaseResponse | StructuredEconomicCaseResponse | Response:
+        AI-generated content in the requested shape.
     """
-    service = bedrock_economic_prompt_service(aws_access_key_id=bedrock_key, aws_secret_access_key=bedrock_secret)
-    response = service.generate_economic_response(request)
+    response = None
+    if container.economic_prefetcher is not None:
+        response = await container.economic_prefetcher.take(request, generation)
+    if response is None:
+        service = container.economic_prompt_service(context=generation.context)
+        response = await generation.run(service.generate_economic_response, request)
+    if mode == ResponseMode.RAW:
+        return Response(content=sanitise_json_string_response(response), media_type="application/json")
+    if mode == ResponseMode.STRUCTURED:
+        return parse_case_sections(
+            response, EconomicCaseSections, "economic1", StructuredEconomicCaseResponse,
+            output_mode=container.settings.structured_output,
+        )
     return EconomicCaseResponse(**dict(data=f"{response}"))
 
 
 @app.post("/api/ai/create/section")
-async def generate_section(request: SectionGeneration):
+async def generate_section(
+        request: SectionGeneration,
+        container: ServiceContainer = Depends(get_container),
+        generation: GenerationRunner = Depends(get_generation),
+):
     """Generate a single section based on the provided configuration.
 
+    When ``caseId`` is set the stored case supplies the sections and
+    parameters, the request's sections are saved as changes, and the generated
+    section is stored under ``sectionId``.
+
     Args:
         request: Section generation inputs (section id, context, etc.).
 
     Returns:
         SectionGenerationResponse: AI-created section content.
     """
-    service = bedrock_prompt_service(aws_access_key_id=bedrock_key, aws_secret_access_key=bedrock_secret)
-    response = service.generate_section(request)
+    request = await resolve_section_case(request, container)
+    service = container.prompt_service(context=generation.context)
+    response = await generation.run(service.generate_section, request)
+
+    if request.caseId:
+        await run_in_threadpool(
+            container.case_store.update,
+            request.caseId,
+            [SectionModel(sectionID=request.sectionId, content=response.content)],
+        )
     return response
 
 
+@app.post("/api/ai/create/section/stream")
+async def generate_section_stream(
+        request: SectionGeneration,
+        container: ServiceContainer = Depends(get_container),
+        generation: GenerationRunner = Depends(get_generation),
+):
+    """Generate a single section progressively, as server-sent events.
+
+    A small model (``DRAFT_MODEL_ID``) streams an HTML draft as ``draft``
+    events while the configured model generates the section. The ``final``
+    event carries the section content, which replaces the draft; the draft is
+    cancelled if it is still running. ``done`` reports the time to first
+    useful content and to the final section. ``caseId`` is handled as by
+    ``/api/ai/create/section``.
+
+    Args:
+        request: Section generation inputs (section id, context, etc.).
+
+    Returns:
+        StreamingResponse: ``text/event-stream`` of ``draft`` events, then
+        ``final`` and ``done``, or ``error``.
+    """
+    request = await resolve_section_case(request, container)
+    # Checked up front so an exhausted budget is a 429, not an error event.
+    if generation.usage_ledger is not None:
+        generation.usage_ledger.check(generation.context.project)
+    settings = container.settings
+    service = container.prompt_service(context=generation.context)
+    draft_controller = container.ai_service(model_id=settings.draft_model_id) if settings.draft_model_id else None
+
+    async def events():
+        try:
+            async for event, data in progressive_section(
+                    generation, service, request, draft_controller, settings.draft_max_tokens,
+            ):
+                if event == FINAL and request.caseId:
+                    await run_in_threadpool(
+                        container.case_store.update,
+                        request.caseId,
+                        [SectionModel(sectionID=request.sectionId, content=data["content"])],
+                    )
+                yield sse_event(event, data)
+        except Exception as e:
+            yield sse_event("error", {"detail": str(e)})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+async def resolve_section_case(request: SectionGeneration, container: ServiceContainer) -> SectionGeneration:
+    """Fill in a section request's context from its stored case, if it has one.
+
+    The request's sections are saved as changes; the stored sections, less the
+    one being generated, become the context, and the stored parameters are
+    used unless the request has its own.
+
+    Raises:
+        HTTPException: 404 if the case is unknown.
+    """
+    if not request.caseId:
+        return request
+    try:
+        session, sections = await run_in_threadpool(
+            container.case_store.resolve_sections, request.caseId, request.sections,
+        )
+    except CaseNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Unknown case: {request.caseId}")
+    return request.model_copy(update=dict(
+        sections=[section for section in sections if section.sectionID != request.sectionId],
+        initialParams=request.initialParams or session.initialParams,
+    ))
+
+
 @app.post("/api/ai/update/section/additional")
-async def section_additional(request: PromptsRequestModel):
+async def section_additional(
+        request: PromptsRequestModel,
+        container: ServiceContainer = Depends(get_container),
+        generation: GenerationRunner = Depends(get_generation),
+):
     """Update an existing section with additional user-provided guidance.
 
+    When ``caseId`` is set, the stored sections are used as context and the
+    request only needs to carry changed sections.
+
     Args:
         request: Contains prior section text, prompts, and user query.
 
     Returns:
         PromptsResponseModel: Updated section text.
     """
-    service = bedrock_prompt_service(aws_access_key_id=bedrock_key, aws_secret_access_key=bedrock_secret)
-    response = service.generate_additional_content(request)
+    if request.caseId:
+        try:
+            _, sections = await run_in_threadpool(
+                container.case_store.resolve_sections, request.caseId, request.sections,
+            )
+        except CaseNotFoundError:
+            raise HTTPException(status_code=404, detail=f"Unknown case: {request.caseId}")
+        request = request.model_copy(update=dict(sections=sections))
+
+    service = container.prompt_service(context=generation.context)
+    response = await generation.run(service.generate_additional_content, request)
     return response
 
 
+@app.websocket("/api/ai/update/section/session")
+async def section_edit_session(websocket: WebSocket):
+    """Edit a section interactively over a WebSocket.
+
+    The server keeps the context sections and the conversation, so each turn
+    only sends the query; edits are streamed back as they are generated, and
+    a new query cancels the edit in flight. See ``services/editing.py`` for
+    the messages.
+
+    Args:
+        websocket: The editor's connection.
+    """
+    container = websocket.app.state.container
+    await EditSessionHandler(websocket, container, container.settings.edit_session_idle_seconds).serve()
+
+
+@app.get("/api/ai/update/section/cache")
+async def section_edit_cache(container: ServiceContainer = Depends(get_container)):
+    """Report on the near-duplicate cache of section edits.
+
+    Returns:
+        dict: Entries, lookups, hit rate, audit results (suspected false
+        matches) and the most recent hits with the queries they matched.
+
+    Raises:
+        HTTPException: 404 if the cache is disabled.
+    """
+    if container.edit_cache is None:
+        raise HTTPException(status_code=404, detail="The edit cache is disabled")
+    return container.edit_cache.report()
+
+
+@app.get("/api/ai/prompts")
+async def prompt_templates(container: ServiceContainer = Depends(get_container)):
+    """Report on the token cost of the prompt templates.
+
+    Returns:
+        dict: Estimated tokens of every route's fixed prompt against its
+        ``PROMPT_TOKEN_BUDGETS`` budget, section tokens before and after
+        compilation, and instruction lines repeated across templates.
+    """
+    return prompt_report(container.settings.prompt_token_budgets)
+
+
 @app.post("/api/ai/summarise")
-async def summarise_info(request: SupplementaryInfo):
+async def summarise_info(
+        request: SupplementaryInfo,
+        container: ServiceContainer = Depends(get_container),
+        generation: GenerationRunner = Depends(get_generation),
+):
     """Summarise supplementary information using Bedrock.
 
     Args:
@@ -190,43 +721,151 @@ async def summarise_info(request: SupplementaryInfo):
     Returns:
         SupplementaryInfoResponse: Summary of the provided information.
     """
-    service = bedrock_prompt_service(aws_access_key_id=bedrock_key, aws_secret_access_key=bedrock_secret)
-    response = service.generate_summary_response(request)
+    service = container.prompt_service(context=generation.context)
+    if service.needs_map_reduce(request):
+        summary = await service.summariser(generation).summarise(chunk_text(request.text))
+        return SupplementaryInfoResponse(data=summary)
+    response = await generation.run(service.generate_summary_response, request)
     return response
 
 
-@app.post("/api/ai/update/section/additional")
-async def section_additional(request: PromptsRequestModel):
-    """Update an existing section with additional user-provided guidance.
+@app.post("/api/ai/summarise/stream")
+async def summarise_stream(
+        request: Request,
+        container: ServiceContainer = Depends(get_container),
+        generation: GenerationRunner = Depends(get_generation),
+):
+    """Summarise a large text or HTML document streamed as the request body.
 
-    Duplicate of the earlier route kept for backward compatibility.
+    The body is read incrementally and split into paragraph-aligned chunks as
+    it arrives; each chunk is summarised in the background as soon as it is
+    complete, and the chunk summaries are reduced into the final summary.
+    Each model call is admitted by the scheduler and bounded by the deadline;
+    the calls are cancelled if the client disconnects or the upload fails.
 
     Args:
-        request: Contains prior section text, prompts, and user query.
+        request: Raw request whose body is the document (``text/plain`` or ``text/html``).
 
     Returns:
-        PromptsResponseModel: Updated section text.
+        SupplementaryInfoResponse: Summary of the document.
+
+    Raises:
+        HTTPException: 400 if the body is empty.
     """
-    service = bedrock_prompt_service(aws_access_key_id=bedrock_key, aws_secret_access_key=bedrock_secret)
-    response = service.generate_additional_content(request)
-    return response
+    summariser = container.prompt_service(context=generation.context).summariser(generation)
+    chunker = ParagraphChunker()
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    is_html = "html" in request.headers.get("content-type", "")
+    futures = []
 
+    def submit(chunks):
+        for chunk in chunks:
+            futures.append(summariser.submit(strip_html(chunk) if is_html else chunk))
 
-@app.post("/api/ai/summarise")
-async def summarise_info(request: SupplementaryInfo):
-    """Summarise supplementary information using Bedrock.
+    try:
+        with generation.reading_body():
+            async for body in request.stream():
+                submit(chunker.feed(decoder.decode(body)))
+        submit(chunker.feed(decoder.decode(b"", final=True)))
+        submit(chunker.finish())
 
-    Duplicate of the earlier route kept for backward compatibility.
+        if not futures:
+            raise HTTPException(status_code=400, detail="Empty document")
+        summary = await summariser.reduce(await summariser.gather(futures))
+    finally:
+        summariser.close()
+    return SupplementaryInfoResponse(data=summary)
+
+
+@app.get("/api/ai/results/{key}")
+async def get_result(key: str, request: Request, container: ServiceContainer = Depends(get_container)):
+    """Return the stored response of a generation made with an ``Idempotency-Key``.
+
+    Supports conditional requests: when ``If-None-Match`` matches the stored
+    ETag, 304 is returned without a body.
 
     Args:
-        request: Supplementary info payload.
+        key: The ``Idempotency-Key`` the generation was requested with.
+        request: Incoming request, read for ``If-None-Match``.
 
     Returns:
-        SupplementaryInfoResponse: Summary of the provided information.
+        Response: The stored response, 304, or 202 while the generation runs.
+
+    Raises:
+        HTTPException: 404 if no generation is known for the key.
     """
-    service = bedrock_prompt_service(aws_access_key_id=bedrock_key, aws_secret_access_key=bedrock_secret)
-    response = service.generate_summary_response(request)
-    return response
+    store = container.idempotency_store
+    stored = await run_in_threadpool(store.get, key)
+    if stored is None:
+        if await run_in_threadpool(store.is_pending, key):
+            return JSONResponse(status_code=202, content={"status": "pending"})
+        raise HTTPException(status_code=404, detail=f"Unknown result: {key}")
+
+    headers = {"ETag": stored.etag}
+    if_none_match = request.headers.get("if-none-match", "")
+    if stored.etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+    return Response(content=stored.body, status_code=stored.status, media_type=stored.content_type, headers=headers)
+
+
+@app.post("/api/cases")
+async def create_case(request: CaseSessionRequest, container: ServiceContainer = Depends(get_container)):
+    """Store a case so later requests can reference it by id.
+
+    Args:
+        request: Initial parameters and any sections generated so far.
+
+    Returns:
+        CaseSessionResponse: The new case id, version and stored section ids.
+    """
+    session = await run_in_threadpool(container.case_store.create, request.initialParams, request.sections)
+    return case_summary(session)
+
+
+@app.get("/api/cases/{case_id}")
+async def get_case(case_id: str, container: ServiceContainer = Depends(get_container)):
+    """Return a stored case with all of its sections.
+
+    Args:
+        case_id: The case identifier.
+
+    Returns:
+        CaseSession: The stored case.
+
+    Raises:
+        HTTPException: 404 if the case is unknown.
+    """
+    try:
+        return await run_in_threadpool(container.case_store.get, case_id)
+    except CaseNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Unknown case: {case_id}")
+
+
+@app.patch("/api/cases/{case_id}/sections")
+async def update_case_sections(
+        case_id: str,
+        request: CaseSectionsUpdate,
+        container: ServiceContainer = Depends(get_container),
+):
+    """Apply changed and removed sections to a stored case.
+
+    Args:
+        case_id: The case identifier.
+        request: Changed sections, removed section ids and optional new parameters.
+
+    Returns:
+        CaseSessionResponse: The case id, new version and stored section ids.
+
+    Raises:
+        HTTPException: 404 if the case is unknown.
+    """
+    try:
+        session = await run_in_threadpool(
+            container.case_store.update, case_id, request.sections, request.removed, request.initialParams,
+        )
+    except CaseNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Unknown case: {case_id}")
+    return case_summary(session)
 
 
 @app.post("/api/ai/mocked/create/strategic-case")
@@ -250,96 +889,183 @@ async def mocked_strategic_case(request: StrategicCaseRequest):
     return StrategicCaseResponse(**mocked)
 
 
+def bedrock_params(prompt: BedrockPrompt) -> dict:
+    """Messages API request body for a passthrough prompt."""
+    if prompt.messages:
+        messages = [message.model_dump() for message in prompt.messages]
+    else:
+        messages = [{"role": "user", "content": prompt.user_prompt}]
+    params = dict(anthropic_version="bedrock-2023-05-31", max_tokens=prompt.max_tokens, messages=messages)
+    if prompt.system_prompt:
+        params["system"] = prompt.system_prompt
+    for name in ("temperature", "top_p", "stop_sequences"):
+        value = getattr(prompt, name)
+        if value is not None:
+            params[name] = value
+    return params
+
+
+def require_prompt(prompt: BedrockPrompt):
+    if not prompt.user_prompt and not prompt.messages:
+        raise HTTPException(status_code=400, detail="Missing required parameter: user_prompt")
+
+
+def usage_of(context: GenerationContext) -> BedrockUsage:
+    return BedrockUsage(**asdict(Usage.combine(context.usage)))
+
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
 @app.post("/api/bedrock")
-async def invoke_bedrock(request: Request):
-    """Invoke AWS Bedrock with basic system and user prompt inputs.
+async def invoke_bedrock(
+        request: BedrockRequest,
+        container: ServiceContainer = Depends(get_container),
+        generation: GenerationRunner = Depends(get_generation),
+):
+    """Invoke AWS Bedrock with a prompt through the Messages API.
+
+    Runs on the shared controller, so region routing, deadlines, usage
+    accounting and budgets apply as for the other AI routes.
 
     Request body JSON fields:
-      - model_id (str): Optional Bedrock model ID; defaults to Claude if omitted.
+      - model_id (str): Optional Bedrock model ID; defaults to the configured model.
       - system_prompt (str): Optional system context.
-      - user_prompt (str): Required user prompt.
+      - user_prompt (str): The user prompt; or ``messages`` for a whole conversation.
+      - max_tokens, temperature, top_p, stop_sequences: Optional sampling parameters.
+      - stream (bool): Stream the completion as server-sent events.
 
     Returns:
-        dict: JSON payload with completion text and raw model response.
+        dict | StreamingResponse: JSON payload with the completion text and
+        the Messages API response, or an ``text/event-stream`` of ``delta``
+        events followed by ``done`` (with the usage) or ``error``.
 
     Raises:
         HTTPException: If required inputs are missing or invocation fails.
     """
+    require_prompt(request)
+    service = container.ai_service(model_id=request.model_id)
+    params = bedrock_params(request)
+    context = generation.context
+
+    if request.stream:
+        # Checked up front so an exhausted budget is a 429, not an error event.
+        if generation.usage_ledger is not None:
+            generation.usage_ledger.check(context.project)
+
+        async def events():
+            pieces = service.stream_response(
+                "", "", ignore_defaults_params=True, context=context, **params
+            )
+            finished = False
+            try:
+                async with generation.admit():
+                    while True:
+                        piece = await run_in_threadpool(next, pieces, None)
+                        if piece is None:
+                            break
+                        yield sse_event("delta", {"text": piece})
+                finished = True
+                yield sse_event("done", {"model": service.model_id, "usage": usage_of(context).model_dump()})
+            except Exception as e:
+                yield sse_event("error", {"detail": str(e)})
+            finally:
+                if not finished:
+                    # Reached early when the client disconnects; cancelling the
+                    # context ends the Bedrock stream.
+                    context.cancel()
+                    try:
+                        pieces.close()
+                    except ValueError:
+                        # Still running in the thread pool; it stops on the cancelled context.
+                        pass
+
+        return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
     try:
-        # Parse the request body
-        data = await request.json()
-
-        # Extract required parameters
-        model_id = data.get('model_id', 'anthropic.claude-v2')  # Default to Claude v2 if not specified
-        system_prompt = data.get('system_prompt', '')
-        user_prompt = data.get('user_prompt', '')
-
-        if not user_prompt:
-            raise HTTPException(status_code=400, detail="Missing required parameter: user_prompt")
-
-        # Prepare the prompt based on the model
-        if 'anthropic' in model_id:
-            # Anthropic models use a specific format
-            # For Claude, system instructions should be included at the beginning of the Human message
-            if system_prompt:
-                prompt = f"\n\nHuman: {system_prompt}\n\n{user_prompt}\n\nAssistant:"
-            else:
-                prompt = f"\n\nHuman: {user_prompt}\n\nAssistant:"
-
-            # Prepare the request body for Anthropic models via Bedrock
-            request_body = {
-                "prompt": prompt,
-                "max_tokens_to_sample": 2000,
-                "temperature": 0.7,
-                "top_p": 0.9,
-                "stop_sequences": ["\n\nHuman:"]
-            }
-        else:
-            # Generic format for other models
-            request_body = {
-                "system_prompt": system_prompt,
-                "prompt": user_prompt,
-                "max_tokens": 2000,
-                "temperature": 0.7,
-                "top_p": 0.9,
-            }
-
-        # Invoke the Bedrock model
-        response = bedrock.invoke_model(
-            modelId=model_id,
-            body=json.dumps(request_body)
+        completion = await generation.run(
+            service.generate_response, "", "", ignore_defaults_params=True, context=context, **params
         )
+    except (GenerationCancelled, BudgetExceeded):
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Bedrock invocation failed: {str(e)}")
 
-        # Parse the response
-        response_body = json.loads(response['body'].read())
-
-        # Extract the completion text based on the model type
-        if 'anthropic' in model_id:
-            completion_text = response_body.get('completion', '')
-        else:
-            # For other models, try to extract the generated text
-            # This may need to be adjusted based on the specific model's response format
-            completion_text = response_body.get(
-                'generated_text',
-                response_body.get(
-                    'text',
-                    response_body.get('output', str(response_body))
-                )
-            )
+    usage = usage_of(context).model_dump()
+    return {
+        "status": "success",
+        "model": service.model_id,
+        "response": {
+            "completion": completion,
+            "usage": usage,
+            "raw_response": {
+                "type": "message",
+                "role": "assistant",
+                "content": [{"type": "text", "text": completion}],
+                "usage": usage,
+            },
+        },
+    }
 
-        return {
-            "status": "success",
-            "model": model_id,
-            "response": {
-                "completion": completion_text,
-                "raw_response": response_body
-            }
-        }
 
-    except HTTPException as e:
-        raise e
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Bedrock invocation failed: {str(e)}")
+@app.post("/api/bedrock/batch")
+async def invoke_bedrock_batch(
+        request: BedrockBatchRequest,
+        container: ServiceContainer = Depends(get_container),
+        generation: GenerationRunner = Depends(get_generation),
+):
+    """Invoke AWS Bedrock with many prompts at once.
+
+    Prompts run concurrently, at most ``concurrency`` at a time (capped by
+    ``BEDROCK_BATCH_CONCURRENCY``), and each one is admitted by the scheduler
+    like a request of its own. A failed prompt is reported in its result
+    without failing the batch.
+
+    Args:
+        request: The prompts, an optional model ID and the concurrency.
+
+    Returns:
+        BedrockBatchResponse: One result per prompt, in request order, with
+        the completion or error and the token usage.
+
+    Raises:
+        HTTPException: 400 if the batch is too large or a prompt is empty.
+    """
+    settings = container.settings
+    if len(request.prompts) > settings.bedrock_batch_max_prompts:
+        raise HTTPException(
+            status_code=400,
+            detail=f"A batch may hold at most {settings.bedrock_batch_max_prompts} prompts",
+        )
+    for prompt in request.prompts:
+        require_prompt(prompt)
+
+    service = container.ai_service(model_id=request.model_id)
+    semaphore = asyncio.Semaphore(min(request.concurrency, settings.bedrock_batch_concurrency))
+    parent = generation.context
+
+    async def run_prompt(index: int, prompt: BedrockPrompt) -> BedrockBatchResult:
+        async with semaphore:
+            context = GenerationContext(parent.deadline, project=parent.project, operation=parent.operation)
+            unregister = parent.on_cancel(context.cancel)
+            try:
+                completion = await generation.run(
+                    service.generate_response, "", "", ignore_defaults_params=True, context=context,
+                    **bedrock_params(prompt)
+                )
+                return BedrockBatchResult(index=index, completion=completion, usage=usage_of(context))
+            except Exception as e:
+                if parent.cancelled:
+                    raise
+                metrics.incr("bedrock.batch_failures")
+                return BedrockBatchResult(index=index, error=str(e), usage=usage_of(context))
+            finally:
+                unregister()
+
+    results = await asyncio.gather(*(run_prompt(index, prompt) for index, prompt in enumerate(request.prompts)))
+    metrics.observe("bedrock.batch_size", len(results))
+    return BedrockBatchResponse(data=list(results))
 
 
 @app.get("/health-check")
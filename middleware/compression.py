@@ -0,0 +1,237 @@
+"""Response compression middleware (gzip, and brotli when installed).
+
+Unlike Starlette's ``GZipMiddleware`` this negotiates brotli as well as gzip
+and keeps streaming responses streaming: every chunk of a
+``text/event-stream`` response is compressed and flushed on its own, so an SSE
+event reaches the client as soon as it is produced. Small, already-encoded and
+non-text responses are passed through untouched.
+
+brotli comes from ``requirements.txt``; an install without the ``brotli``
+package offers gzip only.
+"""
+
+import time
+import zlib
+from typing import Optional
+
+from starlette.datastructures import Headers
+from starlette.datastructures import MutableHeaders
+
+from services.metrics import metrics
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+COMPRESSIBLE_TYPES = (
+    "text/",
+    "application/json",
+    "application/javascript",
+    "application/xml",
+    "application/problem+json",
+)
+
+
+class _GzipEncoder:
+    name = "gzip"
+
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class _BrotliEncoder:
+    name = "br"
+
+    def __init__(self, quality: int):
+        self._compressor = brotli.Compressor(mode=brotli.MODE_TEXT, quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+def negotiate_encoding(accept_encoding: str, available: tuple) -> Optional[str]:
+    """Pick the encoding with the highest client q-value from ``available``.
+
+    Ties are broken by the order of ``available`` (server preference).
+    """
+    preferences = {}
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        preferences[token] = quality
+
+    best, best_quality = None, 0.0
+    for encoding in available:
+        quality = preferences.get(encoding, preferences.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def is_compressible(content_type: str) -> bool:
+    content_type = content_type.lower()
+    return content_type.startswith(COMPRESSIBLE_TYPES) or "+json" in content_type
+
+
+class CompressionMiddleware:
+    """Negotiate and apply gzip/brotli compression to HTTP responses.
+
+    Args:
+        app: The wrapped ASGI application.
+        minimum_size: Complete responses smaller than this many bytes are sent
+            uncompressed.
+        gzip_level: zlib compression level (1-9).
+        brotli_quality: brotli quality (0-11); mid values suit dynamic content.
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 5):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.available = ("br", "gzip") if brotli is not None else ("gzip",)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""), self.available)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        responder = _CompressionResponder(self, encoding, send)
+        await self.app(scope, receive, responder.send)
+
+    def encoder(self, encoding: str):
+        if encoding == "br":
+            return _BrotliEncoder(self.brotli_quality)
+        return _GzipEncoder(self.gzip_level)
+
+
+class _CompressionResponder:
+    def __init__(self, middleware: CompressionMiddleware, encoding: str, send):
+        self.middleware = middleware
+        self.encoding = encoding
+        self._send = send
+        self.start_message = None
+        self.started = False
+        self.passthrough = False
+        self.flush_each_chunk = False
+        self.encoder = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cpu_seconds = 0.0
+
+    async def send(self, message):
+        if message["type"] == "http.response.start":
+            # Held back until the first body chunk shows whether to compress.
+            self.start_message = message
+            return
+        if message["type"] != "http.response.body":
+            await self._send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if not self.started:
+            self.started = True
+            await self._start(body, more_body)
+            return
+
+        if self.passthrough:
+            await self._send(message)
+            return
+        await self._send_chunk(body, more_body)
+
+    async def _start(self, body: bytes, more_body: bool):
+        headers = MutableHeaders(raw=self.start_message["headers"])
+        content_type = headers.get("content-type", "")
+
+        if "content-encoding" in headers or not is_compressible(content_type):
+            metrics.incr("compression.skipped", reason="not_compressible")
+            await self._pass_through(body, more_body)
+            return
+        if not more_body and len(body) < self.middleware.minimum_size:
+            metrics.incr("compression.skipped", reason="too_small")
+            await self._pass_through(body, more_body)
+            return
+
+        self.encoder = self.middleware.encoder(self.encoding)
+        self.flush_each_chunk = content_type.startswith("text/event-stream")
+        headers["Content-Encoding"] = self.encoding
+        headers.add_vary_header("Accept-Encoding")
+
+        if not more_body:
+            compressed = self._compress(body, finish=True)
+            headers["Content-Length"] = str(len(compressed))
+            await self._send(self.start_message)
+            await self._send({"type": "http.response.body", "body": compressed})
+            self._record()
+            return
+
+        if "content-length" in headers:
+            del headers["Content-Length"]
+        await self._send(self.start_message)
+        await self._send_chunk(body, more_body)
+
+    async def _pass_through(self, body: bytes, more_body: bool):
+        self.passthrough = True
+        await self._send(self.start_message)
+        await self._send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+    async def _send_chunk(self, body: bytes, more_body: bool):
+        data = self._compress(body, finish=not more_body)
+        # Empty chunks are only worth sending when they end the response.
+        if data or not more_body:
+            await self._send({"type": "http.response.body", "body": data, "more_body": more_body})
+        if not more_body:
+            self._record()
+
+    def _compress(self, body: bytes, finish: bool) -> bytes:
+        started = time.thread_time()
+        data = self.encoder.compress(body)
+        if finish:
+            data += self.encoder.finish()
+        elif self.flush_each_chunk:
+            data += self.encoder.flush()
+        self.cpu_seconds += time.thread_time() - started
+        self.bytes_in += len(body)
+        self.bytes_out += len(data)
+        return data
+
+    def _record(self):
+        metrics.incr("compression.responses", encoding=self.encoding)
+        metrics.incr("compression.bytes_in", self.bytes_in, encoding=self.encoding)
+        metrics.incr("compression.bytes_out", self.bytes_out, encoding=self.encoding)
+        metrics.incr("compression.cpu_seconds", self.cpu_seconds, encoding=self.encoding)
+        if self.bytes_out:
+            metrics.observe("compression.ratio", self.bytes_in / self.bytes_out, encoding=self.encoding)
@@ -0,0 +1,183 @@
+"""ASGI middleware implementing ``Idempotency-Key`` for generation routes.
+
+A request with an ``Idempotency-Key`` header to one of the generation routes
+is fingerprinted (method, path, query and body). The first request with a key
+runs normally and its response is stored. A retry with the same key either
+waits for the running generation or is answered from the store. It is marked
+with ``Idempotency-Replayed: true`` and never starts a second generation.
+Reusing a key for a different request is rejected with 422.
+
+Successful responses and 4xx errors are stored. 5xx responses are not, so a
+retry after a server error runs again. Neither are 429 (the project's budget
+is used up, which may no longer hold on retry) and 499 (the generation was
+cancelled).
+"""
+
+import asyncio
+import hashlib
+import json
+import time
+
+from fastapi.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.datastructures import MutableHeaders
+
+from services.idempotency import IdempotencyConflictError
+from services.idempotency import IdempotencyStore
+from services.idempotency import StoredResponse
+from services.metrics import metrics
+
+IDEMPOTENT_PREFIXES = ("/api/ai/create/", "/api/ai/update/")
+# Client errors that depend on the moment of the request, not on the request.
+TRANSIENT_STATUSES = frozenset({429, 499})
+HEADER = "idempotency-key"
+
+
+async def send_stored(send, stored: StoredResponse, key: str, replayed: bool):
+    headers = MutableHeaders()
+    headers["content-type"] = stored.content_type
+    headers["content-length"] = str(len(stored.body))
+    headers["etag"] = stored.etag
+    headers["idempotency-key"] = key
+    if replayed:
+        headers["idempotency-replayed"] = "true"
+    await send({"type": "http.response.start", "status": stored.status, "headers": headers.raw})
+    await send({"type": "http.response.body", "body": stored.body})
+
+
+async def send_json(send, status: int, payload: dict):
+    body = json.dumps(payload).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class IdempotencyMiddleware:
+    """Deduplicate retried generation requests by ``Idempotency-Key``.
+
+    Args:
+        app: The wrapped ASGI application.
+        wait_timeout: Seconds a retry waits for a generation running in
+            another worker before giving up with 409.
+    """
+
+    def __init__(self, app, wait_timeout: float = 600):
+        self.app = app
+        self.wait_timeout = wait_timeout
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or not scope["path"].startswith(IDEMPOTENT_PREFIXES):
+            await self.app(scope, receive, send)
+            return
+        key = Headers(scope=scope).get(HEADER)
+        if not key:
+            await self.app(scope, receive, send)
+            return
+
+        store: IdempotencyStore = scope["app"].state.container.idempotency_store
+        messages, body = await self._read_body(receive)
+        fingerprint = hashlib.sha256(
+            b"\0".join([scope["method"].encode(), scope["path"].encode(), scope.get("query_string", b""), body])
+        ).hexdigest()
+
+        # A retry woken by an abandoned generation goes round again and claims it.
+        while True:
+            try:
+                state, value = await store.begin(key, fingerprint)
+            except IdempotencyConflictError:
+                await send_json(send, 422, {"detail": "Idempotency-Key was already used for a different request"})
+                return
+
+            if state == store.DONE:
+                metrics.incr("idempotency.duplicates_avoided", source="stored")
+                await send_stored(send, value, key, replayed=True)
+                return
+            if state == store.IN_FLIGHT:
+                stored = await value
+                if stored is None:
+                    continue
+                metrics.incr("idempotency.duplicates_avoided", source="in_flight")
+                await send_stored(send, stored, key, replayed=True)
+                return
+            if state == store.PENDING_ELSEWHERE:
+                stored = await store.wait_elsewhere(key, self.wait_timeout)
+                if stored is None:
+                    if await run_in_threadpool(store.is_pending, key):
+                        await send_json(send, 409, {"detail": "A request with this Idempotency-Key is still running"})
+                        return
+                    continue
+                metrics.incr("idempotency.duplicates_avoided", source="other_worker")
+                await send_stored(send, stored, key, replayed=True)
+                return
+            break
+
+        await self._run(scope, receive, messages, send, store, key, fingerprint)
+
+    @staticmethod
+    async def _renew(store: IdempotencyStore, key: str):
+        """Renew the shared claim on ``key`` while the generation runs."""
+        while True:
+            await asyncio.sleep(store.lease_seconds / 3)
+            await run_in_threadpool(store.renew, key)
+
+    @staticmethod
+    async def _read_body(receive):
+        messages, chunks = [], []
+        while True:
+            message = await receive()
+            messages.append(message)
+            if message["type"] != "http.request":
+                break
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+        return messages, b"".join(chunks)
+
+    async def _run(self, scope, receive, messages, send, store: IdempotencyStore, key: str, fingerprint: str):
+        pending = list(messages)
+
+        async def replay_receive():
+            # Hand the buffered body to the app, then fall through to the real
+            # receive so client disconnects are still observed.
+            if pending:
+                return pending.pop(0)
+            return await receive()
+
+        start = {}
+        chunks = []
+        completed = False
+
+        async def capture_send(message):
+            nonlocal completed
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message)["idempotency-key"] = key
+                start.update(message)
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+                completed = not message.get("more_body", False)
+            await send(message)
+
+        renewal = asyncio.ensure_future(self._renew(store, key)) if store.shared else None
+        try:
+            await self.app(scope, replay_receive, capture_send)
+        except BaseException:
+            await store.abandon(key)
+            raise
+        finally:
+            if renewal is not None:
+                renewal.cancel()
+
+        status = start.get("status", 500)
+        if not completed or status >= 500 or status in TRANSIENT_STATUSES:
+            await store.abandon(key)
+            return
+        await store.complete(key, StoredResponse(
+            status=status,
+            content_type=Headers(raw=start["headers"]).get("content-type", "application/octet-stream"),
+            body=b"".join(chunks),
+            fingerprint=fingerprint,
+            created=time.time(),
+        ))
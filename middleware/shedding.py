@@ -0,0 +1,47 @@
+"""ASGI middleware answering shed generation requests before they are read.
+
+A request to a generation route (one with a scheduler priority) whose
+priority class is overloaded is answered with 503 and ``Retry-After``
+without reading its body or validating it. Other routes, such as ``/``, the
+mocked case, ``/metrics``, ``/health-check`` and case storage, are never shed.
+
+It runs inside :class:`~middleware.idempotency.IdempotencyMiddleware`, so a
+retry with an ``Idempotency-Key`` whose generation is already running or
+stored is answered from it and never shed. The claim of a shed request is
+released, because 503 responses are not stored.
+"""
+
+import json
+
+from services.metrics import metrics
+from services.scheduler import OPERATION_PRIORITIES
+
+
+class LoadSheddingMiddleware:
+    """Shed generation requests the scheduler's load shedder rejects."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        priority = OPERATION_PRIORITIES.get(scope["path"]) if scope["type"] == "http" else None
+        if priority is None:
+            await self.app(scope, receive, send)
+            return
+        shed = scope["app"].state.container.scheduler.check(priority)
+        if shed is None:
+            await self.app(scope, receive, send)
+            return
+
+        metrics.incr("http.shed", path=scope["path"])
+        body = json.dumps({"detail": str(shed)}).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(shed.retry_after).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
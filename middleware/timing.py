@@ -0,0 +1,42 @@
+"""ASGI middleware recording request latency.
+
+Every request's duration is observed per route template; the very first
+request a worker serves is additionally recorded on its own so that
+first-request latency after a (re)start can be compared with steady state.
+"""
+
+import time
+
+from services.metrics import metrics
+
+
+class RequestTimingMiddleware:
+    """Observe ``http.request_seconds`` and ``http.first_request_seconds``."""
+
+    def __init__(self, app):
+        self.app = app
+        self._first_request_pending = True
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            metrics.observe("http.request_seconds", elapsed, path=path, status=status["code"])
+            if self._first_request_pending:
+                self._first_request_pending = False
+                metrics.gauge("http.first_request_seconds", elapsed, path=path)
@@ -1,5 +1,6 @@
 from datetime import datetime
 from datetime import timezone
+from enum import Enum
 from typing import Generic
 from typing import Optional
 from typing import TypeVar
@@ -13,4 +14,10 @@ class ResponseModel(BaseModel, Generic[T]):
     status: str = "success"  # or "error"
     message: Optional[str] = None
     data: Optional[T] = None
-    date: Optional[datetime] = datetime.now(tz=timezone.utc)
\ No newline at end of file
+    date: Optional[datetime] = datetime.now(tz=timezone.utc)
+
+
+class ResponseMode(str, Enum):
+    LEGACY = "legacy"  # model output as a JSON string inside ``data``
+    STRUCTURED = "structured"  # model output parsed into typed objects
+    RAW = "raw"  # model output passed through as the response body
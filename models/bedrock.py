@@ -0,0 +1,60 @@
+from typing import List
+from typing import Literal
+from typing import Optional
+
+from pydantic import BaseModel
+from pydantic import ConfigDict
+from pydantic import Field
+
+from models.base import ResponseModel
+
+
+class BedrockMessage(BaseModel):
+    role: Literal["user", "assistant"]
+    content: str
+
+
+class BedrockPrompt(BaseModel):
+    system_prompt: str = Field("", description="Optional system context")
+    user_prompt: Optional[str] = Field(None, description="The user prompt; required unless messages are given")
+    messages: Optional[List[BedrockMessage]] = Field(
+        None,
+        description="Full conversation in Messages API form; takes precedence over user_prompt",
+    )
+    max_tokens: int = Field(2000, gt=0)
+    temperature: Optional[float] = Field(0.7, ge=0, le=1)
+    top_p: Optional[float] = Field(None, ge=0, le=1)
+    stop_sequences: Optional[List[str]] = None
+
+
+class BedrockRequest(BedrockPrompt):
+    model_config = ConfigDict(protected_namespaces=())
+
+    model_id: Optional[str] = Field(None, description="Bedrock model ID; defaults to the configured model")
+    stream: bool = Field(False, description="Stream the completion as server-sent events")
+
+
+class BedrockBatchRequest(BaseModel):
+    model_config = ConfigDict(protected_namespaces=())
+
+    model_id: Optional[str] = Field(None, description="Bedrock model ID; defaults to the configured model")
+    prompts: List[BedrockPrompt] = Field(min_length=1)
+    concurrency: int = Field(4, gt=0, description="Prompts run at once; capped by BEDROCK_BATCH_CONCURRENCY")
+
+
+class BedrockUsage(BaseModel):
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cache_read_input_tokens: int = 0
+    cache_creation_input_tokens: int = 0
+
+
+class BedrockBatchResult(BaseModel):
+    index: int = Field(description="Position of the prompt in the request")
+    completion: Optional[str] = None
+    usage: BedrockUsage = Field(default_factory=BedrockUsage)
+    error: Optional[str] = Field(None, description="Why the prompt failed; the other prompts are unaffected")
+
+
+class BedrockBatchResponse(ResponseModel[List[BedrockBatchResult]]):
+    pass
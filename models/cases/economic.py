@@ -6,6 +6,7 @@ from pydantic import BaseModel
 from pydantic import Field
 
 from models.base import ResponseModel
+from models.cases.section import CaseSection
 from models.cases.supplementary import SupplementaryInfo
 
 
@@ -62,3 +63,13 @@ class EconomicCaseResponse(ResponseModel):
 
 class EconomicCaseRequest(BaseModel):
     document: EconomicCase
+
+
+class EconomicCaseSections(BaseModel):
+    economic1: List[CaseSection]
+
+
+class StructuredEconomicCaseResponse(ResponseModel[List[CaseSection]]):
+    doc_type: str = Field(
+        default="Economic Case",
+    )
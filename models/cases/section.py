@@ -1,3 +1,5 @@
+from typing import Optional
+
 from pydantic import BaseModel
 from pydantic import Field
 
@@ -10,7 +12,14 @@ class SectionGeneration(BaseModel):
         example="1-1",
     )
 
+    caseId: Optional[str] = Field(
+        None,
+        description="Identifier of a stored case. When set, `sections` only needs to contain changed sections "
+                    "and `initialParams` may be omitted.",
+    )
+
     sections: list[SectionModel] = Field(
+        default_factory=list,
         description="The list of sections that the new section should be based on",
         example="""
         [
@@ -23,6 +32,7 @@ class SectionGeneration(BaseModel):
     )
 
     initialParams: str = Field(
+        default_factory=str,
         description="The parameters laid out at the beginning of section generation. Should be a stringified JSON object.",
         example="""
         {
@@ -44,4 +54,23 @@ class SectionGenerationResponse(BaseModel):
     )
 
 class SectionGenerationRequest(BaseModel):
-    document: SectionGeneration
\ No newline at end of file
+    document: SectionGeneration
+
+
+class CaseSection(BaseModel):
+    id: str = Field(
+        description="The unique identifier of the section in X-Y format",
+        examples=["1-1"],
+    )
+    name: str = Field(
+        description="The numbered title of the section",
+        examples=["1.1 Strategic Context"],
+    )
+    description: Optional[str] = Field(
+        None,
+        description="The guidance the section was generated from",
+    )
+    body: str = Field(
+        default_factory=str,
+        description="The generated section content as an HTML snippet",
+    )
@@ -0,0 +1,60 @@
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from pydantic import BaseModel
+from pydantic import Field
+
+from models.base import ResponseModel
+from models.section import SectionModel
+
+
+class CaseSession(BaseModel):
+    caseId: str = Field(
+        description="The identifier of the stored case",
+    )
+    initialParams: str = Field(
+        default_factory=str,
+        description="The parameters laid out at the beginning of section generation. Should be a stringified JSON object.",
+    )
+    sections: Dict[str, str] = Field(
+        default_factory=dict,
+        description="Section contents keyed by section id",
+    )
+    version: int = Field(
+        default=1,
+        description="Incremented on every update of the stored case",
+    )
+
+
+class CaseSessionRequest(BaseModel):
+    initialParams: str = Field(
+        default_factory=str,
+        description="The parameters laid out at the beginning of section generation. Should be a stringified JSON object.",
+    )
+    sections: List[SectionModel] = Field(default_factory=list)
+
+
+class CaseSectionsUpdate(BaseModel):
+    initialParams: Optional[str] = Field(
+        None,
+        description="Replacement parameters; omit to keep the stored ones",
+    )
+    sections: List[SectionModel] = Field(
+        default_factory=list,
+        description="Only the sections that changed since the last update",
+    )
+    removed: List[str] = Field(
+        default_factory=list,
+        description="Ids of sections to drop from the stored case",
+    )
+
+
+class CaseSessionSummary(BaseModel):
+    caseId: str
+    version: int
+    sectionIds: List[str]
+
+
+class CaseSessionResponse(ResponseModel[CaseSessionSummary]):
+    pass
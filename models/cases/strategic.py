@@ -6,6 +6,7 @@ from pydantic import BaseModel
 from pydantic import Field
 
 from models.base import ResponseModel
+from models.cases.section import CaseSection
 from models.cases.supplementary import SupplementaryInfo
 
 
@@ -67,4 +68,14 @@ class StrategicCaseRequest(BaseModel):
 class StrategicCaseResponse(ResponseModel):
     doc_type: str = Field(
         default="Business Case",
-    )
\ No newline at end of file
+    )
+
+
+class StrategicCaseSections(BaseModel):
+    strategic: List[CaseSection]
+
+
+class StructuredStrategicCaseResponse(ResponseModel[List[CaseSection]]):
+    doc_type: str = Field(
+        default="Business Case",
+    )
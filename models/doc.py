@@ -2,6 +2,7 @@ from typing import List
 from typing import Optional
 
 from pydantic import BaseModel
+from pydantic import Field
 
 from models.base import ResponseModel
 
@@ -10,6 +11,17 @@ class PolicyDocument(BaseModel):
     title: str
 
 
+class PolicyDocumentKnowledge(BaseModel):
+    accessible: bool = Field(
+        False,
+        description="Whether the document is known and can be referenced",
+    )
+    url: Optional[str] = Field(
+        None,
+        description="URL of the latest version of the document",
+    )
+
+
 class PolicyDocumentResponse(ResponseModel):
     accessible: bool
     url: Optional[str] = None
@@ -21,4 +33,29 @@ class PolicyDocsRequest(BaseModel):
 
 
 class PolicyDocsResponse(ResponseModel):
-    message: List[PolicyDocumentResponse]
\ No newline at end of file
+    message: List[PolicyDocumentResponse]
+
+
+class PolicyCatalogueEntry(BaseModel):
+    title: str
+    url: str
+    aliases: List[str] = Field(default_factory=list, description="Other titles the document is requested by")
+    source: str = Field(description="builtin, or promoted from a model answer")
+
+
+class PolicyDocumentCandidate(BaseModel):
+    title: str
+    url: str = Field(description="URL the model gave for the title")
+
+
+class PolicyDocumentPromotion(BaseModel):
+    title: str
+    url: Optional[str] = Field(None, description="Canonical URL; defaults to the URL the model gave for the title")
+    aliases: List[str] = Field(default_factory=list)
+
+
+class PolicyCatalogueResponse(ResponseModel[List[PolicyCatalogueEntry]]):
+    candidates: List[PolicyDocumentCandidate] = Field(
+        default_factory=list,
+        description="Model answers for uncatalogued titles, awaiting promotion",
+    )
@@ -1,6 +1,9 @@
 from enum import Enum
+from typing import Annotated
 from typing import List
+from typing import Literal
 from typing import Optional
+from typing import Union
 
 from pydantic import BaseModel
 from pydantic import Field
@@ -23,10 +26,49 @@ class SectionPromptsModel(BaseModel):
     )
 
 class PromptsRequestModel(BaseModel):
+    caseId: Optional[str] = Field(
+        None,
+        description="Identifier of a stored case. When set, `sections` only needs to contain changed sections, "
+                    "with the section being edited first.",
+    )
     sections: List[SectionModel] = Field(default_factory=list)
     prompts: List[SectionPromptsModel] = Field(default_factory=list)
     originalText: str
     userQuery: str
 
 class PromptsResponseModel(ResponseModel):
-    response: str = Field(default_factory=str)
\ No newline at end of file
+    response: str = Field(default_factory=str)
+
+class EditSessionStart(BaseModel):
+    type: Literal["start"]
+    caseId: Optional[str] = Field(
+        None,
+        description="Identifier of a stored case. When set, `sections` only needs to contain changed sections, "
+                    "with the section being edited first.",
+    )
+    sections: List[SectionModel] = Field(default_factory=list)
+    prompts: List[SectionPromptsModel] = Field(
+        default_factory=list,
+        description="Earlier turns of the conversation, to resume it",
+    )
+    originalText: str
+
+
+class EditSessionEdit(BaseModel):
+    type: Literal["edit"]
+    userQuery: str
+    originalText: Optional[str] = Field(
+        None,
+        description="New text to edit, e.g. once a rewrite is accepted; the previous text is kept when omitted",
+    )
+    sections: List[SectionModel] = Field(default_factory=list, description="Context sections that changed")
+
+
+class EditSessionCancel(BaseModel):
+    type: Literal["cancel"]
+
+
+EditSessionMessage = Annotated[
+    Union[EditSessionStart, EditSessionEdit, EditSessionCancel],
+    Field(discriminator="type"),
+]
@@ -0,0 +1,35 @@
+from typing import List
+from typing import Optional
+
+from pydantic import BaseModel
+from pydantic import Field
+
+from models.base import ResponseModel
+
+
+class UsageRecord(BaseModel):
+    day: Optional[str] = Field(None, description="UTC date (YYYY-MM-DD); omitted when not grouped by day")
+    project: Optional[str] = None
+    operation: Optional[str] = None
+    model: Optional[str] = None
+    requests: int = Field(0, description="Bedrock calls made")
+    inputTokens: int = 0
+    outputTokens: int = 0
+    cacheReadTokens: int = 0
+    cacheWriteTokens: int = 0
+
+
+class BudgetStatus(BaseModel):
+    project: str
+    period: str = Field(description="The budget period the spend is counted in, e.g. 2026-10")
+    budget: Optional[int] = Field(None, description="Token budget; null when the project is unlimited")
+    spent: int
+    remaining: Optional[int] = None
+
+
+class UsageResponse(ResponseModel[List[UsageRecord]]):
+    pass
+
+
+class BudgetResponse(ResponseModel[List[BudgetStatus]]):
+    pass
@@ -7,17 +7,38 @@ standard AWS provider chain.
 """
 
 from controllers.ai.base import BaseAIController
+from controllers.ai.context import GenerationContext
 from controllers.ai.bedrock import AWSBedrockService
+from services.catalogue import PolicyCatalogue
 from services.prompt.manager import PromptManager as BedrockPromptManager
 from services.prompt.economic import EconomicPromptManager
+from services.prompt.similarity import EditCache
+from services.settings import Settings
 
-def get_ai_service(provider: str, aws_access_key_id: str = None, aws_secret_access_key: str = None) -> BaseAIController:
+def get_ai_service(
+        provider: str,
+        aws_access_key_id: str = None,
+        aws_secret_access_key: str = None,
+        client=None,
+        region_name: str = None,
+        model_id: str = None,
+        region_pool=None,
+        usage_ledger=None,
+        **client_options,
+) -> BaseAIController:
     """Create a concrete AI controller for the specified provider.
 
     Args:
         provider: The AI provider identifier, currently only "bedrock".
         aws_access_key_id: Optional explicit AWS access key ID.
         aws_secret_access_key: Optional explicit AWS secret access key.
+        client: Optional pre-built provider client to reuse across requests.
+        region_name: Optional region override.
+        model_id: Optional model override.
+        region_pool: Optional RegionPool spreading calls across regions.
+        usage_ledger: Optional UsageLedger recording token usage and enforcing budgets.
+        **client_options: Timeout, retry and pool options overriding the
+            controller defaults (see ``AWSBedrockService``).
 
     Returns:
         BaseAIController: A controller capable of generating AI responses.
@@ -27,42 +48,84 @@ def get_ai_service(provider: str, aws_access_key_id: str = None, aws_secret_acce
     """
     if provider == "bedrock":
         config = dict(
-            region_name="eu-west-2",
-            model_id="anthropic.claude-3-7-sonnet-20250219-v1:0",  # 20240229 (3) #20250219 (3-7)
+            region_name=region_name or "eu-west-2",
+            model_id=model_id or "anthropic.claude-3-7-sonnet-20250219-v1:0",  # 20240229 (3) #20250219 (3-7)
             read_timeout=280,  # Increase read timeout to 280 seconds
-            connect_timeout=10  # Optional: time to establish connection
+            connect_timeout=10,  # Optional: time to establish connection
         )
+        config.update(client_options)
 
         # Add API key credentials if provided
         if aws_access_key_id and aws_secret_access_key:
             config["aws_access_key_id"] = aws_access_key_id
             config["aws_secret_access_key"] = aws_secret_access_key
 
+        if client is not None:
+            config["client"] = client
+
+        if region_pool is not None:
+            config["region_pool"] = region_pool
+
+        if usage_ledger is not None:
+            config["usage_ledger"] = usage_ledger
+
         return AWSBedrockService(config=config)
     else:
         raise ValueError("Unknown provider: {}".format(provider))
 
 
-def bedrock_prompt_service(aws_access_key_id: str = None, aws_secret_access_key: str = None):
+def bedrock_prompt_service(
+        aws_access_key_id: str = None,
+        aws_secret_access_key: str = None,
+        settings: Settings = None,
+        context: GenerationContext = None,
+        edit_cache: EditCache = None,
+        policy_catalogue: PolicyCatalogue = None,
+        **kwargs
+):
     """Construct a PromptManager backed by AWS Bedrock.
 
     Args:
         aws_access_key_id: Optional explicit AWS access key ID.
         aws_secret_access_key: Optional explicit AWS secret access key.
+        settings: Optional worker settings; defaults are used when omitted.
+        context: Optional per-request context used to cancel generations.
+        edit_cache: Optional near-duplicate cache of section edits.
+        policy_catalogue: Optional local catalogue of known policy documents.
+        **kwargs: Extra controller options forwarded to ``get_ai_service``.
 
     Returns:
         PromptManager: High-level helper for prompt-based operations.
     """
-    return BedrockPromptManager(get_ai_service("bedrock", aws_access_key_id, aws_secret_access_key))
+    return BedrockPromptManager(
+        get_ai_service("bedrock", aws_access_key_id, aws_secret_access_key, **kwargs),
+        settings=settings,
+        context=context,
+        edit_cache=edit_cache,
+        policy_catalogue=policy_catalogue,
+    )
 
-def bedrock_economic_prompt_service(aws_access_key_id: str = None, aws_secret_access_key: str = None):
+def bedrock_economic_prompt_service(
+        aws_access_key_id: str = None,
+        aws_secret_access_key: str = None,
+        settings: Settings = None,
+        context: GenerationContext = None,
+        **kwargs
+):
     """Construct an EconomicPromptManager backed by AWS Bedrock.
 
     Args:
         aws_access_key_id: Optional explicit AWS access key ID.
         aws_secret_access_key: Optional explicit AWS secret access key.
+        settings: Optional worker settings; defaults are used when omitted.
+        context: Optional per-request context used to cancel generations.
+        **kwargs: Extra controller options forwarded to ``get_ai_service``.
 
     Returns:
         EconomicPromptManager: Helper dedicated to economic case prompts.
     """
-    return EconomicPromptManager(get_ai_service("bedrock", aws_access_key_id, aws_secret_access_key))
\ No newline at end of file
+    return EconomicPromptManager(
+        get_ai_service("bedrock", aws_access_key_id, aws_secret_access_key, **kwargs),
+        settings=settings,
+        context=context,
+    )
\ No newline at end of file
@@ -0,0 +1,332 @@
+"""Local catalogue of well-known policy documents.
+
+Most titles sent to ``/api/ai/policy-docs`` name one of a handful of UK
+government frameworks. :class:`PolicyCatalogue` answers those from a local
+list of documents (title, aliases and canonical URL) before any model call.
+
+Titles are normalised (lowercased, punctuation, possessives, edition years
+and a leading "the" dropped, "&" spelled out) and looked up exactly among
+every title and alias, then fuzzily: an inverted index from character
+trigrams to names yields the names sharing one of the query's rarest
+trigrams, which are scored by the Dice coefficient of their trigram sets.
+The best name scoring at least ``threshold`` matches. A name that shares
+none of the rarest trigrams cannot reach the threshold, so few names are
+scored and a lookup stays well under a millisecond with thousands of
+entries.
+
+A fuzzy match only corrects spelling, so the name must have as many words
+as the title. A title with words added, such as an annex or a chapter of a
+catalogued document, names a different document and is left to the model:
+
+>>> catalogue = PolicyCatalogue()
+>>> catalogue.lookup("Managing public mony").entry.title
+'Managing Public Money'
+>>> catalogue.lookup("Managing public money annex 4.7") is None
+True
+
+URLs the model gives for unmatched titles are remembered as candidates.
+Promoting a candidate, or adding a document directly, puts it in the
+catalogue; with ``path`` set, promoted documents are kept in SQLite and
+picked up by the other workers on the host.
+"""
+
+import json
+import math
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict
+from typing import FrozenSet
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+from services.cache import LRUCache
+from services.metrics import metrics
+
+BUILTIN = "builtin"
+PROMOTED = "promoted"
+
+WORD_RE = re.compile(r"[a-z0-9]+")
+POSSESSIVE_RE = re.compile(r"['\u2019]s\b")
+# A year names an edition of a document, not a different one.
+YEAR_RE = re.compile(r"(?:19|20)[0-9]{2}")
+
+_UNMATCHED = object()
+
+
+@dataclass(frozen=True)
+class PolicyEntry:
+    title: str
+    url: str
+    aliases: Tuple[str, ...] = ()
+    source: str = BUILTIN
+
+
+@dataclass(frozen=True)
+class CatalogueMatch:
+    entry: PolicyEntry
+    matched: str
+    score: float
+
+
+BUILTIN_DOCUMENTS = (
+    PolicyEntry(
+        "The Green Book: appraisal and evaluation in central government",
+        "https://www.gov.uk/government/publications/the-green-book-appraisal-and-evaluation-in-central-government",
+        ("Green Book", "HM Treasury Green Book", "Green Book guidance", "Green Book appraisal and evaluation"),
+    ),
+    PolicyEntry(
+        "The Magenta Book: central government guidance on evaluation",
+        "https://www.gov.uk/government/publications/the-magenta-book",
+        ("Magenta Book", "HM Treasury Magenta Book", "Magenta Book evaluation guidance"),
+    ),
+    PolicyEntry(
+        "The Aqua Book: guidance on producing quality analysis for government",
+        "https://www.gov.uk/government/publications/the-aqua-book-guidance-on-producing-quality-analysis-for-government",
+        ("Aqua Book", "HM Treasury Aqua Book"),
+    ),
+    PolicyEntry(
+        "The Orange Book: management of risk - principles and concepts",
+        "https://www.gov.uk/government/publications/orange-book",
+        ("Orange Book", "HM Treasury Orange Book", "Orange Book management of risk"),
+    ),
+    PolicyEntry(
+        "Net Zero Strategy: Build Back Greener",
+        "https://www.gov.uk/government/publications/net-zero-strategy",
+        ("Net Zero Strategy", "UK Net Zero Strategy", "Build Back Greener"),
+    ),
+    PolicyEntry(
+        "A Green Future: Our 25 Year Plan to Improve the Environment",
+        "https://www.gov.uk/government/publications/25-year-environment-plan",
+        ("25 Year Environment Plan", "25 Year Plan", "25 Year Plan to Improve the Environment", "A Green Future"),
+    ),
+    PolicyEntry(
+        "Transport Analysis Guidance (TAG)",
+        "https://www.gov.uk/guidance/transport-analysis-guidance-tag",
+        ("TAG", "WebTAG", "Transport Analysis Guidance", "DfT Transport Analysis Guidance"),
+    ),
+    PolicyEntry(
+        "Managing Public Money",
+        "https://www.gov.uk/government/publications/managing-public-money",
+        ("HM Treasury Managing Public Money", "MPM"),
+    ),
+)
+
+
+class CandidateNotFoundError(KeyError):
+    """Raised when a title to promote has no remembered URL."""
+
+
+def normalise_title(title: str) -> str:
+    """Lowercase ``title`` and reduce it to its words, without possessives,
+    edition years or a leading "the"."""
+    text = POSSESSIVE_RE.sub("", (title or "").lower().replace("&", " and "))
+    words = WORD_RE.findall(text)
+    words = [word for word in words if not YEAR_RE.fullmatch(word)] or words
+    if words and words[0] == "the" and len(words) > 1:
+        words = words[1:]
+    return " ".join(words)
+
+
+def trigrams(text: str) -> FrozenSet[str]:
+    """Character trigrams of ``text``, padded so word starts count."""
+    padded = f"  {text} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+class PolicyCatalogue:
+    """Trigram-indexed catalogue of policy documents.
+
+    Args:
+        documents: The documents the catalogue starts with.
+        threshold: Minimum trigram similarity of a fuzzy match.
+        path: Optional SQLite database of promoted documents, shared by the
+            workers on a host.
+        max_candidates: Model answers kept for promotion.
+        max_matches: Recent lookup results kept.
+    """
+
+    def __init__(
+            self,
+            documents: Iterable[PolicyEntry] = BUILTIN_DOCUMENTS,
+            threshold: float = 0.8,
+            path: Optional[str] = None,
+            max_candidates: int = 256,
+            max_matches: int = 4096,
+    ):
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._entries: Dict[str, PolicyEntry] = {}
+        self._names: List[Tuple[str, str, FrozenSet[str]]] = []
+        self._exact: Dict[str, int] = {}
+        self._index: Dict[str, List[int]] = {}
+        self._candidates = LRUCache(max_candidates)
+        # Recent lookups; titles repeat across requests far more than they vary.
+        self._matches = LRUCache(max_matches)
+        for entry in documents:
+            self._add(entry)
+
+        self._db = None
+        self._data_version = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS policy_documents ("
+                "title TEXT PRIMARY KEY, url TEXT NOT NULL, aliases TEXT NOT NULL, promoted REAL NOT NULL)"
+            )
+            self._db.commit()
+            with self._lock:
+                self._reload()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _add(self, entry: PolicyEntry):
+        """Index ``entry``; its names take over from any entry sharing them."""
+        key = normalise_title(entry.title)
+        self._entries[key] = entry
+        for name in (entry.title, *entry.aliases):
+            normalised = normalise_title(name)
+            if not normalised:
+                continue
+            previous = self._exact.get(normalised)
+            if previous is not None:
+                for gram in self._names[previous][2]:
+                    self._index[gram].remove(previous)
+            position = len(self._names)
+            grams = trigrams(normalised)
+            self._names.append((normalised, key, grams))
+            self._exact[normalised] = position
+            for gram in grams:
+                self._index.setdefault(gram, []).append(position)
+        self._matches.clear()
+
+    def _reload(self):
+        """Index documents other workers have promoted since the last check."""
+        version = self._db.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._data_version:
+            return
+        self._data_version = version
+        for title, url, aliases in self._db.execute("SELECT title, url, aliases FROM policy_documents"):
+            entry = PolicyEntry(title, url, tuple(json.loads(aliases)), PROMOTED)
+            if self._entries.get(normalise_title(title)) != entry:
+                self._add(entry)
+
+    def lookup(self, title: str) -> Optional[CatalogueMatch]:
+        """The catalogue entry ``title`` names, or None when nothing is close enough."""
+        started = time.perf_counter()
+        query = normalise_title(title)
+        match = None
+        with self._lock:
+            if self._db is not None:
+                self._reload()
+            if query:
+                match = self._matches.get(query, _UNMATCHED)
+                if match is _UNMATCHED:
+                    match = self._match(query)
+                    self._matches.set(query, match)
+        metrics.observe("policy_catalogue.lookup_seconds", time.perf_counter() - started)
+        metrics.incr("policy_catalogue.lookups", result="hit" if match else "miss")
+        return match
+
+    def _match(self, query: str) -> Optional[CatalogueMatch]:
+        position = self._exact.get(query)
+        if position is not None:
+            name, key, _ = self._names[position]
+            return CatalogueMatch(self._entries[key], name, 1.0)
+
+        grams = trigrams(query)
+        size = len(grams)
+        # A name at the threshold shares at least ``min_shared`` trigrams with
+        # the query, so it shares one of any ``size - min_shared + 1`` of
+        # them: only the rarest are looked up. Its own trigram count is
+        # bounded the same way.
+        min_shared = math.ceil(self.threshold * size / (2 - self.threshold) - 1e-9)
+        max_size = size * (2 - self.threshold) / self.threshold
+        rarest = sorted(grams, key=lambda gram: len(self._index.get(gram, ())))[:size - min_shared + 1]
+        candidates = set()
+        for gram in rarest:
+            candidates.update(self._index.get(gram, ()))
+        words = query.count(" ")
+        best: Optional[Tuple[float, int]] = None
+        best_score = self.threshold
+        names = self._names
+        for position in candidates:
+            name, _, name_grams = names[position]
+            name_size = len(name_grams)
+            if name_size < min_shared or name_size > max_size or name.count(" ") != words:
+                continue
+            score = 2 * len(grams & name_grams) / (size + name_size)
+            if score >= best_score and (best is None or score > best[0]):
+                best = (score, position)
+                best_score = score
+        if best is None:
+            return None
+        score, position = best
+        name, key, _ = self._names[position]
+        return CatalogueMatch(self._entries[key], name, score)
+
+    def remember(self, title: str, url: str):
+        """Keep the model's URL for an unmatched title as a promotion candidate."""
+        self._candidates.set(normalise_title(title), (title, url))
+
+    def candidate(self, title: str) -> Optional[Tuple[str, str]]:
+        """The remembered ``(title, url)`` for ``title``, if any."""
+        return self._candidates.get(normalise_title(title))
+
+    def promote(self, title: str, url: Optional[str] = None, aliases: Sequence[str] = ()) -> PolicyEntry:
+        """Add a document to the catalogue.
+
+        Args:
+            title: Title of the document.
+            url: Canonical URL; defaults to the URL the model gave for
+                ``title``.
+            aliases: Other names the document is requested by.
+
+        Returns:
+            PolicyEntry: The added entry.
+
+        Raises:
+            CandidateNotFoundError: If no URL is given and the model has not
+                answered for ``title``.
+        """
+        if not url:
+            candidate = self._candidates.pop(normalise_title(title))
+            if candidate is None:
+                raise CandidateNotFoundError(title)
+            url = candidate[1]
+        else:
+            self._candidates.pop(normalise_title(title))
+        entry = PolicyEntry(title, url, tuple(aliases), PROMOTED)
+        with self._lock:
+            self._add(entry)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO policy_documents (title, url, aliases, promoted) VALUES (?, ?, ?, ?)",
+                    (title, url, json.dumps(list(aliases)), time.time()),
+                )
+                self._db.commit()
+        metrics.incr("policy_catalogue.promotions")
+        return entry
+
+    def entries(self) -> List[PolicyEntry]:
+        with self._lock:
+            if self._db is not None:
+                self._reload()
+            return sorted(self._entries.values(), key=lambda entry: entry.title.lower())
+
+    def candidates(self) -> List[Tuple[str, str]]:
+        """Remembered ``(title, url)`` pairs awaiting promotion."""
+        return self._candidates.values()
+
+    def close(self):
+        if self._db is not None:
+            with self._lock:
+                self._db.close()
+                self._db = None
@@ -0,0 +1,283 @@
+"""Per-worker resource container.
+
+The container owns the long-lived resources of a worker (settings, the pool of
+per-region ``bedrock-runtime`` clients) and is created inside the FastAPI
+lifespan, i.e. after gunicorn has forked the worker. Clients are built lazily
+and rebuilt if the container is ever used from a different process, so no
+connection pool is shared across a fork.
+"""
+
+import importlib
+import logging
+import os
+import threading
+import time
+from typing import Optional
+
+from services.eventloop import LoopMonitor
+from services.generation import load
+from services.idempotency import IdempotencyStore
+from services.metrics import metrics
+from services.catalogue import PolicyCatalogue
+from services.prefetch import EconomicPrefetcher
+from services.profiling import MemoryTracer
+from services.profiling import SamplingProfiler
+from services.prompt.similarity import EditCache
+from services.scheduler import GenerationScheduler
+from services.shedding import LoadShedder
+from services.session import CaseStore
+from services.settings import Settings
+from services.usage import UsageLedger
+
+logger = logging.getLogger(__name__)
+
+# Modules holding the prompt templates; importing them evaluates every template.
+PROMPT_MODULES = (
+    "services.prompts",
+    "services.prompt.sections",
+    "services.prompt.compiler",
+    "services.prompt.manager",
+    "services.prompt.economic",
+)
+
+
+class ServiceContainer:
+    """Lazily constructed, fork-aware holder of worker resources."""
+
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None
+        self._region_pool = None
+        self.case_store = CaseStore(settings.case_store_max_entries, settings.case_store_path)
+        self.idempotency_store = IdempotencyStore(
+            settings.idempotency_max_entries,
+            settings.idempotency_ttl_seconds,
+            settings.idempotency_store_path,
+            lease_seconds=settings.idempotency_lease_seconds,
+        )
+        self.usage_ledger = UsageLedger(
+            settings.usage_store_path,
+            flush_seconds=settings.usage_flush_seconds,
+            budgets=settings.usage_budgets,
+            default_budget=settings.usage_default_budget,
+            period=settings.usage_budget_period,
+        )
+        shedder = None
+        if settings.load_shedding:
+            shedder = LoadShedder(settings.shed_target_seconds, settings.shed_interval_seconds)
+        self.scheduler = GenerationScheduler(
+            max_concurrency=settings.bedrock_max_concurrency,
+            reserved_interactive=settings.scheduler_reserved_interactive,
+            aging_seconds=settings.scheduler_aging_seconds,
+            tenant_weights=settings.scheduler_tenant_weights,
+            shedder=shedder,
+        )
+        self.edit_cache: Optional[EditCache] = None
+        if settings.edit_cache:
+            self.edit_cache = EditCache(
+                max_entries=settings.edit_cache_max_entries,
+                threshold=settings.edit_cache_threshold,
+                max_text_distance=settings.edit_cache_max_text_distance,
+                ttl_seconds=settings.edit_cache_ttl_seconds,
+                audit_fraction=settings.edit_cache_audit_fraction,
+            )
+        self.policy_catalogue: Optional[PolicyCatalogue] = None
+        if settings.policy_catalogue:
+            self.policy_catalogue = PolicyCatalogue(
+                threshold=settings.policy_catalogue_threshold,
+                path=settings.policy_catalogue_path,
+            )
+        self.profiler = SamplingProfiler(settings.profile_max_seconds)
+        self.memory_tracer = MemoryTracer()
+        self.loop_monitor: Optional[LoopMonitor] = None
+        if settings.loop_monitor:
+            self.loop_monitor = LoopMonitor(
+                interval=settings.loop_monitor_interval_seconds,
+                block_threshold=settings.loop_block_threshold_seconds,
+            )
+        self.economic_prefetcher: Optional[EconomicPrefetcher] = None
+        if settings.economic_prefetch:
+            self.economic_prefetcher = EconomicPrefetcher(
+                lambda context: self.economic_prompt_service(context=context),
+                load,
+                max_load=settings.economic_prefetch_max_load,
+                ttl_seconds=settings.economic_prefetch_ttl_seconds,
+                timeout=settings.request_timeout_seconds,
+            )
+
+    @property
+    def region_pool(self):
+        """The RegionPool of ``bedrock-runtime`` clients for this process.
+
+        boto3 clients are thread-safe, so one client per region (and its
+        connection pool) is reused by every request handled by the worker.
+        """
+        if self._region_pool is None or self._pid != os.getpid():
+            with self._lock:
+                if self._region_pool is None or self._pid != os.getpid():
+                    self._region_pool = self._create_region_pool()
+                    self._pid = os.getpid()
+        return self._region_pool
+
+    @property
+    def bedrock_client(self):
+        """The client for the preferred region."""
+        pool = self.region_pool
+        return pool.client(pool.primary)
+
+    def _create_region_pool(self):
+        from controllers.ai.regions import RegionPool
+
+        settings = self.settings
+        return RegionPool(
+            settings.bedrock_regions or (settings.region_name,),
+            self._create_bedrock_client,
+            allowed_regions=settings.bedrock_allowed_regions or None,
+            failure_threshold=settings.bedrock_circuit_failures,
+            open_seconds=settings.bedrock_circuit_open_seconds,
+            probe_fraction=settings.bedrock_probe_fraction,
+        )
+
+    def _create_bedrock_client(self, region_name: str):
+        from controllers.ai.bedrock import AWSBedrockService
+
+        return AWSBedrockService.create_client(dict(
+            region_name=region_name,
+            aws_access_key_id=self.settings.bedrock_access_key,
+            aws_secret_access_key=self.settings.bedrock_secret_access_key,
+            **self._client_options(),
+        ))
+
+    def _client_options(self) -> dict:
+        return dict(
+            connect_timeout=self.settings.bedrock_connect_timeout,
+            read_timeout=self.settings.bedrock_read_timeout,
+            retry_mode=self.settings.bedrock_retry_mode,
+            max_attempts=self.settings.bedrock_max_attempts,
+            max_pool_connections=self.settings.bedrock_max_pool_connections,
+            retry_min_budget_seconds=self.settings.bedrock_retry_min_budget_seconds,
+        )
+
+    def _service_kwargs(self) -> dict:
+        return dict(
+            aws_access_key_id=self.settings.bedrock_access_key,
+            aws_secret_access_key=self.settings.bedrock_secret_access_key,
+            region_pool=self.region_pool,
+            usage_ledger=self.usage_ledger,
+            region_name=self.settings.region_name,
+            model_id=self.settings.model_id,
+            **self._client_options(),
+        )
+
+    def ai_service(self, model_id: Optional[str] = None):
+        """Construct a Bedrock controller bound to the shared clients.
+
+        Args:
+            model_id: Optional model override; defaults to ``BEDROCK_MODEL_ID``.
+        """
+        from services.ai import get_ai_service
+
+        kwargs = self._service_kwargs()
+        if model_id:
+            kwargs["model_id"] = model_id
+        return get_ai_service("bedrock", **kwargs)
+
+    def prompt_service(self, context=None):
+        """Construct a PromptManager bound to the shared client.
+
+        Args:
+            context: Optional GenerationContext of the request being served.
+        """
+        from services.ai import bedrock_prompt_service
+
+        return bedrock_prompt_service(
+            settings=self.settings,
+            context=context,
+            edit_cache=self.edit_cache,
+            policy_catalogue=self.policy_catalogue,
+            **self._service_kwargs(),
+        )
+
+    def economic_prompt_service(self, context=None):
+        """Construct an EconomicPromptManager bound to the shared client.
+
+        Args:
+            context: Optional GenerationContext of the request being served.
+        """
+        from services.ai import bedrock_economic_prompt_service
+
+        return bedrock_economic_prompt_service(settings=self.settings, context=context, **self._service_kwargs())
+
+    def check_prompt_budgets(self):
+        """Record the token cost of every route's fixed prompt and warn about overruns."""
+        from services.prompt.compiler import prompt_report
+
+        report = prompt_report(self.settings.prompt_token_budgets)
+        for route in report["routes"]:
+            metrics.gauge("prompt.template_tokens", route["totalTokens"], route=route["route"], variant=route["variant"])
+        for route in report["overBudget"]:
+            logger.warning(
+                "Prompt for %s [%s] is %d tokens, over its budget of %d",
+                route["route"], route["variant"], route["totalTokens"], route["budget"],
+            )
+
+    def prewarm(self):
+        """Load prompt templates and open a Bedrock connection ahead of traffic.
+
+        The connection is warmed with a deliberately invalid ``invoke_model``
+        call: it resolves DNS and completes the TLS handshake, and the server
+        rejects it during validation without running the model. The open
+        connection then stays in the client's pool for the first real request.
+        """
+        with metrics.timer("startup.prewarm_seconds", step="templates"):
+            for module in PROMPT_MODULES:
+                importlib.import_module(module)
+            self.check_prompt_budgets()
+
+        pool = self.region_pool
+        for region in pool.regions:
+            with metrics.timer("startup.prewarm_seconds", step="bedrock", region=region):
+                try:
+                    pool.client(region).invoke_model(
+                        modelId=self.settings.model_id, body=b"{}", contentType="application/json"
+                    )
+                except Exception as e:
+                    # A validation error is the expected outcome of the warm-up call.
+                    logger.debug("Bedrock warm-up call to %s returned %s", region, e)
+
+    def close(self):
+        """Close the shared clients and the stores owned by the worker."""
+        with self._lock:
+            pool, self._region_pool = self._region_pool, None
+        if pool is not None:
+            pool.close()
+        if self.economic_prefetcher is not None:
+            self.economic_prefetcher.close()
+        self.case_store.close()
+        self.idempotency_store.close()
+        self.usage_ledger.close()
+        if self.policy_catalogue is not None:
+            self.policy_catalogue.close()
+        self.memory_tracer.stop()
+        if self.loop_monitor is not None:
+            self.loop_monitor.stop()
+
+
+def startup(container: ServiceContainer, process_started: float):
+    """Run worker start-up and record cold-start timings.
+
+    Args:
+        container: The worker's container.
+        process_started: ``time.perf_counter()`` captured when the app module was imported.
+    """
+    lifespan_started = time.perf_counter()
+    metrics.gauge("startup.import_seconds", lifespan_started - process_started)
+    if container.settings.prewarm:
+        container.prewarm()
+    ready = time.perf_counter()
+    metrics.gauge("startup.ready_seconds", ready - process_started)
+    logger.info(
+        "Worker %s ready in %.3fs (prewarm %.3fs)",
+        os.getpid(), ready - process_started, ready - lifespan_started,
+    )
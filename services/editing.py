@@ -0,0 +1,229 @@
+"""WebSocket sessions for interactive section editing.
+
+``/api/ai/update/section/additional`` is stateless: every turn re-sends the
+context sections and the whole conversation. On
+``/api/ai/update/section/session`` an editor opens one WebSocket and the
+server keeps that state, so a turn is just the query.
+
+Client messages (JSON, told apart by ``type``):
+
+- ``start``: ``originalText``, the context ``sections`` (the edited section
+  first) or a ``caseId``, and optionally earlier ``prompts`` to resume from.
+  Starts or restarts the session.
+- ``edit``: ``userQuery``, optionally a new ``originalText`` and changed
+  ``sections``. Cancels the edit in flight, if any, and starts a new one.
+- ``cancel``: Cancels the edit in flight.
+
+Server messages: ``ready`` after ``start``; ``delta`` with the next piece of
+an edit's text, ``done`` with the whole text, or ``cancelled``, each tagged
+with the ``turn`` it belongs to; ``error`` for a failed turn or an invalid
+message.
+
+Completed turns are added to the conversation; cancelled ones are not. Each
+edit is scheduled, deadlined and budgeted like a request to the REST route.
+"""
+
+import asyncio
+import time
+from typing import List
+from typing import Optional
+from typing import Sequence
+
+from fastapi import WebSocket
+from fastapi import WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from pydantic import TypeAdapter
+from pydantic import ValidationError
+
+from models.section import EditSessionEdit
+from models.section import EditSessionMessage
+from models.section import EditSessionStart
+from models.section import PromptsInputModel
+from models.section import PromptsRequestModel
+from models.section import SectionModel
+from models.section import SectionPromptsModel
+from services.generation import discard_result
+from services.generation import generation_runner
+from services.metrics import metrics
+from services.session import CaseNotFoundError
+
+SESSION_MESSAGE = TypeAdapter(EditSessionMessage)
+
+
+class EditSession:
+    """Conversation state of one editing session.
+
+    Args:
+        sections: Context sections, the edited section first.
+        original_text: The text being edited.
+        turns: Earlier turns of the conversation.
+        case_id: Stored case that changed sections are saved to.
+    """
+
+    def __init__(
+            self,
+            sections: Sequence[SectionModel],
+            original_text: str,
+            turns: Sequence[SectionPromptsModel] = (),
+            case_id: Optional[str] = None,
+    ):
+        self.sections: List[SectionModel] = list(sections)
+        self.original_text = original_text
+        self.turns: List[SectionPromptsModel] = list(turns)
+        self.case_id = case_id
+
+    def apply(self, sections: Sequence[SectionModel], original_text: Optional[str] = None):
+        """Replace changed sections in place; sections not seen before are appended."""
+        changed = {section.sectionID: section for section in sections}
+        self.sections = [changed.pop(section.sectionID, section) for section in self.sections]
+        self.sections += changed.values()
+        if original_text is not None:
+            self.original_text = original_text
+
+    def request(self, user_query: str) -> PromptsRequestModel:
+        return PromptsRequestModel(
+            sections=self.sections,
+            prompts=self.turns,
+            originalText=self.original_text,
+            userQuery=user_query,
+        )
+
+    def record(self, user_query: str, response: str):
+        """Add a completed turn to the conversation."""
+        self.turns.append(SectionPromptsModel(text=user_query, sender=PromptsInputModel.USER))
+        self.turns.append(SectionPromptsModel(text=response, sender=PromptsInputModel.AI))
+
+
+class EditSessionHandler:
+    """Serve one editing session over ``websocket``.
+
+    Args:
+        websocket: The editor's WebSocket; accepted by :meth:`serve`.
+        container: The worker's ServiceContainer.
+        idle_seconds: The session is closed after this long without a
+            message; never when 0.
+    """
+
+    def __init__(self, websocket: WebSocket, container, idle_seconds: float = 0):
+        self.websocket = websocket
+        self.container = container
+        self.idle_seconds = idle_seconds or None
+        self.session: Optional[EditSession] = None
+        self._turn: Optional[asyncio.Task] = None
+        self._turn_id = 0
+        self._closed = False
+
+    async def serve(self):
+        await self.websocket.accept()
+        metrics.incr("edit_session.opened")
+        try:
+            while True:
+                try:
+                    text = await asyncio.wait_for(self.websocket.receive_text(), self.idle_seconds)
+                except asyncio.TimeoutError:
+                    metrics.incr("edit_session.idle_closed")
+                    await self.websocket.close()
+                    return
+                metrics.observe("edit_session.message_bytes", len(text.encode("utf-8")))
+                try:
+                    message = SESSION_MESSAGE.validate_json(text)
+                except ValidationError as e:
+                    await self._send(type="error", detail=str(e))
+                    continue
+                await self._handle(message)
+        except WebSocketDisconnect:
+            pass
+        finally:
+            self._closed = True
+            await self._cancel_turn(notify=False)
+
+    async def _handle(self, message):
+        if isinstance(message, EditSessionStart):
+            await self._cancel_turn()
+            try:
+                self.session = await run_in_threadpool(self._start, message)
+            except CaseNotFoundError:
+                await self._send(type="error", detail=f"Unknown case: {message.caseId}")
+                return
+            await self._send(type="ready", turns=len(self.session.turns) // 2)
+        elif isinstance(message, EditSessionEdit):
+            if self.session is None:
+                await self._send(type="error", detail="The session has not been started")
+                return
+            await self._cancel_turn()
+            if message.sections and self.session.case_id:
+                try:
+                    await run_in_threadpool(self.container.case_store.update, self.session.case_id, message.sections)
+                except CaseNotFoundError:
+                    await self._send(type="error", detail=f"Unknown case: {self.session.case_id}")
+                    return
+            self.session.apply(message.sections, message.originalText)
+            self._turn_id += 1
+            self._turn = asyncio.ensure_future(self._run_turn(self._turn_id, message.userQuery))
+        else:
+            await self._cancel_turn()
+
+    def _start(self, message: EditSessionStart) -> EditSession:
+        sections = message.sections
+        if message.caseId:
+            _, sections = self.container.case_store.resolve_sections(message.caseId, message.sections)
+        return EditSession(sections, message.originalText, message.prompts, message.caseId)
+
+    async def _cancel_turn(self, notify: bool = True):
+        turn, self._turn = self._turn, None
+        if turn is None or turn.done():
+            return
+        turn.cancel()
+        await asyncio.wait({turn})
+        metrics.incr("edit_session.turns", result="cancelled")
+        if notify:
+            await self._send(type="cancelled", turn=self._turn_id)
+
+    async def _run_turn(self, turn_id: int, user_query: str):
+        generation = generation_runner(self.websocket)
+        service = self.container.prompt_service(context=generation.context)
+        pieces = service.stream_additional_content(self.session.request(user_query))
+        started = time.perf_counter()
+        text: List[str] = []
+        pending = None
+        try:
+            async with generation.admit():
+                while True:
+                    pending = asyncio.ensure_future(run_in_threadpool(next, pieces, None))
+                    await generation.wait_any([pending])
+                    piece, pending = pending.result(), None
+                    if piece is None:
+                        break
+                    if not text:
+                        metrics.observe("edit_session.first_delta_seconds", time.perf_counter() - started)
+                    text.append(piece)
+                    await self._send(type="delta", turn=turn_id, text=piece)
+            response = "".join(text)
+            self.session.record(user_query, response)
+            metrics.observe("edit_session.turn_seconds", time.perf_counter() - started)
+            metrics.incr("edit_session.turns", result="completed")
+            await self._send(type="done", turn=turn_id, response=response)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            metrics.incr("edit_session.turns", result="failed")
+            await self._send(type="error", turn=turn_id, detail=str(e))
+        finally:
+            if pending is not None:
+                # Cancelling the context ends the Bedrock stream of the abandoned edit.
+                generation.context.cancel()
+                pending.add_done_callback(discard_result)
+            try:
+                pieces.close()
+            except ValueError:
+                # Still running in the thread pool; it stops on the cancelled context.
+                pass
+
+    async def _send(self, **message):
+        if self._closed:
+            return
+        try:
+            await self.websocket.send_json(message)
+        except (RuntimeError, WebSocketDisconnect):
+            # The editor went away; the receive loop ends the session.
+            self._closed = True
@@ -0,0 +1,136 @@
+"""Event-loop lag monitor and blocking-call detector.
+
+Synchronous work done directly in an ``async def`` handler (a boto3 call,
+heavy pydantic validation, SQLite) stalls every request the worker serves.
+:class:`LoopMonitor` makes that visible:
+
+- A task on the loop sleeps for ``interval`` and measures how late it wakes
+  up. The lateness is the loop's lag, observed as ``event_loop.lag_seconds``
+  (``/metrics`` reports its p50, p95 and p99 over the recent samples).
+- A watchdog thread checks the task's heartbeat. When the loop has not
+  turned for ``block_threshold``, the watchdog captures the loop thread's
+  stack and the running task, which name the code that blocks, and logs
+  them. ``event_loop.blocked`` counts these blocks and
+  ``event_loop.block_seconds`` observes how long each one lasted.
+
+The last ``max_reports`` blocks are kept for ``/debug/loop/blocks``.
+"""
+
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import List
+from typing import Optional
+
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class LoopMonitor:
+    """Measure the lag of the running event loop and report blocking calls.
+
+    Args:
+        interval: Seconds between lag measurements.
+        block_threshold: Seconds without a turn of the loop reported as a block.
+        max_reports: Recent blocks kept.
+        stack_limit: Innermost frames kept of a blocked stack.
+    """
+
+    def __init__(
+            self,
+            interval: float = 0.05,
+            block_threshold: float = 0.1,
+            max_reports: int = 50,
+            stack_limit: int = 30,
+    ):
+        self.interval = interval
+        self.block_threshold = block_threshold
+        self.stack_limit = stack_limit
+        self._reports: deque = deque(maxlen=max_reports)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._beat = 0.0
+        # The report of the block in progress, completed when the loop turns again.
+        self._pending: Optional[dict] = None
+
+    def start(self):
+        """Start monitoring the running loop; call from the loop thread."""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stopped.clear()
+        self._task = self._loop.create_task(self._measure(), name="loop-monitor")
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    def stop(self):
+        """Stop the measuring task and the watchdog."""
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._watchdog is not None:
+            self._watchdog.join(timeout=1)
+            self._watchdog = None
+
+    async def _measure(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._beat = now
+            lag = max(0.0, now - started - self.interval)
+            metrics.observe("event_loop.lag_seconds", lag)
+            pending, self._pending = self._pending, None
+            if pending is not None:
+                pending["blockedSeconds"] = round(lag, 3)
+                metrics.observe("event_loop.block_seconds", lag)
+
+    def _watch(self):
+        reported = None
+        while not self._stopped.wait(self.block_threshold / 2):
+            beat = self._beat
+            stalled = time.monotonic() - beat - self.interval
+            if stalled < self.block_threshold or beat == reported:
+                continue
+            reported = beat
+            self._report(stalled)
+
+    def _report(self, stalled: float):
+        frame = sys._current_frames().get(self._loop_thread)
+        if frame is None:
+            return
+        stack = traceback.format_stack(frame)[-self.stack_limit:]
+        task = asyncio.current_task(self._loop)
+        report = dict(
+            at=time.time(),
+            task=_describe(task),
+            stalledSeconds=round(stalled, 3),
+            blockedSeconds=None,
+            stack=[line.rstrip() for line in stack],
+        )
+        self._pending = report
+        self._reports.append(report)
+        metrics.incr("event_loop.blocked")
+        logger.warning(
+            "Event loop blocked for over %.3f s in %s:\n%s", stalled, report["task"] or "a callback", "".join(stack)
+        )
+
+    def reports(self) -> List[dict]:
+        """Recent blocks, oldest first."""
+        return list(self._reports)
+
+
+def _describe(task: Optional[asyncio.Task]) -> Optional[str]:
+    if task is None:
+        return None
+    coro = task.get_coro()
+    return f"{task.get_name()} ({getattr(coro, '__qualname__', coro)})"
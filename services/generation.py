@@ -0,0 +1,269 @@
+"""Route-side execution of blocking generations.
+
+Controllers are synchronous (boto3), so routes hand generation work to the
+thread pool through :class:`GenerationRunner`. While the work runs, the runner
+polls the HTTP connection and cancels the request's
+:class:`GenerationContext` as soon as the client disconnects, which makes the
+controller close the Bedrock stream instead of generating for nobody.
+
+Before a generation starts it is admitted by the worker's
+:class:`GenerationScheduler`, which bounds Bedrock concurrency and orders
+waiting work by priority class and tenant. Requests for a project whose token
+budget is used up are rejected before they queue.
+
+Each request also gets a :class:`Deadline`, from ``REQUEST_TIMEOUT_SECONDS``
+or a shorter ``X-Request-Timeout`` header. Once it passes, the context is
+cancelled with DeadlineExceeded and the route answers 504.
+"""
+
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+from contextlib import contextmanager
+from typing import Callable
+from typing import Iterable
+from typing import List
+from typing import Optional
+
+from fastapi import Request
+from starlette.requests import HTTPConnection
+from fastapi.concurrency import run_in_threadpool
+
+from controllers.ai.context import Deadline
+from controllers.ai.context import DeadlineExceeded
+from controllers.ai.context import GenerationContext
+from services.metrics import metrics
+from services.scheduler import GenerationScheduler
+from services.scheduler import operation_priority
+from services.usage import UsageLedger
+
+
+class GenerationLoad:
+    """Number of request-serving generations running in this worker.
+
+    Background work (e.g. speculative prefetch) subscribes to changes so it
+    can step aside when requests are waiting on Bedrock.
+    """
+
+    def __init__(self):
+        self._active = 0
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[int], None]] = []
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    def subscribe(self, listener: Callable[[int], None]) -> Callable[[], None]:
+        """Call ``listener`` with the new count on every change; returns an unsubscribe function."""
+        with self._lock:
+            self._listeners.append(listener)
+        return lambda: self._unsubscribe(listener)
+
+    def _unsubscribe(self, listener: Callable[[int], None]):
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    def _change(self, delta: int):
+        with self._lock:
+            self._active += delta
+            active, listeners = self._active, list(self._listeners)
+        metrics.gauge("generation.in_flight", active)
+        for listener in listeners:
+            listener(active)
+
+    def enter(self):
+        self._change(1)
+
+    def exit(self):
+        self._change(-1)
+
+
+load = GenerationLoad()
+
+
+class GenerationRunner:
+    """Run generation callables for one request, aborting on disconnect.
+
+    Requests with an ``Idempotency-Key`` are not aborted: a retry is expected
+    to join the running generation and collect its result. On a WebSocket the
+    connection is not polled; the session cancels the context itself.
+
+    Args:
+        request: The HTTP request or WebSocket being served.
+        timeout: Seconds the request may take; no deadline when None.
+        poll_interval: Seconds between disconnect checks.
+        scheduler: Admission scheduler; generations start immediately when None.
+        tenant: Fair-queuing key of the caller.
+        priority: Priority class of the operation.
+        usage_ledger: Ledger whose budgets are checked before queueing.
+        project: Project the generation's token usage is attributed to.
+        operation: Operation the token usage is attributed to.
+    """
+
+    def __init__(
+            self,
+            request: HTTPConnection,
+            timeout: Optional[float] = None,
+            poll_interval: float = 0.5,
+            scheduler: Optional[GenerationScheduler] = None,
+            tenant: str = "",
+            priority: str = "standard",
+            usage_ledger: Optional[UsageLedger] = None,
+            project: str = "",
+            operation: str = "",
+    ):
+        self.request = request
+        self.poll_interval = poll_interval
+        self.deadline = Deadline(timeout) if timeout else None
+        self.context = GenerationContext(self.deadline, project=project, operation=operation)
+        self.abort_on_disconnect = isinstance(request, Request) and not request.headers.get("idempotency-key")
+        self.scheduler = scheduler
+        self.tenant = tenant
+        self.priority = priority
+        self.usage_ledger = usage_ledger
+
+    async def _wait(self, future: asyncio.Future, on_expired=None):
+        """Wait for ``future`` while watching the deadline and the connection.
+
+        Returns True once ``future`` is done, False if the client disconnected.
+        """
+        while not future.done():
+            interval = self.poll_interval
+            if self.deadline is not None:
+                interval = min(interval, self.deadline.remaining())
+            await asyncio.wait({future}, timeout=interval)
+            if future.done():
+                break
+            if self.deadline is not None and self.deadline.expired:
+                # Answer now rather than waiting for a worker thread that
+                # may be blocked connecting; it stops once it sees the
+                # cancelled context.
+                metrics.incr("generation.deadline_exceeded")
+                self.context.cancel(DeadlineExceeded)
+                if on_expired is not None:
+                    on_expired()
+                raise self.context.error()
+            if self.abort_on_disconnect and await self.request.is_disconnected():
+                metrics.incr("generation.client_disconnects")
+                self.context.cancel()
+                return False
+        return True
+
+    async def wait_any(self, futures: Iterable[asyncio.Future]) -> bool:
+        """Wait until one of ``futures`` is done, watching the deadline and the connection.
+
+        Returns False if the client disconnected first; the futures are left running.
+        """
+        waiter = asyncio.ensure_future(asyncio.wait(set(futures), return_when=asyncio.FIRST_COMPLETED))
+        try:
+            return await self._wait(waiter)
+        finally:
+            waiter.cancel()
+
+    @contextmanager
+    def reading_body(self):
+        """Stop watching the connection while the route reads the request body.
+
+        Starlette's ``is_disconnected`` consumes a pending body message, so
+        polling while ``request.stream()`` is read would drop part of the
+        body. A disconnect during the upload ends the stream instead.
+        """
+        abort_on_disconnect, self.abort_on_disconnect = self.abort_on_disconnect, False
+        try:
+            yield
+        finally:
+            self.abort_on_disconnect = abort_on_disconnect
+
+    @asynccontextmanager
+    async def admit(self):
+        """Hold a scheduler slot for the body of the ``async with`` block.
+
+        Checks the project's budget, waits for admission while watching the
+        deadline and the connection, and counts the block as in-flight load.
+        Raises LoadShed if the scheduler sheds the generation.
+        """
+        if self.usage_ledger is not None:
+            self.usage_ledger.check(self.context.project)
+        if self.scheduler is not None:
+            shed = self.scheduler.check(self.priority)
+            if shed is not None:
+                raise shed
+        ticket = None
+        try:
+            if self.scheduler is not None:
+                ticket = self.scheduler.enqueue(self.tenant, self.priority)
+                if not await self._wait(ticket.granted):
+                    self.context.raise_if_cancelled()
+                # Raises LoadShed if the generation was shed while queued.
+                ticket.granted.result()
+            load.enter()
+            try:
+                yield
+            finally:
+                load.exit()
+        except asyncio.CancelledError:
+            self.context.cancel()
+            raise
+        finally:
+            if ticket is not None:
+                self.scheduler.release(ticket)
+
+    async def run(self, func, *args, **kwargs):
+        async with self.admit():
+            task = asyncio.ensure_future(run_in_threadpool(func, *args, **kwargs))
+            try:
+                await self._wait(task, on_expired=lambda: task.add_done_callback(discard_result))
+            except asyncio.CancelledError:
+                # The thread stops on the cancelled context; nobody collects its result.
+                task.add_done_callback(discard_result)
+                raise
+            return await task
+
+
+def discard_result(task: asyncio.Future):
+    if not task.cancelled():
+        task.exception()
+
+
+def request_timeout(request: HTTPConnection) -> Optional[float]:
+    """Seconds the request may take: the configured timeout, or a shorter one
+    asked for by the client through ``X-Request-Timeout``."""
+    timeout = request.app.state.container.settings.request_timeout_seconds or None
+    try:
+        requested = float(request.headers.get("x-request-timeout", ""))
+    except ValueError:
+        return timeout
+    if requested > 0 and (timeout is None or requested < timeout):
+        return requested
+    return timeout
+
+
+def request_tenant(request: HTTPConnection) -> str:
+    """Fair-queuing key: ``X-Tenant-Id``, else ``X-Project-Id``, else the client address."""
+    tenant = request.headers.get("x-tenant-id") or request.headers.get("x-project-id")
+    if tenant:
+        return tenant
+    return request.client.host if request.client else ""
+
+
+def get_generation(request: Request) -> GenerationRunner:
+    """FastAPI dependency returning a runner bound to the current request."""
+    return generation_runner(request)
+
+
+def generation_runner(request: HTTPConnection) -> GenerationRunner:
+    """A runner for one generation of ``request``, attributed to its route."""
+    container = request.app.state.container
+    path = getattr(request.scope.get("route"), "path", None)
+    return GenerationRunner(
+        request,
+        timeout=request_timeout(request),
+        scheduler=container.scheduler,
+        tenant=request_tenant(request),
+        priority=operation_priority(path),
+        usage_ledger=container.usage_ledger,
+        project=request.headers.get("x-project-id", ""),
+        operation=path or "",
+    )
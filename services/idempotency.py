@@ -0,0 +1,248 @@
+"""Store of idempotent generation results.
+
+Requests carrying an ``Idempotency-Key`` header are tracked here: while a
+generation runs, retries with the same key wait for it instead of starting a
+second one; once it finishes, the response is kept so retries (and later
+``GET /api/ai/results/{key}`` calls) are answered from the store.
+
+In-flight generations are tracked per worker. SQLite is only used from the
+thread pool, so a busy database never stalls the event loop. With a SQLite path configured,
+claims and results are also shared by the workers on one host: a retry that
+lands on another worker polls the database until the first worker finishes.
+A shared claim is a lease of ``lease_seconds`` that the claiming worker
+renews while the generation runs, so the claim of a worker that crashed
+expires quickly and a retry runs the generation again.
+"""
+
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+from services.cache import LRUCache
+
+
+@dataclass(frozen=True)
+class StoredResponse:
+    status: int
+    content_type: str
+    body: bytes
+    fingerprint: str
+    created: float
+
+    @property
+    def etag(self) -> str:
+        return '"' + hashlib.sha256(self.body).hexdigest()[:32] + '"'
+
+
+class IdempotencyConflictError(ValueError):
+    """Raised when a key is reused with a different request."""
+
+
+class IdempotencyStore:
+    """Completed results (LRU + optional SQLite) and in-flight generations.
+
+    Args:
+        max_entries: Completed results kept in memory.
+        ttl_seconds: How long completed results are honoured.
+        path: Optional SQLite database path shared by the workers on a host.
+        lease_seconds: How long a shared claim is honoured without renewal.
+    """
+
+    CLAIMED = "claimed"
+    DONE = "done"
+    IN_FLIGHT = "in_flight"
+    PENDING_ELSEWHERE = "pending_elsewhere"
+
+    def __init__(
+            self,
+            max_entries: int = 1024,
+            ttl_seconds: float = 86400,
+            path: Optional[str] = None,
+            lease_seconds: float = 60,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.lease_seconds = lease_seconds
+        self._results = LRUCache(max_entries)
+        self._in_flight: Dict[str, Tuple[str, asyncio.Future]] = {}
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS idempotency ("
+                "key TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, state TEXT NOT NULL, status INTEGER, "
+                "content_type TEXT, body BLOB, updated REAL NOT NULL)"
+            )
+            self._db.commit()
+
+    @property
+    def shared(self) -> bool:
+        return self._db is not None
+
+    def _fresh(self, created: float) -> bool:
+        return time.time() - created < self.ttl_seconds
+
+    def get(self, key: str) -> Optional[StoredResponse]:
+        """Return the completed response for ``key``, if any."""
+        stored = self._results.get(key)
+        if stored is not None and self._fresh(stored.created):
+            return stored
+        if self._db is None:
+            return None
+        with self._lock:
+            row = self._db.execute(
+                "SELECT fingerprint, status, content_type, body, updated FROM idempotency "
+                "WHERE key = ? AND state = 'done'",
+                (key,),
+            ).fetchone()
+        if row is None or not self._fresh(row[4]):
+            return None
+        stored = StoredResponse(status=row[1], content_type=row[2], body=row[3], fingerprint=row[0], created=row[4])
+        self._results.set(key, stored)
+        return stored
+
+    def is_pending(self, key: str) -> bool:
+        if key in self._in_flight:
+            return True
+        if self._db is None:
+            return False
+        with self._lock:
+            row = self._db.execute(
+                "SELECT updated FROM idempotency WHERE key = ? AND state = 'pending'", (key,)
+            ).fetchone()
+        return row is not None and time.time() - row[0] < self.lease_seconds
+
+    async def begin(self, key: str, fingerprint: str):
+        """Claim ``key`` for a new generation, or report what already exists.
+
+        Returns:
+            tuple: ``(state, value)`` where state is ``DONE`` (value is the
+            StoredResponse), ``IN_FLIGHT`` (value is a future resolving to it),
+            ``PENDING_ELSEWHERE`` (another worker holds the claim) or
+            ``CLAIMED`` (the caller must run the generation).
+
+        Raises:
+            IdempotencyConflictError: If the key was used for a different request.
+        """
+        stored = self._results.get(key)
+        if stored is None or not self._fresh(stored.created):
+            stored = await run_in_threadpool(self.get, key) if self._db is not None else None
+        if stored is not None:
+            if stored.fingerprint != fingerprint:
+                raise IdempotencyConflictError(key)
+            return self.DONE, stored
+
+        in_flight = self._joinable(key, fingerprint)
+        if in_flight is not None:
+            return self.IN_FLIGHT, in_flight
+
+        if self._db is not None and not await run_in_threadpool(self._claim_shared, key, fingerprint):
+            # Another request of this worker may have claimed it meanwhile.
+            in_flight = self._joinable(key, fingerprint)
+            if in_flight is not None:
+                return self.IN_FLIGHT, in_flight
+            return self.PENDING_ELSEWHERE, None
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = (fingerprint, future)
+        return self.CLAIMED, future
+
+    def _joinable(self, key: str, fingerprint: str) -> Optional[asyncio.Future]:
+        in_flight = self._in_flight.get(key)
+        if in_flight is None:
+            return None
+        if in_flight[0] != fingerprint:
+            raise IdempotencyConflictError(key)
+        return in_flight[1]
+
+    def _claim_shared(self, key: str, fingerprint: str) -> bool:
+        now = time.time()
+        with self._lock:
+            # Drop an expired result, or the claim of a worker that stopped renewing it.
+            self._db.execute(
+                "DELETE FROM idempotency WHERE key = ? AND "
+                "(state = 'done' AND updated < ? OR state = 'pending' AND updated < ?)",
+                (key, now - self.ttl_seconds, now - self.lease_seconds),
+            )
+            cursor = self._db.execute(
+                "INSERT OR IGNORE INTO idempotency (key, fingerprint, state, updated) VALUES (?, ?, 'pending', ?)",
+                (key, fingerprint, now),
+            )
+            self._db.commit()
+            if cursor.rowcount:
+                return True
+            row = self._db.execute("SELECT fingerprint FROM idempotency WHERE key = ?", (key,)).fetchone()
+        if row is not None and row[0] != fingerprint:
+            raise IdempotencyConflictError(key)
+        return False
+
+    def renew(self, key: str):
+        """Extend this worker's shared claim on ``key`` by another lease."""
+        if self._db is None:
+            return
+        with self._lock:
+            self._db.execute(
+                "UPDATE idempotency SET updated = ? WHERE key = ? AND state = 'pending'", (time.time(), key)
+            )
+            self._db.commit()
+
+    async def complete(self, key: str, stored: StoredResponse):
+        """Store the finished response and release waiting retries."""
+        self._results.set(key, stored)
+        if self._db is not None:
+            await run_in_threadpool(self._complete_shared, key, stored)
+        _, future = self._in_flight.pop(key, (None, None))
+        if future is not None and not future.done():
+            future.set_result(stored)
+
+    def _complete_shared(self, key: str, stored: StoredResponse):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO idempotency "
+                "(key, fingerprint, state, status, content_type, body, updated) VALUES (?, ?, 'done', ?, ?, ?, ?)",
+                (key, stored.fingerprint, stored.status, stored.content_type, stored.body, stored.created),
+            )
+            self._db.commit()
+
+    async def abandon(self, key: str):
+        """Release a claim without storing a result so a retry can run again.
+
+        Waiting retries are woken with ``None`` and go on to claim the key.
+        """
+        if self._db is not None:
+            await run_in_threadpool(self._abandon_shared, key)
+        _, future = self._in_flight.pop(key, (None, None))
+        if future is not None and not future.done():
+            future.set_result(None)
+
+    def _abandon_shared(self, key: str):
+        with self._lock:
+            self._db.execute("DELETE FROM idempotency WHERE key = ? AND state = 'pending'", (key,))
+            self._db.commit()
+
+    async def wait_elsewhere(self, key: str, timeout: float, interval: float = 1.0) -> Optional[StoredResponse]:
+        """Poll the shared store until another worker completes ``key``."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            stored = await run_in_threadpool(self.get, key)
+            if stored is not None:
+                return stored
+            if not await run_in_threadpool(self.is_pending, key):
+                return None
+            await asyncio.sleep(interval)
+        return None
+
+    def close(self):
+        if self._db is not None:
+            with self._lock:
+                self._db.close()
+                self._db = None
@@ -0,0 +1,129 @@
+"""In-process metrics registry.
+
+A deliberately small registry of counters, gauges and timing summaries that is
+cheap enough to call on every request. Each worker keeps its own registry; the
+``/metrics`` route exposes a JSON snapshot of it.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+RESERVOIR_SIZE = 1024
+
+
+def _key(name: str, labels: Dict[str, str]) -> Tuple[str, Tuple[Tuple[str, str], ...]]:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _render_key(key: Tuple[str, Tuple[Tuple[str, str], ...]]) -> str:
+    name, labels = key
+    if not labels:
+        return name
+    return name + "{" + ",".join(f"{k}={v}" for k, v in labels) + "}"
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Return the ``fraction`` percentile (0-1) of ``values`` (nearest rank)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+class _Summary:
+    __slots__ = ("count", "total", "minimum", "maximum", "samples", "_cursor")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.minimum = float("inf")
+        self.maximum = float("-inf")
+        self.samples: List[float] = []
+        self._cursor = 0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.total += value
+        self.minimum = min(self.minimum, value)
+        self.maximum = max(self.maximum, value)
+        # Fixed-size ring of the most recent samples keeps percentiles current
+        # without unbounded growth.
+        if len(self.samples) < RESERVOIR_SIZE:
+            self.samples.append(value)
+        else:
+            self.samples[self._cursor] = value
+            self._cursor = (self._cursor + 1) % RESERVOIR_SIZE
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "min": self.minimum if self.count else 0.0,
+            "max": self.maximum if self.count else 0.0,
+            "avg": self.total / self.count if self.count else 0.0,
+            "p50": percentile(self.samples, 0.5),
+            "p95": percentile(self.samples, 0.95),
+            "p99": percentile(self.samples, 0.99),
+        }
+
+
+class MetricsRegistry:
+    """Thread-safe registry of counters, gauges and summaries."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[tuple, float] = {}
+        self._gauges: Dict[tuple, float] = {}
+        self._summaries: Dict[tuple, _Summary] = {}
+
+    def incr(self, name: str, value: float = 1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def gauge(self, name: str, value: float, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name: str, value: float, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            summary = self._summaries.get(key)
+            if summary is None:
+                summary = self._summaries[key] = _Summary()
+            summary.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """Observe the wall-clock duration (seconds) of the wrapped block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def counter_value(self, name: str, **labels) -> float:
+        with self._lock:
+            return self._counters.get(_key(name, labels), 0)
+
+    def summary(self, name: str, **labels) -> dict:
+        with self._lock:
+            summary = self._summaries.get(_key(name, labels))
+            return summary.snapshot() if summary else _Summary().snapshot()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "counters": {_render_key(k): v for k, v in self._counters.items()},
+                "gauges": {_render_key(k): v for k, v in self._gauges.items()},
+                "summaries": {_render_key(k): s.snapshot() for k, s in self._summaries.items()},
+            }
+
+
+metrics = MetricsRegistry()
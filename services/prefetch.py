@@ -0,0 +1,305 @@
+"""Speculative generation of the economic case.
+
+The economic case is generated from the finished strategic case, and clients
+almost always ask for it straight after. With ``ECONOMIC_PREFETCH`` enabled,
+a completed strategic case starts the economic case in the background. The
+result is stored under a digest of the economic prompt's inputs: the
+strategic content, the frameworks and the supplementary text. A matching
+``/api/ai/create/economic-case`` request is answered from it, or waits for
+the running generation, instead of generating again. A request waits for a
+running prefetch for at most ``WAIT_SHARE`` of its remaining time, so a fresh
+generation can still finish within the deadline if the prefetch does not.
+
+Prefetch is background work. It only starts while fewer than
+``ECONOMIC_PREFETCH_MAX_LOAD`` request generations are running, and running
+prefetches are cancelled when load reaches that level. A prefetch that a
+request is already waiting on is never cancelled.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from controllers.ai.context import Deadline
+from controllers.ai.context import GenerationContext
+from models.cases.economic import EconomicCase
+from models.cases.economic import EconomicCaseRequest
+from models.cases.strategic import StrategicCaseRequest
+from services.generation import GenerationLoad
+from services.generation import GenerationRunner
+from services.generation import discard_result
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+TAG_RE = re.compile(r"<[^>]+>")
+WHITESPACE_RE = re.compile(r"\s+")
+SECTION_ID_RE = re.compile(r"^\d+(?:-\d+)*$")
+
+# Usage ledger operation of prefetched generations.
+PREFETCH_OPERATION = "prefetch/economic-case"
+
+# Share of a request's remaining time spent waiting for a running prefetch.
+WAIT_SHARE = 0.5
+
+
+def _normalise(text: str) -> str:
+    return WHITESPACE_RE.sub(" ", TAG_RE.sub(" ", text)).strip()
+
+
+def _collect_sections(value, found: List[Tuple[str, str]]):
+    """Collect ``(section_id, html)`` pairs from either strategic case shape.
+
+    Generated cases are ``{"strategic": [{"id": ..., "body": ...}]}``; clients
+    send back ``{"strategic": {"sectionsData": {"1-1": {"content": ...}}}}``.
+    """
+    if isinstance(value, dict):
+        if isinstance(value.get("id"), str) and isinstance(value.get("body"), str):
+            found.append((value["id"], value["body"]))
+            return
+        for key, item in value.items():
+            if SECTION_ID_RE.match(str(key)) and isinstance(item, dict):
+                content = item.get("content", item.get("body"))
+                if isinstance(content, str):
+                    found.append((key, content))
+                    continue
+            _collect_sections(item, found)
+    elif isinstance(value, list):
+        for item in value:
+            _collect_sections(item, found)
+
+
+def strategic_content_digest(strategic_case: str) -> str:
+    """Digest of a strategic case's section text, independent of its JSON shape and markup."""
+    try:
+        found: List[Tuple[str, str]] = []
+        _collect_sections(json.loads(strategic_case), found)
+    except (TypeError, ValueError):
+        found = []
+    if found:
+        text = "\n".join(f"{section_id}:{_normalise(html)}" for section_id, html in sorted(found))
+    else:
+        text = _normalise(strategic_case or "")
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def economic_input_key(request: EconomicCaseRequest) -> str:
+    """Key of everything the economic prompt is built from."""
+    doc = request.document
+    digest = hashlib.sha256(strategic_content_digest(doc.strategicCase).encode("utf-8"))
+    for framework in doc.frameworks or []:
+        digest.update(b"\x00framework:" + framework.strip().encode("utf-8"))
+    for item in doc.supplementaryInformation or []:
+        digest.update(b"\x00supplementary:" + _normalise(item.text or "").encode("utf-8"))
+    return digest.hexdigest()
+
+
+@dataclass
+class _Prefetch:
+    future: Future
+    context: GenerationContext
+    created: float
+
+
+class EconomicPrefetcher:
+    """Background economic-case generation keyed by the strategic content.
+
+    Args:
+        service_factory: Returns an EconomicPromptManager for a GenerationContext.
+        load: Tracker of request-serving generations.
+        max_load: Request generations at or above which prefetch is shed.
+        ttl_seconds: How long a prefetched result may be served.
+        timeout: Deadline, in seconds, of one prefetch.
+        max_entries: Prefetches kept at once; the oldest are dropped first.
+        max_workers: Prefetches generated concurrently.
+    """
+
+    def __init__(
+            self,
+            service_factory: Callable[[GenerationContext], object],
+            load: GenerationLoad,
+            max_load: int = 4,
+            ttl_seconds: float = 1800,
+            timeout: float = 600,
+            max_entries: int = 64,
+            max_workers: int = 1,
+    ):
+        self.service_factory = service_factory
+        self.load = load
+        self.max_load = max_load
+        self.ttl_seconds = ttl_seconds
+        self.timeout = timeout
+        self.max_entries = max_entries
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+        self._entries: "OrderedDict[str, _Prefetch]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._lookups = 0
+        self._hits = 0
+        self._unsubscribe = load.subscribe(self._on_load)
+
+    def schedule(
+            self,
+            strategic_request: StrategicCaseRequest,
+            strategic_response: str,
+            project: str = "",
+    ) -> Optional[str]:
+        """Start generating the economic case that follows ``strategic_response``.
+
+        Args:
+            strategic_request: The strategic case request that was answered.
+            strategic_response: The generated strategic case.
+            project: Project the prefetch's token usage is attributed to.
+
+        Returns:
+            str: The prefetch key, or None when nothing was scheduled.
+        """
+        try:
+            parsed = json.loads(strategic_response)
+        except (TypeError, ValueError):
+            parsed = None
+        if not isinstance(parsed, dict) or not parsed.get("strategic"):
+            metrics.incr("prefetch.skipped", reason="no_strategic_case")
+            return None
+        if self.load.active >= self.max_load:
+            metrics.incr("prefetch.skipped", reason="load")
+            return None
+
+        strategic = strategic_request.document
+        request = EconomicCaseRequest(document=EconomicCase(
+            strategicCase=strategic_response,
+            criticalSuccessFactors=None,
+            frameworks=strategic.frameworks,
+            supplementaryInformation=strategic.supplementaryInformation,
+        ))
+        key = economic_input_key(request)
+        with self._lock:
+            if key in self._entries:
+                metrics.incr("prefetch.skipped", reason="duplicate")
+                return key
+            context = GenerationContext(Deadline(self.timeout), project=project, operation=PREFETCH_OPERATION)
+            future = self._executor.submit(self._generate, request, context)
+            self._entries[key] = _Prefetch(future, context, time.monotonic())
+            while len(self._entries) > self.max_entries:
+                _, dropped = self._entries.popitem(last=False)
+                self._cancel(dropped, "evicted")
+        metrics.incr("prefetch.scheduled")
+        return key
+
+    def _generate(self, request: EconomicCaseRequest, context: GenerationContext) -> str:
+        started = time.perf_counter()
+        try:
+            response = self.service_factory(context).generate_economic_response(request)
+        except Exception as e:
+            if not context.cancelled:
+                metrics.incr("prefetch.failed")
+            logger.info("Economic case prefetch stopped: %s", e)
+            raise
+        metrics.incr("prefetch.completed")
+        metrics.observe("prefetch.generation_seconds", time.perf_counter() - started)
+        return response
+
+    async def take(
+            self,
+            request: EconomicCaseRequest,
+            generation: Optional[GenerationRunner] = None,
+    ) -> Optional[str]:
+        """Return the prefetched economic case for ``request``, if there is one.
+
+        A prefetch that is still running is waited for, as it is ahead of a
+        fresh generation: for at most ``WAIT_SHARE`` of the remaining time of
+        ``generation``'s deadline, and only while its client is connected. A
+        prefetch that is not ready by then is cancelled.
+
+        Args:
+            request: The economic case request.
+            generation: Runner of the request; the prefetch is waited for
+                without limit when None.
+
+        Returns:
+            str: The generated economic case, or None on a miss.
+
+        Raises:
+            GenerationCancelled: If the client disconnected while waiting.
+        """
+        key = economic_input_key(request)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is not None and time.monotonic() - entry.created > self.ttl_seconds:
+            self._cancel(entry, "expired")
+            entry = None
+        if entry is None:
+            self._record_lookup("miss")
+            return None
+
+        result = "hit" if entry.future.done() else "hit_in_flight"
+        waiter = asyncio.wrap_future(entry.future)
+        if result == "hit_in_flight" and generation is not None:
+            waiting = [waiter]
+            if generation.deadline is not None:
+                waiting.append(asyncio.ensure_future(asyncio.sleep(generation.deadline.remaining() * WAIT_SHARE)))
+            try:
+                connected = await generation.wait_any(waiting)
+            finally:
+                for future in waiting[1:]:
+                    future.cancel()
+            if not waiter.done():
+                waiter.add_done_callback(discard_result)
+                self._cancel(entry, "timeout" if connected else "disconnect")
+                self._record_lookup("timeout" if connected else "disconnected")
+                if not connected:
+                    raise generation.context.error()
+                return None
+        try:
+            response = await waiter
+        except Exception:
+            self._record_lookup("failed")
+            return None
+        self._record_lookup(result)
+        return response
+
+    def _record_lookup(self, result: str):
+        with self._lock:
+            self._lookups += 1
+            if result.startswith("hit"):
+                self._hits += 1
+            hit_rate = self._hits / self._lookups
+        metrics.incr("prefetch.lookups", result=result)
+        metrics.gauge("prefetch.hit_rate", hit_rate)
+
+    def _on_load(self, active: int):
+        if active < self.max_load:
+            return
+        with self._lock:
+            shed = [key for key, entry in self._entries.items() if not entry.future.done()]
+            entries = [self._entries.pop(key) for key in shed]
+        for entry in entries:
+            self._cancel(entry, "load")
+
+    @staticmethod
+    def _cancel(entry: _Prefetch, reason: str):
+        if entry.future.done():
+            return
+        metrics.incr("prefetch.cancelled", reason=reason)
+        # A queued prefetch never starts; a running one has its stream closed.
+        if not entry.future.cancel():
+            entry.context.cancel()
+
+    def close(self):
+        self._unsubscribe()
+        with self._lock:
+            entries, self._entries = list(self._entries.values()), OrderedDict()
+        for entry in entries:
+            self._cancel(entry, "shutdown")
+        self._executor.shutdown(wait=False)
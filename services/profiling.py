@@ -0,0 +1,193 @@
+"""On-demand CPU and memory profiling of a live worker.
+
+Nothing runs until a profile is asked for, so an idle worker pays nothing.
+
+:class:`SamplingProfiler` samples the stacks of every thread in the process
+(``sys._current_frames``) at a fixed interval for a bounded time. The result
+is in the folded format of flame-graph tools (``flamegraph.pl``, speedscope,
+inferno): one line per distinct stack, frames from the root separated by
+``;``, then the number of samples. Each stack starts with the thread's name,
+so time on the event loop and in the thread pool can be told apart. Threads
+waiting on a lock, a queue or the selector are left out unless asked for.
+
+:class:`MemoryTracer` wraps ``tracemalloc``. Tracing starts on demand, which
+slows allocation while it runs. Snapshots report the top allocation sites and
+the growth since a baseline, which is taken when tracing starts and can be
+reset.
+"""
+
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from services.metrics import metrics
+
+# Leaf frames of threads that are blocked waiting for work, by file and function.
+IDLE_FRAMES = frozenset({
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("selectors.py", "select"),
+    ("thread.py", "_worker"),
+})
+
+MEMORY_GROUPINGS = ("lineno", "filename", "traceback")
+
+
+class ProfilerBusyError(RuntimeError):
+    """Raised when a profile is requested while another one runs."""
+
+
+def frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Time-bounded sampling CPU profiler producing folded stacks.
+
+    Args:
+        max_seconds: Longest profile that may be asked for.
+    """
+
+    def __init__(self, max_seconds: float = 60):
+        self.max_seconds = max_seconds
+        self._lock = threading.Lock()
+
+    def profile(self, seconds: float, interval: float = 0.01, include_idle: bool = False) -> str:
+        """Sample every thread for ``seconds`` and return the folded stacks.
+
+        Blocks the calling thread for the duration; it is not sampled.
+
+        Args:
+            seconds: How long to sample, capped at ``max_seconds``.
+            interval: Seconds between samples.
+            include_idle: Keep threads that are blocked waiting for work.
+
+        Raises:
+            ProfilerBusyError: If another profile is running.
+        """
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusyError("A CPU profile is already running in this worker")
+        try:
+            return self._sample(min(seconds, self.max_seconds), interval, include_idle)
+        finally:
+            self._lock.release()
+
+    @staticmethod
+    def _sample(seconds: float, interval: float, include_idle: bool) -> str:
+        own = threading.get_ident()
+        stacks: Counter = Counter()
+        samples = 0
+        started = time.perf_counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                code = frame.f_code
+                if not include_idle and (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(frame_label(frame.f_code))
+                    frame = frame.f_back
+                labels.append(names.get(ident, f"thread-{ident}"))
+                stacks[";".join(reversed(labels))] += 1
+            samples += 1
+            time.sleep(interval)
+        metrics.incr("profiling.cpu_profiles")
+        metrics.observe("profiling.cpu_profile_seconds", time.perf_counter() - started)
+        metrics.gauge("profiling.cpu_samples", samples)
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+class MemoryTracer:
+    """On-demand ``tracemalloc`` snapshots and diffs against a baseline."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._baseline: Optional[tracemalloc.Snapshot] = None
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    @staticmethod
+    def _snapshot() -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ))
+
+    def start(self, frames: int = 1):
+        """Start tracing with ``frames`` frames per allocation and take the baseline."""
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(frames)
+                metrics.gauge("profiling.tracemalloc", 1)
+            self._baseline = self._snapshot()
+
+    def stop(self):
+        """Stop tracing and drop the traces."""
+        with self._lock:
+            self._baseline = None
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+                metrics.gauge("profiling.tracemalloc", 0)
+
+    def report(self, limit: int = 25, group_by: str = "lineno", reset: bool = False) -> Dict[str, object]:
+        """Top allocation sites and the growth since the baseline.
+
+        Args:
+            limit: Sites listed in each of ``top`` and ``diff``.
+            group_by: ``lineno``, ``filename`` or ``traceback``.
+            reset: Make this snapshot the new baseline.
+
+        Raises:
+            RuntimeError: If tracing has not been started.
+        """
+        if group_by not in MEMORY_GROUPINGS:
+            raise ValueError(f"Unknown grouping: {group_by}")
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                raise RuntimeError("Memory tracing has not been started")
+            snapshot = self._snapshot()
+            baseline = self._baseline
+            if reset or baseline is None:
+                self._baseline = snapshot
+            current, peak = tracemalloc.get_traced_memory()
+            overhead = tracemalloc.get_tracemalloc_memory()
+
+        top = snapshot.statistics(group_by)[:limit]
+        diff = snapshot.compare_to(baseline, group_by)[:limit] if baseline is not None else []
+        metrics.incr("profiling.memory_snapshots")
+        return dict(
+            tracedBytes=current,
+            peakBytes=peak,
+            tracemallocBytes=overhead,
+            top=[dict(site=_site(stat.traceback), sizeBytes=stat.size, count=stat.count) for stat in top],
+            diff=[
+                dict(
+                    site=_site(stat.traceback),
+                    sizeBytes=stat.size,
+                    sizeDiffBytes=stat.size_diff,
+                    count=stat.count,
+                    countDiff=stat.count_diff,
+                )
+                for stat in diff
+            ],
+        )
+
+
+def _site(traceback: tracemalloc.Traceback) -> List[str]:
+    """Frames of an allocation site, outermost first."""
+    return [f"{frame.filename}:{frame.lineno}" for frame in traceback]
@@ -0,0 +1,188 @@
+"""Progressive two-tier section generation.
+
+The large model takes a while to generate a section, and the JSON it answers
+with cannot be shown until it is complete. In progressive mode a small, fast
+model (``DRAFT_MODEL_ID``) streams a plain HTML draft of the section while
+the large model generates the final one. Both are delivered over one stream
+of events:
+
+- ``draft`` with the next piece of the draft's text;
+- ``final`` with the section content, which replaces the draft;
+- ``done`` with the timings.
+
+The draft is cancelled as soon as the final section is ready, and a draft
+that fails is dropped without affecting the final section. Time to first
+useful content (the first piece of the draft, or the final section if it
+comes first) is recorded as ``progressive.ttfuc_seconds`` and reported
+separately from ``progressive.final_seconds``.
+
+The draft is a model call of its own, so it is admitted by the scheduler
+with its own ticket, at ``bulk`` priority: it only takes a free slot and
+never delays other requests' generations. A draft that has not been admitted
+when the final section is ready, or that is shed, is skipped. It runs under
+its own :class:`GenerationContext`, linked to the request's so it is
+cancelled with it. Its tokens are attributed to the request's project and
+operation.
+"""
+
+import asyncio
+import time
+from typing import AsyncIterator
+from typing import Optional
+from typing import Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+from controllers.ai.base import BaseAIController
+from controllers.ai.context import GenerationContext
+from models.cases.section import SectionGeneration
+from services.generation import GenerationRunner
+from services.generation import discard_result
+from services.generation import load
+from services.metrics import metrics
+from services.prompt.manager import PromptManager
+from services.scheduler import BULK
+
+DRAFT = "draft"
+FINAL = "final"
+DONE = "done"
+
+# Outcome of the draft once the final section is ready.
+COMPLETED = "completed"
+CANCELLED = "cancelled"
+FAILED = "failed"
+DISABLED = "disabled"
+SKIPPED = "skipped"
+
+# Drafts only improve latency, so they yield to every other generation.
+DRAFT_PRIORITY = BULK
+
+
+async def progressive_section(
+        generation: GenerationRunner,
+        service: PromptManager,
+        request: SectionGeneration,
+        draft_controller: Optional[BaseAIController] = None,
+        draft_max_tokens: Optional[int] = None,
+) -> AsyncIterator[Tuple[str, dict]]:
+    """Generate a section, streaming a draft until the final section is ready.
+
+    Args:
+        generation: Runner of the request being served.
+        service: PromptManager bound to the request's context; generates the
+            final section.
+        request: Section generation inputs.
+        draft_controller: Controller of the draft model; only the final
+            section is generated when None.
+        draft_max_tokens: Optional cap on the length of the draft.
+
+    Yields:
+        tuple: ``(event, data)`` pairs; ``draft`` events, then ``final`` and
+        ``done``. Nothing more is yielded if the client disconnects.
+
+    Raises:
+        Exception: Whatever the final generation raised, and
+            DeadlineExceeded if the deadline passes.
+    """
+    context = generation.context
+    started = time.perf_counter()
+    first_useful: Optional[float] = None
+    draft_chars = 0
+    outcome = DISABLED
+
+    async with generation.admit():
+        final = asyncio.ensure_future(run_in_threadpool(service.generate_section, request))
+        draft_context, pieces, next_piece, unlink = None, None, None, None
+        ticket, drafting = None, False
+        scheduler = generation.scheduler
+
+        def start_draft():
+            nonlocal draft_context, pieces, next_piece, unlink, drafting
+            load.enter()
+            drafting = True
+            draft_context = GenerationContext(context.deadline, project=context.project, operation=context.operation)
+            unlink = context.on_cancel(draft_context.cancel)
+            pieces = service.stream_section_draft(request, draft_controller, draft_context, draft_max_tokens)
+            next_piece = asyncio.ensure_future(run_in_threadpool(next, pieces, None))
+
+        if draft_controller is not None:
+            if scheduler is None:
+                start_draft()
+            elif scheduler.check(DRAFT_PRIORITY) is None:
+                ticket = scheduler.enqueue(generation.tenant, DRAFT_PRIORITY)
+            else:
+                outcome = SKIPPED
+        try:
+            while not final.done():
+                waiting = [final]
+                if next_piece is not None:
+                    waiting.append(next_piece)
+                elif ticket is not None and not drafting:
+                    waiting.append(ticket.granted)
+                if not await generation.wait_any(waiting):
+                    return
+                if final.done():
+                    continue
+                if next_piece is None:
+                    if ticket is not None and not drafting and ticket.granted.done():
+                        if ticket.granted.exception() is None:
+                            start_draft()
+                        else:
+                            outcome = SKIPPED
+                            scheduler.release(ticket)
+                            ticket = None
+                    continue
+                if not next_piece.done():
+                    continue
+                try:
+                    piece = next_piece.result()
+                except Exception:
+                    outcome, next_piece = FAILED, None
+                    continue
+                if piece is None:
+                    outcome, next_piece = COMPLETED, None
+                    continue
+                if first_useful is None:
+                    first_useful = time.perf_counter() - started
+                    metrics.observe("progressive.ttfuc_seconds", first_useful, tier=DRAFT)
+                draft_chars += len(piece)
+                yield DRAFT, {"text": piece}
+                next_piece = asyncio.ensure_future(run_in_threadpool(next, pieces, None))
+
+            section = await final
+            final_seconds = time.perf_counter() - started
+            if next_piece is not None:
+                outcome = CANCELLED
+            elif ticket is not None and not drafting:
+                outcome = SKIPPED
+            if first_useful is None:
+                first_useful = final_seconds
+                metrics.observe("progressive.ttfuc_seconds", first_useful, tier=FINAL)
+            metrics.observe("progressive.final_seconds", final_seconds)
+            metrics.incr("progressive.drafts", result=outcome)
+            yield FINAL, {"content": section.content}
+            yield DONE, {
+                "ttfucSeconds": round(first_useful, 3),
+                "finalSeconds": round(final_seconds, 3),
+                "draft": outcome,
+                "draftChars": draft_chars,
+            }
+        finally:
+            if next_piece is not None:
+                # Closing the context ends the draft's Bedrock stream.
+                draft_context.cancel()
+                next_piece.add_done_callback(discard_result)
+                try:
+                    pieces.close()
+                except ValueError:
+                    # Still running in the thread pool; it stops on the cancelled context.
+                    pass
+            if not final.done():
+                context.cancel()
+                final.add_done_callback(discard_result)
+            if unlink is not None:
+                unlink()
+            if drafting:
+                load.exit()
+            if ticket is not None:
+                scheduler.release(ticket)
@@ -0,0 +1,354 @@
+"""Prompt template compiler and token accounting.
+
+Section prompts are f-strings that embed shared instruction blocks
+(``REPEATED_PROMPT``, ``OPTIONS_FRAMEWORK_PROMPT``), and some section bodies
+repeat lines of those blocks. At import, every section prompt is split into
+segments: the section's own text and the shared blocks it embeds. Shared
+blocks are normalised once and reused by every section, each is included at
+most once per prompt, and section lines that repeat a line of an included
+block are dropped. The prompt managers build on :data:`COMPILED_SECTIONS`
+and :func:`compile_prompt` instead of the raw templates.
+
+:func:`prompt_report` renders the fixed part of every route's prompt (the
+system prompt and the template, without request content) and lists its
+estimated tokens, instruction lines repeated within it, and lines repeated
+across templates. Run it as a check with::
+
+    python -m services.prompt.compiler --budget /api/ai/create/section=2500
+
+which exits non-zero when a route exceeds its budget (and, with
+``--strict``, when a prompt repeats an instruction).
+"""
+
+import argparse
+import json
+import re
+import sys
+import textwrap
+from dataclasses import dataclass
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+from typing import Union
+
+from services.prompt.sections import BLANK_PROMPT
+from services.prompt.sections import OPTIONS_FRAMEWORK_PROMPT
+from services.prompt.sections import REPEATED_PROMPT
+from services.prompt.sections import SECTION_PROMPTS
+from services.prompt.tokens import estimate_tokens
+
+# Shorter lines (and list items) are too generic to count as repeated instructions.
+MIN_DUPLICATE_CHARS = 40
+
+# Per-item markers that case schemas repeat on purpose.
+PLACEHOLDERS = frozenset({BLANK_PROMPT.strip()})
+
+
+def normalise(text: str) -> str:
+    """Dedent ``text``, strip trailing whitespace and collapse blank lines."""
+    lines = []
+    for line in textwrap.dedent(text).strip().splitlines():
+        line = line.rstrip()
+        if line or (lines and lines[-1]):
+            lines.append(line)
+    return "\n".join(lines)
+
+
+def instruction_lines(text: str) -> List[str]:
+    """Lines of ``text`` that are checked for repetition."""
+    lines = (line.strip() for line in text.splitlines())
+    return [line for line in lines if len(line) >= MIN_DUPLICATE_CHARS and not line.startswith("-")]
+
+
+@dataclass(frozen=True)
+class Segment:
+    name: str
+    text: str
+    tokens: int
+    shared: bool = False
+
+
+def segment(name: str, text: str, shared: bool = False) -> Segment:
+    text = normalise(text)
+    return Segment(name, text, estimate_tokens(text), shared)
+
+
+SHARED_SEGMENTS = {
+    "options_framework": segment("options_framework", OPTIONS_FRAMEWORK_PROMPT, shared=True),
+    "repeated": segment("repeated", REPEATED_PROMPT, shared=True),
+}
+
+_SHARED_BY_SOURCE = {
+    OPTIONS_FRAMEWORK_PROMPT: SHARED_SEGMENTS["options_framework"],
+    REPEATED_PROMPT: SHARED_SEGMENTS["repeated"],
+}
+_SHARED_RE = re.compile("|".join(re.escape(text) for text in _SHARED_BY_SOURCE))
+
+
+@dataclass(frozen=True)
+class CompiledPrompt:
+    name: str
+    segments: Tuple[Segment, ...]
+    text: str
+    tokens: int
+    source_tokens: int
+
+    @property
+    def body(self) -> str:
+        """The prompt without its shared segments."""
+        return "\n".join(part.text for part in self.segments if not part.shared)
+
+
+def compile_prompt(
+        name: str,
+        parts: Sequence[Union[Segment, str]],
+        source_tokens: Optional[int] = None,
+) -> CompiledPrompt:
+    """Join template parts into one prompt without repeated instructions.
+
+    Args:
+        name: Name of the prompt, used in reports.
+        parts: Template text and shared segments, in order.
+        source_tokens: Estimated tokens of the uncompiled template; defaults
+            to the tokens of ``parts`` joined as given.
+
+    Returns:
+        CompiledPrompt: The prompt, with each shared segment included once
+        and lines of the other parts that repeat an earlier or shared
+        instruction removed.
+    """
+    shared = [part for part in parts if isinstance(part, Segment)]
+    known = {line for part in shared for line in instruction_lines(part.text)}
+    included = set()
+    segments = []
+    for index, part in enumerate(parts):
+        if isinstance(part, Segment):
+            if part.name not in included:
+                included.add(part.name)
+                segments.append(part)
+            continue
+        kept = []
+        for line in normalise(part).splitlines():
+            key = line.strip()
+            if key in known:
+                continue
+            known.update(instruction_lines(key))
+            kept.append(line)
+        text = normalise("\n".join(kept))
+        if text:
+            segments.append(segment(f"{name}#{index}", text))
+
+    text = "\n".join(part.text for part in segments)
+    if source_tokens is None:
+        source_tokens = estimate_tokens("".join(part if isinstance(part, str) else part.text for part in parts))
+    return CompiledPrompt(name, tuple(segments), text, estimate_tokens(text), source_tokens)
+
+
+def split_template(template: str) -> List[Union[Segment, str]]:
+    """Split a template into its own text and the shared blocks it embeds."""
+    parts: List[Union[Segment, str]] = []
+    position = 0
+    for match in _SHARED_RE.finditer(template):
+        parts.append(template[position:match.start()])
+        parts.append(_SHARED_BY_SOURCE[match.group()])
+        position = match.end()
+    parts.append(template[position:])
+    return parts
+
+
+def compile_sections() -> Dict[str, CompiledPrompt]:
+    """Compile every entry of ``SECTION_PROMPTS``."""
+    return {
+        section_id: compile_prompt(section_id, split_template(template), estimate_tokens(template))
+        for section_id, template in SECTION_PROMPTS.items()
+    }
+
+
+COMPILED_SECTIONS = compile_sections()
+
+
+@dataclass(frozen=True)
+class RoutePrompt:
+    route: str
+    variant: str
+    system: str
+    template: str
+
+    @property
+    def tokens(self) -> int:
+        return estimate_tokens(self.system) + estimate_tokens(self.template)
+
+
+def route_prompts() -> List[RoutePrompt]:
+    """The fixed prompt of every route, rendered from an empty request."""
+    from services.prompt.economic import EconomicPromptManager
+    from services.prompt.manager import DRAFT_OUTPUT_INSTRUCTIONS
+    from services.prompt.manager import PromptManager
+    from services.prompt.manager import edit_prompt
+    from services.prompt.manager import policy_document_prompt
+    from services.prompt.manager import section_prompt
+    from services.prompt.manager import summary_prompt
+    from services.prompts import SYSTEM_CREATE_CASE
+    from services.prompts import SYSTEM_DOCUMENT_ACCESSIBLE_PROMPT
+    from services.prompts import SYSTEM_SUMMARISE_SUPPLEMENTARY_INFORMATION
+    from services.prompts import SYSTEM_UPDATE_SECTION_EXCERPT
+    from models.cases.economic import EconomicCase
+    from models.cases.economic import EconomicCaseRequest
+    from models.cases.strategic import ProjectSector
+    from models.cases.strategic import StrategicCase
+    from models.cases.strategic import StrategicCaseRequest
+    from models.section import SectionModel
+
+    strategic = StrategicCaseRequest(document=StrategicCase(
+        projectTitle="", projectDescription="", projectSector=ProjectSector.OTHER, supplementaryInformation=None,
+    ))
+    economic = EconomicCaseRequest(document=EconomicCase(
+        strategicCase="", criticalSuccessFactors=None, supplementaryInformation=None,
+    ))
+    params = dict.fromkeys(
+        ("projectTitle", "projectDescription", "keyFactsIssues", "estimatedBudget", "location", "projectSector"), "",
+    )
+
+    routes = [
+        RoutePrompt("/api/ai/create/section", section_id, SYSTEM_CREATE_CASE,
+                    section_prompt(section_id, [], json.dumps(params), []))
+        for section_id in COMPILED_SECTIONS
+    ]
+    routes += [
+        RoutePrompt("/api/ai/create/section/stream", f"draft {section_id}", SYSTEM_CREATE_CASE,
+                    section_prompt(section_id, [], json.dumps(params), [], DRAFT_OUTPUT_INSTRUCTIONS))
+        for section_id in COMPILED_SECTIONS
+    ]
+    for section_id, variant in (("1-1", "default"), ("2-3-2", "options_framework")):
+        routes.append(RoutePrompt(
+            "/api/ai/update/section/additional", variant, SYSTEM_UPDATE_SECTION_EXCERPT,
+            edit_prompt([SectionModel(sectionID=section_id)], "", "", ""),
+        ))
+    routes += [
+        RoutePrompt("/api/ai/create/strategic-case", "default", SYSTEM_CREATE_CASE,
+                    PromptManager.process_strategic_response(strategic)),
+        RoutePrompt("/api/ai/create/economic-case", "default", SYSTEM_CREATE_CASE,
+                    EconomicPromptManager.process_economic_response(economic)),
+        RoutePrompt("/api/ai/policy-docs", "default", SYSTEM_DOCUMENT_ACCESSIBLE_PROMPT, policy_document_prompt("")),
+        RoutePrompt("/api/ai/summarise", "default", SYSTEM_SUMMARISE_SUPPLEMENTARY_INFORMATION, summary_prompt("")),
+    ]
+    return routes
+
+
+def _repeated(lines: Sequence[str]) -> List[str]:
+    counts: Dict[str, int] = {}
+    for line in lines:
+        counts[line] = counts.get(line, 0) + 1
+    return [line for line, count in counts.items() if count > 1 and line not in PLACEHOLDERS]
+
+
+def duplicated_blocks() -> List[dict]:
+    """Instruction lines that occur in more than one template."""
+    from services import prompts
+
+    templates = {
+        name: value for name, value in vars(prompts).items() if name.startswith("SYSTEM_") and isinstance(value, str)
+    }
+    templates.update({f"segment {shared.name}": shared.text for shared in SHARED_SEGMENTS.values()})
+    for section_id, compiled in COMPILED_SECTIONS.items():
+        templates[f"section {section_id}"] = compiled.body
+
+    found: Dict[str, List[str]] = {}
+    for name, text in templates.items():
+        for line in set(instruction_lines(text)):
+            found.setdefault(line, []).append(name)
+    return [
+        dict(text=line, tokens=estimate_tokens(line), templates=sorted(names))
+        for line, names in sorted(found.items(), key=lambda item: -len(item[1]))
+        if len(names) > 1
+    ]
+
+
+def prompt_report(budgets: Optional[Dict[str, int]] = None) -> dict:
+    """Token counts and repeated instructions of every prompt template.
+
+    Args:
+        budgets: Token budget per route; a route's variants are each held to
+            it.
+
+    Returns:
+        dict: ``routes`` with the tokens of each route's fixed prompt, its
+        budget and the instructions it repeats; ``sections`` with each
+        section's tokens before and after compilation; ``duplicatedBlocks``
+        with the lines shared by several templates; and ``overBudget``.
+    """
+    budgets = budgets or {}
+    routes = []
+    for prompt in route_prompts():
+        budget = budgets.get(prompt.route)
+        routes.append(dict(
+            route=prompt.route,
+            variant=prompt.variant,
+            systemTokens=estimate_tokens(prompt.system),
+            templateTokens=estimate_tokens(prompt.template),
+            totalTokens=prompt.tokens,
+            budget=budget,
+            overBudget=budget is not None and prompt.tokens > budget,
+            repeatedLines=_repeated(instruction_lines(prompt.system) + instruction_lines(prompt.template)),
+        ))
+    sections = [
+        dict(
+            sectionId=section_id,
+            sourceTokens=compiled.source_tokens,
+            compiledTokens=compiled.tokens,
+            sharedSegments=[part.name for part in compiled.segments if part.shared],
+        )
+        for section_id, compiled in COMPILED_SECTIONS.items()
+    ]
+    return dict(
+        routes=routes,
+        sections=sections,
+        duplicatedBlocks=duplicated_blocks(),
+        overBudget=[route for route in routes if route["overBudget"]],
+    )
+
+
+def _budget(value: str) -> Tuple[str, int]:
+    route, _, tokens = value.rpartition("=")
+    if not route:
+        raise argparse.ArgumentTypeError(f"expected ROUTE=TOKENS, got {value!r}")
+    return route, int(tokens)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    from services.settings import load_settings
+
+    parser = argparse.ArgumentParser(description="Report the token cost of every prompt template.")
+    parser.add_argument("--budget", action="append", type=_budget, default=[], metavar="ROUTE=TOKENS",
+                        help="token budget of a route; overrides PROMPT_TOKEN_BUDGETS")
+    parser.add_argument("--strict", action="store_true", help="also fail when a prompt repeats an instruction")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    budgets = {**load_settings().prompt_token_budgets, **dict(args.budget)}
+    report = prompt_report(budgets)
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    else:
+        for route in report["routes"]:
+            budget = "" if route["budget"] is None else f" / {route['budget']}"
+            flag = " OVER BUDGET" if route["overBudget"] else ""
+            print(f"{route['route']} [{route['variant']}]: {route['totalTokens']}{budget} tokens "
+                  f"(system {route['systemTokens']}){flag}")
+            for line in route["repeatedLines"]:
+                print(f"    repeated: {line}")
+        print("\nSections (tokens before -> after compilation):")
+        for section in report["sections"]:
+            print(f"  {section['sectionId']}: {section['sourceTokens']} -> {section['compiledTokens']}")
+        print("\nLines repeated across templates:")
+        for block in report["duplicatedBlocks"]:
+            print(f"  {len(block['templates'])}x ~{block['tokens']} tokens: {block['text']}")
+
+    repeated = any(route["repeatedLines"] for route in report["routes"])
+    return 1 if report["overBudget"] or (args.strict and repeated) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
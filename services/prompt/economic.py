@@ -1,18 +1,100 @@
 from typing import Any
+from typing import Optional
 
 from controllers.ai.base import BaseAIController
+from controllers.ai.context import GenerationContext
 from models.cases.economic import EconomicCase
+from models.cases.economic import EconomicCaseSections
 from models.cases.economic import EconomicCaseRequest
 from models.cases.economic import EconomicCaseResponse
+from services.prompt.compiler import COMPILED_SECTIONS
+from services.prompt.compiler import SHARED_SEGMENTS
 from services.prompt.sections import BLANK_PROMPT
-from services.prompt.sections import SECTION_PROMPTS
+from services.prompt.repair import JSONRepairError
+from services.prompt.structured import load_json
+from services.prompt.structured import structured_kwargs
 from services.prompts import SYSTEM_CREATE_CASE
+from services.settings import Settings
+
+
+# Built once at import from the compiled section prompts; the instructions the
+# sections share follow the schema once instead of repeating in every description.
+ECONOMIC_SECTIONS_SCHEMA = f'''
+        {{
+            "economic1": [
+                {{
+                    "id": "2-1",
+                    "name": "2.1 Purpose of Economic Case",
+                    "description": "{COMPILED_SECTIONS['2-1'].body}"
+                }},
+                {{
+                    "id": "2-2",
+                    "name": "2.2 Market Failure",
+                    "description": "{COMPILED_SECTIONS['2-2'].body}"
+                }},
+                {{
+                    "id": "2-3",
+                    "name": "2.3 Longlist to Shortlist using the Options Framework",
+                    "description": "{COMPILED_SECTIONS['2-3'].body}"
+                }},
+                {{
+                    "id": "2-3-1",
+                    "name": "2.3.1 Critical Success Factors",
+                    "description": "{BLANK_PROMPT}
+                }},
+                {{
+                    "id": "2-3-2",
+                    "name": "2.3.2 Scope Options",
+                    "description": "{BLANK_PROMPT}"
+                }},
+                {{
+                    "id": "2-3-3",
+                    "name": "2.3.3 Solution Options",
+                    "description": "{BLANK_PROMPT}"
+                }},
+                {{
+                    "id": "2-3-4",
+                    "name": "2.3.4 Delivery Options",
+                    "description": "{BLANK_PROMPT}"
+                }},
+                {{
+                    "id": "2-3-5",
+                    "name": "2.3.5 Implementation",
+                    "description": "{BLANK_PROMPT}"
+                }},
+                {{
+                    "id": "2-3-6",
+                    "name": "2.3.6 Funding Options",
+                    "description": "{BLANK_PROMPT}"
+                }},
+                {{
+                    "id": "2-4",
+                    "name": "2.4 Options Framework Summary",
+                    "description": "{BLANK_PROMPT}"
+                }},
+                {{
+                    "id": "2-5",
+                    "name": "2.5 Shortlist of Options",
+                    "description": "{BLANK_PROMPT}"
+                }}
+            ]
+        }}
+        The content of every section must follow these instructions:
+        {SHARED_SEGMENTS['repeated'].text}
+        '''
 
 
 class EconomicPromptManager:
 
-    def __init__(self, ai_controller: BaseAIController):
+    def __init__(
+            self,
+            ai_controller: BaseAIController,
+            settings: Optional[Settings] = None,
+            context: Optional[GenerationContext] = None,
+    ):
         self.ai_controller = ai_controller
+        self.settings = settings or Settings()
+        self.context = context or GenerationContext()
 
     def generate_economic_response(self, economic_case: EconomicCaseRequest) -> Any:
         """
@@ -27,13 +109,24 @@ class EconomicPromptManager:
 
         response = self.ai_controller.generate_response(
             user_prompt=self.process_economic_response(economic_case),
-            system_prompt=system_prompt
+            system_prompt=system_prompt,
+            context=self.context,
+            **structured_kwargs(self.settings.structured_output, EconomicCaseSections, allow_error=True),
         )
+        try:
+            response = load_json(
+                response, self.ai_controller, EconomicCaseSections, "economic1",
+                self.settings.structured_output, context=self.context, allow_error=True,
+            ).text
+        except JSONRepairError:
+            # Passed on as-is; structured callers report the parse error.
+            pass
 
         print(response)
         return response
 
-    def process_economic_response(self, response: EconomicCase) -> EconomicCaseResponse:
+    @staticmethod
+    def process_economic_response(response: EconomicCase) -> EconomicCaseResponse:
         doc = response.document
         prompt = """"""
         # Add each section if it exists
@@ -85,67 +178,7 @@ class EconomicPromptManager:
         Otherwise, you must generate the **Economic Case Part 1**  of in JSON format with the following JSON structure, adding to each JSON object in the list a “body”: “<html string>” attribute the “body” will be where you provide the required content as a HTML snippet as described in the Five Case Model Full Business Case strategy and the “description” element of that item:
         \n\n
         """
-        prompt += f'''
-        {{
-            "economic1": [
-                {{
-                    "id": "2-1",
-                    "name": "2.1 Purpose of Economic Case",
-                    "description": "{SECTION_PROMPTS['2-1']}"
-                }},
-                {{
-                    "id": "2-2",
-                    "name": "2.2 Market Failure",
-                    "description": "{SECTION_PROMPTS['2-2']}"
-                }},
-                {{
-                    "id": "2-3",
-                    "name": "2.3 Longlist to Shortlist using the Options Framework",
-                    "description": "{SECTION_PROMPTS['2-3']}"
-                }},
-                {{
-                    "id": "2-3-1",
-                    "name": "2.3.1 Critical Success Factors",
-                    "description": "{BLANK_PROMPT}
-                }},
-                {{
-                    "id": "2-3-2",
-                    "name": "2.3.2 Scope Options",
-                    "description": "{BLANK_PROMPT}"
-                }},
-                {{
-                    "id": "2-3-3",
-                    "name": "2.3.3 Solution Options",
-                    "description": "{BLANK_PROMPT}"
-                }},
-                {{
-                    "id": "2-3-4",
-                    "name": "2.3.4 Delivery Options",
-                    "description": "{BLANK_PROMPT}"
-                }},
-                {{
-                    "id": "2-3-5",
-                    "name": "2.3.5 Implementation",
-                    "description": "{BLANK_PROMPT}"
-                }},
-                {{
-                    "id": "2-3-6",
-                    "name": "2.3.6 Funding Options",
-                    "description": "{BLANK_PROMPT}"
-                }},
-                {{
-                    "id": "2-4",
-                    "name": "2.4 Options Framework Summary",
-                    "description": "{BLANK_PROMPT}"
-                }},
-                {{
-                    "id": "2-5",
-                    "name": "2.5 Shortlist of Options",
-                    "description": "{BLANK_PROMPT}"
-                }}
-            ]
-        }}
-        '''
+        prompt += ECONOMIC_SECTIONS_SCHEMA
 
         prompt += f"""
         Please provide a response that is strictly factual, referenceable, and based only on verified information. Do not include any fictional, speculative, or unverifiable content. If a claim cannot be backed up by a reliable source, please omit it entirely. Where possible, include hyperlinks to reputable sources so I can verify the information directly. Only include content that can be substantiated.
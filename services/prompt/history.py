@@ -0,0 +1,112 @@
+"""Rolling compaction of editing conversation history.
+
+Long editing sessions resend the whole conversation on every turn. The
+compactor keeps the most recent turns verbatim and replaces the older ones with
+a summary once the history exceeds a token threshold.
+
+Summaries are cached under a digest of the turns they cover, so each prefix of
+a conversation is summarised at most once per worker. When a conversation
+grows, the summary of the longest cached prefix is extended with only the
+turns that have since become "old", rather than re-summarising from scratch.
+"""
+
+import hashlib
+from typing import List
+from typing import Optional
+
+from controllers.ai.base import BaseAIController
+from controllers.ai.context import GenerationContext
+from models.section import SectionPromptsModel
+from services.cache import LRUCache
+from services.metrics import metrics
+from services.prompt.tokens import estimate_tokens
+from services.prompts import SYSTEM_SUMMARISE_CONVERSATION
+
+_summary_cache = LRUCache(max_entries=2048)
+
+
+def render_turn(turn: SectionPromptsModel) -> str:
+    sender = turn.sender.value if turn.sender else "UNKNOWN"
+    return f"{sender}: {turn.text}"
+
+
+def _prefix_digests(rendered: List[str]) -> List[str]:
+    """Digest of every prefix of the conversation, chained turn by turn."""
+    digests = []
+    digest = hashlib.sha256()
+    for turn in rendered:
+        digest.update(turn.encode("utf-8"))
+        digest.update(b"\x00")
+        digests.append(digest.copy().hexdigest())
+    return digests
+
+
+class HistoryCompactor:
+    """Render conversation history within a token threshold.
+
+    Args:
+        ai_controller: Controller used to produce summaries.
+        keep_last: Number of most recent turns always kept verbatim.
+        token_threshold: Estimated tokens above which older turns are summarised.
+        cache: Summary cache; defaults to the worker-wide cache.
+        context: Context of the request the summaries are made for.
+    """
+
+    def __init__(
+            self,
+            ai_controller: BaseAIController,
+            keep_last: int = 4,
+            token_threshold: int = 1500,
+            cache: Optional[LRUCache] = None,
+            context: Optional[GenerationContext] = None,
+    ):
+        self.ai_controller = ai_controller
+        self.keep_last = keep_last
+        self.token_threshold = token_threshold
+        self.cache = cache if cache is not None else _summary_cache
+        self.context = context
+
+    def render(self, turns: List[SectionPromptsModel]) -> str:
+        """Return the history as prompt text, compacting older turns if needed."""
+        rendered = [render_turn(turn) for turn in turns]
+        full = "\n".join(rendered)
+        full_tokens = estimate_tokens(full)
+        if len(rendered) <= self.keep_last or full_tokens <= self.token_threshold:
+            return full
+
+        older = rendered[:-self.keep_last] if self.keep_last else rendered
+        recent = rendered[-self.keep_last:] if self.keep_last else []
+        summary = self._summarise(older)
+        compacted = "\n".join([f"Summary of the earlier conversation: {summary}", *recent])
+
+        metrics.incr("history.compactions")
+        metrics.incr("history.tokens_saved", max(0, full_tokens - estimate_tokens(compacted)))
+        return compacted
+
+    def _summarise(self, older: List[str]) -> str:
+        digests = _prefix_digests(older)
+        cached = self.cache.get(digests[-1])
+        if cached is not None:
+            metrics.incr("history.summary_cache", result="hit")
+            return cached
+
+        # Extend the summary of the longest already-summarised prefix.
+        previous, start = None, 0
+        for index in range(len(older) - 2, -1, -1):
+            previous = self.cache.get(digests[index])
+            if previous is not None:
+                start = index + 1
+                break
+        metrics.incr("history.summary_cache", result="partial" if previous else "miss")
+
+        prompt = ""
+        if previous:
+            prompt += f"Summary of the conversation so far:\n{previous}\n\n"
+        prompt += "Conversation:\n" + "\n".join(older[start:])
+        summary = self.ai_controller.generate_response(
+            system_prompt=SYSTEM_SUMMARISE_CONVERSATION,
+            user_prompt=prompt,
+            context=self.context,
+        ).strip()
+        self.cache.set(digests[-1], summary)
+        return summary
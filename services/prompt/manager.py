@@ -1,26 +1,53 @@
+import hashlib
 import json
 from typing import Any
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import Type
 
+from pydantic import BaseModel
 from pydantic_core import ValidationError
 
 from controllers.ai.base import BaseAIController
+from controllers.ai.context import GenerationContext
+from models.base import ResponseModel
 from models.cases.section import SectionGeneration
 from models.cases.section import SectionGenerationResponse
 from models.cases.strategic import StrategicCase
 from models.cases.strategic import StrategicCaseResponse
 from models.cases.supplementary import SupplementaryInfo
 from models.cases.supplementary import SupplementaryInfoResponse
+from models.cases.strategic import StrategicCaseSections
+from models.doc import PolicyDocumentKnowledge
 from models.doc import PolicyDocumentResponse
 from models.section import PromptsRequestModel
 from models.section import PromptsResponseModel
+from models.section import SectionModel
+from services.catalogue import PolicyCatalogue
+from services.metrics import metrics
+from services.prompt.compiler import COMPILED_SECTIONS
+from services.prompt.compiler import SHARED_SEGMENTS
+from services.prompt.compiler import compile_prompt
+from services.prompt.history import HistoryCompactor
+from services.prompt.relevance import case_context_index
+from services.prompt.repair import JSONRepairError
+from services.prompt.repair import RepairResult
+from services.prompt.structured import load_json
+from services.prompt.structured import record_parse
+from services.prompt.structured import structured_kwargs
 from services.prompt.sections import BLANK_PROMPT
-from services.prompt.sections import OPTIONS_FRAMEWORK_PROMPT
-from services.prompt.sections import REPEATED_PROMPT
-from services.prompt.sections import SECTION_PROMPTS
+from services.prompt.similarity import EditCache
+from services.prompt.similarity import edit_scope
+from services.generation import GenerationRunner
+from services.prompt.summary import MapReduceSummariser
+from services.prompt.tokens import estimate_tokens
 from services.prompts import SYSTEM_CREATE_CASE
 from services.prompts import SYSTEM_DOCUMENT_ACCESSIBLE_PROMPT
 from services.prompts import SYSTEM_SUMMARISE_SUPPLEMENTARY_INFORMATION
 from services.prompts import SYSTEM_UPDATE_SECTION_EXCERPT
+from services.settings import Settings
 
 
 def sanitise_json_string_response(response: str) -> str:
@@ -30,45 +57,332 @@ def sanitise_json_string_response(response: str) -> str:
     return cleaned
 
 
+def parse_case_sections(
+        response: str,
+        sections_model: Type[Any],
+        key: str,
+        response_model: Type[ResponseModel],
+        output_mode: Optional[str] = None,
+) -> ResponseModel:
+    """Parse a whole-case model response into typed sections.
+
+    The JSON is validated straight into ``sections_model`` in a single pass; it
+    is only decoded a second time on failure, to surface the ``{"error": ...}``
+    payload the case prompts ask the model to return for insufficient input.
+
+    Args:
+        response: Raw model output for the case.
+        sections_model: Model wrapping the list of sections under ``key``.
+        key: The top-level key holding the sections (e.g. ``"strategic"``).
+        response_model: Response model whose ``data`` is the list of sections.
+        output_mode: ``STRUCTURED_OUTPUT`` mode the response was generated in,
+            used to label the parse metrics.
+
+    Returns:
+        ResponseModel: Structured response, with ``status="error"`` if the
+        model reported an error or its output could not be validated.
+    """
+    cleaned = sanitise_json_string_response(response)
+    try:
+        parsed = sections_model.model_validate_json(cleaned)
+        record_parse(key, output_mode, ok=True)
+        return response_model(data=getattr(parsed, key))
+    except ValidationError as e:
+        try:
+            payload = json.loads(cleaned)
+        except json.decoder.JSONDecodeError:
+            payload = None
+        if isinstance(payload, dict) and "error" in payload:
+            record_parse(key, output_mode, ok=True)
+            return response_model(status="error", message=str(payload["error"]))
+        record_parse(key, output_mode, ok=False)
+        return response_model(status="error", message=f"Validation error when creating response from AI {e}")
+
+
+OPTIONS_FRAMEWORK_SECTIONS = ("2-3-2", "2-3-3", "2-3-4", "2-3-5", "2-3-6")
+
+EDIT_INSTRUCTIONS = """
+Review the additional context and conversation history, and rewrite the original text to satisfy the user query.
+
+Write in a neutral and factual tone, without explicitly naming the project.
+Use the passive voice where possible; do not use first-person pronouns.
+Use British (UK) English for spelling and grammar.
+Return plain text only. Do not return HTML.
+"""
+
+# Compiled once at import; keyed by whether the section is part of the options framework.
+EDIT_TAILS = {
+    False: compile_prompt("edit", [EDIT_INSTRUCTIONS]).text,
+    True: compile_prompt("edit options_framework", [
+        EDIT_INSTRUCTIONS,
+        "Use the following prompt for further context and instruction:",
+        SHARED_SEGMENTS["options_framework"],
+    ]).text,
+}
+
+SECTION_HEADING_INSTRUCTIONS = """Do not add any headings or numbered headings.
+Do not attempt to guess the number for the next section.
+"""
+
+SECTION_OUTPUT_INSTRUCTIONS = SECTION_HEADING_INSTRUCTIONS + """The response must be in *valid JSON* format according to the following schema:
+        {
+            "content": HTML string
+        }
+        Do not return any other text in the response. *ONLY return the JSON object*.
+        """
+
+# Drafts are streamed to the reader as they are generated, so they are plain HTML.
+DRAFT_OUTPUT_INSTRUCTIONS = SECTION_HEADING_INSTRUCTIONS + (
+    "Return only the content of the section as HTML, without JSON or code fences.\n"
+)
+
+
+def edit_prompt(sections: List[SectionModel], history: str, original_text: str, user_query: str) -> str:
+    """User prompt of a section edit; ``sections`` starts with the edited section."""
+    options_framework = bool(sections) and sections[0].sectionID in OPTIONS_FRAMEWORK_SECTIONS
+    return (
+        f"Additional context: {sections}\n"
+        f"Conversation history: {history}\n"
+        f"Original text: {original_text}\n"
+        f"User query: {user_query}\n\n"
+        + EDIT_TAILS[options_framework]
+    )
+
+
+def section_prompt(
+        section_id: str,
+        sections: List[Tuple[str, str]],
+        initial_params: str,
+        supplementary: List[Tuple[str, str]],
+        output_instructions: str = SECTION_OUTPUT_INSTRUCTIONS,
+) -> str:
+    """User prompt of a section generation.
+
+    Args:
+        section_id: The section to generate.
+        sections: ``(section ID, content)`` of the context sections.
+        initial_params: The stringified project parameters.
+        supplementary: ``(title, text)`` of the supplementary documents.
+        output_instructions: How the response must be formatted.
+    """
+    prompt = "You are a UK public sector business case assistant. Generate a section of a business case report according to the following prompt:\n"
+    prompt += COMPILED_SECTIONS[section_id].text + "\n"
+    prompt += "The generated content must follow on from and/or reference the content of the other sections in the business case:\n"
+    for context_id, content in sections:
+        prompt += f"Section {context_id.replace('-', '.')}\n"
+        prompt += f"{content}\n\n"
+    prompt += "The generated content must consider the project information provided in the parameters, and **MUST** reference supplementary information and frameworks where applicable:\n"
+    try:
+        params_data = json.loads(initial_params)
+        prompt += f"Project title: {params_data['projectTitle']}\n"
+        prompt += f"Project description: {params_data['projectDescription']}\n"
+        prompt += f"Key facts and issues: {params_data['keyFactsIssues']}\n"
+        prompt += f"Estimated budget: £{params_data['estimatedBudget']} million\n"
+        prompt += f"Location: {params_data['location']}\n"
+        prompt += f"Sector: {params_data['projectSector']}\n"
+        prompt += "Supplementary information:\n"
+        for title, text in supplementary:
+            prompt += f"Document title: {title}\n"
+            prompt += f"Document summary: {text}\n\n"
+        prompt += "End of supplementary information\n\n"
+    except Exception:
+        prompt += initial_params
+    return prompt + output_instructions
+
+
+def policy_document_prompt(file_name: str) -> str:
+    return f"Are you able to reference the document entitled: {file_name}? Are you able to provide the url to the latest version"
+
+
+def summary_prompt(text: str) -> str:
+    return f"Summarise the following document: {text}"
+
+
+# Built once at import from the compiled section prompts.
+STRATEGIC_SECTIONS_SCHEMA = f'''{{
+            "strategic": [
+            {{
+            "id": "1-1",
+                "name": "1.1 Strategic Context",
+                "description": f"{COMPILED_SECTIONS['1-1'].text}",
+            }},
+            {{
+            "id": "1-2",
+                "name": "1.2 Organisational Overview",
+                "description": "{BLANK_PROMPT}"
+            }},
+            {{
+            "id": "1-3",
+                "name": "1.3 Strategic Drivers",
+                "description": "{BLANK_PROMPT}"
+            }},
+            {{
+            "id": "1-4",
+                "name": "1.4 Spending Objectives",
+                "description": "{BLANK_PROMPT}"
+            }},
+            {{
+            "id": "1-5",
+                "name": "1.5 Existing Arrangements",
+                "description": "{BLANK_PROMPT}"
+            }},
+            {{
+            "id": "1-6",
+                "name": "1.6 Business Needs",
+                "description": "{BLANK_PROMPT}"
+            }},
+            {{
+            "id": "1-7",
+                "name": "1.7 Case for Change Summary",
+                "description": "{BLANK_PROMPT}"
+            }},
+            {{
+            "id": "1-8",
+                "name": "1.8 Potential Benefits",
+                "description": "{BLANK_PROMPT}"
+            }},
+            {{
+            "id": "1-9",
+                "name": "1.9 Potential Risks",
+                "description": "{BLANK_PROMPT}"
+            }},
+            {{
+            "id": "1-10",
+                "name": "1.10 Constraints",
+                "description": "{BLANK_PROMPT}"
+            }},
+            {{
+            "id": "1-11",
+                "name": "1.11 Dependencies",
+                "description": "{BLANK_PROMPT}"
+            }}
+        ]
+    }}'''
+
+
 class PromptManager:
 
-    def __init__(self, ai_controller: BaseAIController):
+    def __init__(
+            self,
+            ai_controller: BaseAIController,
+            settings: Optional[Settings] = None,
+            context: Optional[GenerationContext] = None,
+            edit_cache: Optional[EditCache] = None,
+            policy_catalogue: Optional[PolicyCatalogue] = None,
+    ):
         self.ai_controller = ai_controller
+        self.settings = settings or Settings()
+        self.context = context or GenerationContext()
+        self.edit_cache = edit_cache
+        self.policy_catalogue = policy_catalogue
+        self.history_compactor = HistoryCompactor(
+            ai_controller,
+            keep_last=self.settings.history_keep_turns,
+            token_threshold=self.settings.history_token_threshold,
+            context=self.context,
+        )
+
+    def generate_json(
+            self,
+            user_prompt: str,
+            system_prompt: str,
+            response_model: Type[BaseModel],
+            allow_error: bool = False,
+    ) -> str:
+        """Generate a JSON response expected to validate against ``response_model``.
+
+        The output is constrained according to ``STRUCTURED_OUTPUT`` (see
+        ``services.prompt.structured``).
+
+        Args:
+            user_prompt: The user prompt.
+            system_prompt: The system prompt.
+            response_model: Model the JSON must validate against.
+            allow_error: Whether the prompt may answer with ``{"error": ...}`` instead.
+
+        Returns:
+            str: The JSON text.
+        """
+        return self.ai_controller.generate_response(
+            user_prompt=user_prompt,
+            system_prompt=system_prompt,
+            context=self.context,
+            **structured_kwargs(self.settings.structured_output, response_model, allow_error),
+        )
+
+    def load_json(
+            self,
+            response: str,
+            response_model: Type[BaseModel],
+            kind: str,
+            allow_error: bool = False,
+    ) -> RepairResult:
+        """Decode a JSON response, repairing it or re-requesting only the JSON fix.
+
+        See ``services.prompt.structured.load_json``.
+        """
+        return load_json(
+            response,
+            self.ai_controller,
+            response_model,
+            kind,
+            self.settings.structured_output,
+            context=self.context,
+            allow_error=allow_error,
+        )
+
+    def catalogued_document(self, file_name: str) -> Optional[PolicyDocumentResponse]:
+        """The local catalogue's answer for ``file_name``, or None when it is not catalogued."""
+        if self.policy_catalogue is None:
+            return None
+        match = self.policy_catalogue.lookup(file_name)
+        if match is None:
+            return None
+        return PolicyDocumentResponse(accessible=True, url=match.entry.url, name=file_name)
 
     def detect_file_knowledge(self, file_name: str) -> PolicyDocumentResponse:
         """
         Will ask the AI it's aware of the file of interest and that it capable for referencing the material within.
+        Titles in the local policy catalogue are answered without a model call.
         :param file_name:
         :return:
         """
-        user_prompt = f"Are you able to reference the document entitled: {file_name}? Are you able to provide the url to the latest version"
+        catalogued = self.catalogued_document(file_name)
+        if catalogued is not None:
+            return catalogued
+        return self.ask_file_knowledge(file_name)
+
+    def ask_file_knowledge(self, file_name: str) -> PolicyDocumentResponse:
+        """Ask the model about ``file_name``; a URL it gives becomes a catalogue candidate."""
+        user_prompt = policy_document_prompt(file_name)
         system_prompt = SYSTEM_DOCUMENT_ACCESSIBLE_PROMPT
+        mode = self.settings.structured_output
         try:
-            response = json.loads(
-                sanitise_json_string_response(
-                    self.ai_controller.generate_response(
-                        user_prompt=user_prompt,
-                        system_prompt=system_prompt
-                    )
-                )
-            )
-            response["name"] = file_name
-
-            return PolicyDocumentResponse(**response)
-        except json.decoder.JSONDecodeError as e:
-            response["message"] = user_prompt
+            response = self.load_json(
+                self.generate_json(user_prompt, system_prompt, PolicyDocumentKnowledge),
+                PolicyDocumentKnowledge,
+                "policy_document",
+            ).value
+            # An empty object is the prompt's answer for an unknown document.
+            knowledge = PolicyDocumentKnowledge.model_validate(response)
+        except JSONRepairError as e:
+            record_parse("policy_document", mode, ok=False)
             return PolicyDocumentResponse(
                 accessible=False,
                 message=f"Yielded incorrect response from AI {e}",
                 name=f"{file_name}"
             )
         except ValidationError as e:
-            print(f"whoops {e} response {response}")
+            record_parse("policy_document", mode, ok=False)
             return PolicyDocumentResponse(
                 accessible=False,
                 message=f"Validation error when creating response from AI {e}",
                 name=f"{file_name}"
             )
+        record_parse("policy_document", mode, ok=True)
+        if self.policy_catalogue is not None and knowledge.accessible and knowledge.url:
+            self.policy_catalogue.remember(file_name, knowledge.url)
+        return PolicyDocumentResponse(accessible=knowledge.accessible, url=knowledge.url, name=file_name)
 
     def generate_strategic_response(self, business_case: StrategicCase) -> Any:
         """
@@ -79,102 +393,182 @@ class PromptManager:
 
         system_prompt = SYSTEM_CREATE_CASE
 
-        response = sanitise_json_string_response(
-            self.ai_controller.generate_response(
-                user_prompt=self.process_strategic_response(business_case),
-                system_prompt=system_prompt
-            )
+        response = self.generate_json(
+            self.process_strategic_response(business_case),
+            system_prompt,
+            StrategicCaseSections,
+            allow_error=True,
         )
+        try:
+            response = self.load_json(response, StrategicCaseSections, "strategic", allow_error=True).text
+        except JSONRepairError:
+            # Passed on as-is; structured callers report the parse error.
+            response = sanitise_json_string_response(response)
 
         print(response)
         return response
 
     def generate_additional_content(self, prompts_data: PromptsRequestModel) -> PromptsResponseModel:
+        return PromptsResponseModel(response="".join(self.stream_additional_content(prompts_data)))
+
+    def stream_additional_content(self, prompts_data: PromptsRequestModel) -> Iterator[str]:
+        """Stream an edit of a section as it is generated.
+
+        An edit answered from the edit cache is yielded whole. The result is
+        cached (or audited) once the stream completes; an edit that is
+        abandoned part-way is not cached.
+        """
         system_prompt = SYSTEM_UPDATE_SECTION_EXCERPT
         sections = prompts_data.sections
-        inputs = prompts_data.prompts
         original_text = prompts_data.originalText
         user_query = prompts_data.userQuery
-        is_options_framework = sections[0].sectionID in ["2-3-2", "2-3-3", "2-3-4", "2-3-5", "2-3-6"]
 
-        prompt = f"""
-        Additional context: {sections}
-        Conversation history: {inputs}
-        Original text: {original_text}
-        User query: {user_query}
-        
-        Review the additional context and conversation history, and rewrite the original text to satisfy the user query.\n
-        Write in a neutral and factual tone, without explicitly naming the project.
-        Use the passive voice where possible; do not use first-person pronouns.
-        Use British (UK) English for spelling and grammar.
-        Return plain text only. Do not return HTML.
-        """
+        match, scope = None, None
+        if self.edit_cache is not None:
+            scope = edit_scope(sections, prompts_data.prompts)
+            match = self.edit_cache.lookup(scope, user_query, original_text)
+            if match is not None and not match.audit:
+                yield match.response
+                return
 
-        if is_options_framework:
-            prompt += f"""
-            Use the following prompt for further context and instruction:
-            {OPTIONS_FRAMEWORK_PROMPT}
-            """
+        history = self.history_compactor.render(prompts_data.prompts)
+        prompt = edit_prompt(sections, history, original_text, user_query)
 
-        response = self.ai_controller.generate_response(
-            system_prompt=system_prompt,
-            user_prompt=prompt,
-        )
-        return PromptsResponseModel(response=response)
+        pieces = []
+        for piece in self.ai_controller.stream_response(
+                system_prompt=system_prompt,
+                user_prompt=prompt,
+                context=self.context,
+        ):
+            pieces.append(piece)
+            yield piece
+        response = "".join(pieces)
+        if match is not None:
+            self.edit_cache.audit(match, response)
+        elif self.edit_cache is not None:
+            self.edit_cache.store(scope, user_query, original_text, response)
+
+    def needs_map_reduce(self, supplementary: SupplementaryInfo) -> bool:
+        """Whether the document is too long to summarise in a single prompt."""
+        return estimate_tokens(supplementary.text or "") > self.settings.summary_chunk_threshold_tokens
 
     def generate_summary_response(self, supplementary: SupplementaryInfo) -> SupplementaryInfoResponse:
+        """Summarise a document short enough for a single prompt; see :meth:`summariser` otherwise."""
         system_prompt = SYSTEM_SUMMARISE_SUPPLEMENTARY_INFORMATION
-        prompt = f"Summarise the following document: {supplementary.text}"
+        prompt = summary_prompt(supplementary.text)
         response = self.ai_controller.generate_response(
             system_prompt=system_prompt,
             user_prompt=prompt,
+            context=self.context,
         )
         return SupplementaryInfoResponse(data=response)
 
+    def summariser(self, generation: GenerationRunner) -> MapReduceSummariser:
+        """Map-reduce summariser for documents too long for a single prompt.
+
+        Args:
+            generation: Runner of the request, whose context this manager is
+                bound to; it admits each of the summariser's model calls.
+        """
+        return MapReduceSummariser(
+            self.ai_controller,
+            generation,
+            concurrency=self.settings.summary_concurrency,
+        )
+
     def generate_section(self, section_generation: SectionGeneration) -> SectionGenerationResponse:
         system_prompt = SYSTEM_CREATE_CASE
-        prompt = """"""
-        prompt += "You are a UK public sector business case assistant. Generate a section of a business case report according to the following prompt:\n"
-        prompt += SECTION_PROMPTS[section_generation.sectionId]
-        prompt += "The generated content must follow on from and/or reference the content of the other sections in the business case:\n"
-        for section in section_generation.sections:
-            prompt += f"Section {section.sectionID.replace('-', '.')}\n"
-            prompt += f"{section.content}\n\n"
-        prompt += "The generated content must consider the project information provided in the parameters, and **MUST** reference supplementary information and frameworks where applicable:\n"
+        section_text = COMPILED_SECTIONS[section_generation.sectionId].text
+        sections, supplementary = self.select_section_context(section_generation, section_text)
+        prompt = section_prompt(section_generation.sectionId, sections, section_generation.initialParams, supplementary)
+
+        response = self.generate_json(prompt, system_prompt, SectionGenerationResponse)
+
         try:
-            params_data = json.loads(section_generation.initialParams)
-            prompt += f"Project title: {params_data['projectTitle']}\n"
-            prompt += f"Project description: {params_data['projectDescription']}\n"
-            prompt += f"Key facts and issues: {params_data['keyFactsIssues']}\n"
-            prompt += f"Estimated budget: £{params_data['estimatedBudget']} million\n"
-            prompt += f"Location: {params_data['location']}\n"
-            prompt += f"Sector: {params_data['projectSector']}\n"
-            supplementary = params_data["supplementaryInformation"]
-            prompt += "Supplementary information:\n"
-            for supp in supplementary:
-                prompt += f"Document title: {supp['title']}\n"
-                prompt += f"Document summary: {supp['text']}\n\n"
-            prompt += "End of supplementary information\n\n"
-        except Exception as e:
-            prompt += section_generation.initialParams
-        prompt += "Do not add any headings or numbered headings.\n"
-        prompt += "Do not attempt to guess the number for the next section.\n"
-        prompt += """The response must be in *valid JSON* format according to the following schema:
-        {
-            "content": HTML string
-        }
-        Do not return any other text in the response. *ONLY return the JSON object*.
+            section = SectionGenerationResponse.model_validate(
+                self.load_json(response, SectionGenerationResponse, "section").value
+            )
+        except (JSONRepairError, ValidationError):
+            record_parse("section", self.settings.structured_output, ok=False)
+            raise
+        record_parse("section", self.settings.structured_output, ok=True)
+        return section
+
+    def stream_section_draft(
+            self,
+            section_generation: SectionGeneration,
+            controller: BaseAIController,
+            context: Optional[GenerationContext] = None,
+            max_tokens: Optional[int] = None,
+    ) -> Iterator[str]:
+        """Stream a quick HTML draft of a section from ``controller``.
+
+        The draft is prompted with the same context as :meth:`generate_section`
+        but asked for plain HTML, so it can be shown while it is generated.
+        Nothing runs until the first piece is requested.
+
+        Args:
+            section_generation: Section generation inputs.
+            controller: Controller of the (smaller) draft model.
+            context: GenerationContext of the draft.
+            max_tokens: Optional cap on the length of the draft.
         """
+        section_text = COMPILED_SECTIONS[section_generation.sectionId].text
+        sections, supplementary = self.select_section_context(section_generation, section_text)
+        prompt = section_prompt(
+            section_generation.sectionId, sections, section_generation.initialParams, supplementary,
+            output_instructions=DRAFT_OUTPUT_INSTRUCTIONS,
+        )
+        params = dict(max_tokens=max_tokens) if max_tokens else {}
+        yield from controller.stream_response(prompt, SYSTEM_CREATE_CASE, context=context, **params)
 
-        response = self.ai_controller.generate_response(
-            system_prompt=system_prompt,
-            user_prompt=prompt,
+    def select_section_context(
+            self,
+            section_generation: SectionGeneration,
+            query: str,
+    ) -> Tuple[List[Tuple[str, str]], List[Tuple[str, str]]]:
+        """Pick the sibling sections and supplementary text to include as context.
+
+        With ``section_context_top_k`` set, both are split into passages and
+        only the passages most relevant to the target section's prompt are
+        kept (see ``services.prompt.relevance``); otherwise everything is kept.
+
+        Returns:
+            tuple: ``(section_id, content)`` and ``(title, text)`` pairs, in
+            request order.
+        """
+        sections = [(section.sectionID, section.content) for section in section_generation.sections]
+        try:
+            params_data = json.loads(section_generation.initialParams)
+            supplementary = [(supp["title"], supp["text"]) for supp in params_data["supplementaryInformation"]]
+        except Exception:
+            supplementary = []
+
+        top_k = self.settings.section_context_top_k
+        if not top_k:
+            return sections, supplementary
+
+        key = section_generation.caseId or hashlib.sha256(section_generation.initialParams.encode("utf-8")).hexdigest()
+        passages = case_context_index(key).query(sections, supplementary, query, top_k)
+
+        selected_sections, selected_supplementary = {}, {}
+        for passage in passages:
+            target = selected_sections if passage.group == "section" else selected_supplementary
+            target.setdefault((passage.position, passage.source), []).append(passage.text)
+        selected = (
+            [(source, "\n".join(texts)) for (_, source), texts in selected_sections.items()],
+            [(source, "\n".join(texts)) for (_, source), texts in selected_supplementary.items()],
         )
-        cleaned = sanitise_json_string_response(response)
 
-        return SectionGenerationResponse(**json.loads(cleaned))
+        full_tokens = sum(estimate_tokens(text or "") for _, text in sections + supplementary)
+        selected_tokens = sum(estimate_tokens(text) for part in selected for _, text in part)
+        metrics.incr("relevance.tokens_full", full_tokens)
+        metrics.incr("relevance.tokens_selected", selected_tokens)
+        metrics.observe("relevance.tokens_saved", max(0, full_tokens - selected_tokens))
+        return selected
 
-    def process_strategic_response(self, response: StrategicCase) -> StrategicCaseResponse:
+    @staticmethod
+    def process_strategic_response(response: StrategicCase) -> StrategicCaseResponse:
         doc = response.document
         prompt = """"""
         # Add each section if it exists
@@ -235,65 +629,7 @@ class PromptManager:
         Otherwise, you must generate the **Strategic Case** in JSON format with the following JSON structure, adding to each JSON object in the list a “body”: “<html string>” attribute the “body” will be where you provide the required content as a HTML snippet as described in the Five Case Model Full Business Case strategy and the “description” element of that item:
         \n\n
         """
-        prompt += f'''{{
-            "strategic": [
-            {{
-            "id": "1-1",
-                "name": "1.1 Strategic Context",
-                "description": f"{SECTION_PROMPTS['1-1']}",
-            }},
-            {{
-            "id": "1-2",
-                "name": "1.2 Organisational Overview",
-                "description": "{BLANK_PROMPT}"
-            }},
-            {{
-            "id": "1-3",
-                "name": "1.3 Strategic Drivers",
-                "description": "{BLANK_PROMPT}"
-            }},
-            {{
-            "id": "1-4",
-                "name": "1.4 Spending Objectives",
-                "description": "{BLANK_PROMPT}"
-            }},
-            {{
-            "id": "1-5",
-                "name": "1.5 Existing Arrangements",
-                "description": "{BLANK_PROMPT}"
-            }},
-            {{
-            "id": "1-6",
-                "name": "1.6 Business Needs",
-                "description": "{BLANK_PROMPT}"
-            }},
-            {{
-            "id": "1-7",
-                "name": "1.7 Case for Change Summary",
-                "description": "{BLANK_PROMPT}"
-            }},
-            {{
-            "id": "1-8",
-                "name": "1.8 Potential Benefits",
-                "description": "{BLANK_PROMPT}"
-            }},
-            {{
-            "id": "1-9",
-                "name": "1.9 Potential Risks",
-                "description": "{BLANK_PROMPT}"
-            }},
-            {{
-            "id": "1-10",
-                "name": "1.10 Constraints",
-                "description": "{BLANK_PROMPT}"
-            }},
-            {{
-            "id": "1-11",
-                "name": "1.11 Dependencies",
-                "description": "{BLANK_PROMPT}"
-            }}
-        ]
-    }}'''
+        prompt += STRATEGIC_SECTIONS_SCHEMA
 
         prompt += f"""Please provide a response that is strictly factual, referenceable, and based only on verified information. Do not include any fictional, speculative, or unverifiable content. If a claim cannot be backed up by a reliable source, please omit it entirely. Where possible, include hyperlinks to reputable sources so I can verify the information directly. Only include content that can be substantiated.\n"""
         prompt += f"""Your response must be in a *valid JSON* format\n"""
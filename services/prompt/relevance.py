@@ -0,0 +1,235 @@
+"""Lexical relevance selection of section-generation context.
+
+``generate_section`` used to inline every sibling section and every
+supplementary summary. Here each of them is split into passages and indexed
+with BM25; the target section's prompt is used as the query and only the
+top-k passages are kept.
+
+An index is kept per case and updated incrementally: a section or document
+whose content digest is unchanged is not re-tokenised. Term statistics are
+held as sparse postings (term -> {passage: frequency}), so a query only
+touches the passages that share a term with it.
+"""
+
+import hashlib
+import math
+import re
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from services.cache import LRUCache
+
+TAG_RE = re.compile(r"<[^>]+>")
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+PASSAGE_SPLIT_RE = re.compile(r"(?:</p>|</li>|</tr>|</h\d>|<br\s*/?>|\n\s*\n)", re.IGNORECASE)
+
+STOPWORDS = frozenset("""
+a about above after all also an and any are as at be been before being below between both but by can could
+did do does doing each few for from further had has have having he her here hers him his how i if in into is
+it its itself just me more most must my no nor not now of off on once only or other our ours out over own same
+she should so some such than that the their theirs them then there these they this those through to too under
+until up very was we were what when where which while who whom why will with would you your
+""".split())
+
+# Passages shorter than this are merged with the next one.
+MIN_PASSAGE_CHARS = 200
+
+
+def tokenize(text: str) -> List[str]:
+    text = TAG_RE.sub(" ", text).lower()
+    return [token for token in TOKEN_RE.findall(text) if token not in STOPWORDS and len(token) > 1]
+
+
+def split_passages(text: str, min_chars: int = MIN_PASSAGE_CHARS) -> List[str]:
+    """Split HTML or plain text into paragraph-sized passages."""
+    passages, current = [], ""
+    for piece in PASSAGE_SPLIT_RE.split(text or ""):
+        if not piece.strip():
+            continue
+        current += piece
+        if len(TAG_RE.sub("", current)) >= min_chars:
+            passages.append(current.strip())
+            current = ""
+    if current.strip():
+        passages.append(current.strip())
+    return passages
+
+
+class BM25Index:
+    """Incremental Okapi BM25 index over sparse postings.
+
+    Args:
+        k1: Term-frequency saturation.
+        b: Document-length normalisation.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.lengths: Dict[str, int] = {}
+        self.doc_terms: Dict[str, List[str]] = {}
+        self.total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def add(self, doc_id: str, text: str):
+        if doc_id in self.lengths:
+            self.remove(doc_id)
+        terms = Counter(tokenize(text))
+        for term, frequency in terms.items():
+            self.postings.setdefault(term, {})[doc_id] = frequency
+        length = sum(terms.values())
+        self.doc_terms[doc_id] = list(terms)
+        self.lengths[doc_id] = length
+        self.total_length += length
+
+    def remove(self, doc_id: str):
+        length = self.lengths.pop(doc_id, None)
+        if length is None:
+            return
+        self.total_length -= length
+        for term in self.doc_terms.pop(doc_id):
+            del self.postings[term][doc_id]
+            if not self.postings[term]:
+                del self.postings[term]
+
+    def search(self, query: str, top_k: int) -> List[Tuple[str, float]]:
+        """Return up to ``top_k`` ``(doc_id, score)`` pairs, best first."""
+        if not self.lengths:
+            return []
+        count = len(self.lengths)
+        average_length = self.total_length / count or 1.0
+        scores: Dict[str, float] = {}
+        for term in set(tokenize(query)):
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = math.log(1 + (count - len(docs) + 0.5) / (len(docs) + 0.5))
+            for doc_id, frequency in docs.items():
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[doc_id] / average_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+
+
+@dataclass(frozen=True)
+class Passage:
+    group: str  # "section" or "supplementary"
+    source: str  # section id, or supplementary document title
+    position: int  # order of the source within the request
+    index: int  # order of the passage within its source
+    text: str
+
+
+class CaseContextIndex:
+    """BM25 index over one case's sections and supplementary documents."""
+
+    def __init__(self):
+        self.index = BM25Index()
+        self.passages: Dict[str, Passage] = {}
+        self._sources: Dict[str, Tuple[str, List[str]]] = {}
+        self._lock = threading.Lock()
+
+    def _sync_source(self, key: str, group: str, source: str, position: int, text: str) -> bool:
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        existing = self._sources.get(key)
+        if existing and existing[0] == digest:
+            # Content unchanged; only the position may have moved.
+            for doc_id in existing[1]:
+                passage = self.passages[doc_id]
+                if passage.position != position:
+                    self.passages[doc_id] = Passage(group, source, position, passage.index, passage.text)
+            return False
+        self._drop_source(key)
+        doc_ids = []
+        for index, text_passage in enumerate(split_passages(text)):
+            doc_id = f"{key}#{index}"
+            self.passages[doc_id] = Passage(group, source, position, index, text_passage)
+            self.index.add(doc_id, text_passage)
+            doc_ids.append(doc_id)
+        self._sources[key] = (digest, doc_ids)
+        return True
+
+    def _drop_source(self, key: str):
+        _, doc_ids = self._sources.pop(key, (None, []))
+        for doc_id in doc_ids:
+            self.index.remove(doc_id)
+            self.passages.pop(doc_id, None)
+
+    def sync(self, sections: Iterable[Tuple[str, str]], supplementary: Iterable[Tuple[str, str]]) -> int:
+        """Bring the index in line with the given sources.
+
+        Args:
+            sections: ``(section_id, content)`` pairs.
+            supplementary: ``(title, text)`` pairs.
+
+        Returns:
+            int: Number of sources that were (re-)indexed.
+        """
+        seen, updated = set(), 0
+        for position, (section_id, content) in enumerate(sections):
+            key = f"section:{section_id}"
+            seen.add(key)
+            updated += self._sync_source(key, "section", section_id, position, content or "")
+        for position, (title, text) in enumerate(supplementary):
+            key = f"supplementary:{position}:{title}"
+            seen.add(key)
+            updated += self._sync_source(key, "supplementary", title, position, text or "")
+        for key in [key for key in self._sources if key not in seen]:
+            self._drop_source(key)
+        return updated
+
+    def select(self, query: str, top_k: int) -> List[Passage]:
+        """Return the ``top_k`` most relevant passages in document order."""
+        if len(self.passages) <= top_k:
+            selected = list(self.passages.values())
+        else:
+            selected = [self.passages[doc_id] for doc_id, _ in self.index.search(query, top_k)]
+            if len(selected) < top_k:
+                # Fill unused slots with the latest sections, which the new
+                # section is expected to follow on from.
+                chosen = set(selected)
+                remaining = sorted(
+                    (p for p in self.passages.values() if p not in chosen),
+                    key=lambda p: (p.group == "section", p.position, -p.index),
+                    reverse=True,
+                )
+                selected += remaining[:top_k - len(selected)]
+        return sorted(selected, key=lambda p: (p.group != "section", p.position, p.index))
+
+    def query(
+            self,
+            sections: Iterable[Tuple[str, str]],
+            supplementary: Iterable[Tuple[str, str]],
+            query: str,
+            top_k: int,
+    ) -> List[Passage]:
+        """Sync the index with the request's sources and select passages.
+
+        Concurrent requests for the same case share the index, so both steps
+        run under the index lock.
+        """
+        with self._lock:
+            self.sync(sections, supplementary)
+            return self.select(query, top_k)
+
+
+_case_indexes = LRUCache(max_entries=256)
+
+
+def case_context_index(key: Optional[str]) -> CaseContextIndex:
+    """Return the cached index for a case, creating it if needed."""
+    if key is None:
+        return CaseContextIndex()
+    index = _case_indexes.get(key)
+    if index is None:
+        index = CaseContextIndex()
+        _case_indexes.set(key, index)
+    return index
@@ -0,0 +1,215 @@
+"""Tolerant parsing of JSON produced by the model.
+
+A response that is almost JSON, such as fenced output, prose around the object,
+a raw newline or unescaped quote inside an HTML string, or a truncated tail,
+used to mean a failed request or a full regeneration. :func:`repair_json`
+fixes these locally and reports what it changed. Only output it cannot
+recover needs another model call.
+
+Well-formed input takes the fast path through ``json`` and is not rewritten.
+"""
+
+import json
+import re
+from dataclasses import dataclass
+from dataclasses import field
+from typing import Any
+from typing import List
+
+from services.metrics import metrics
+
+FENCE_RE = re.compile(r"```(?:json|JSON)?\s*(.*?)(?:```|$)", re.DOTALL)
+
+# Characters that may start a value after a comma in an array.
+_VALUE_STARTS = '"{[-0123456789'
+_LITERALS = ("true", "false", "null")
+
+_CONTROL_ESCAPES = {"\n": "\\n", "\r": "\\r", "\t": "\\t", "\b": "\\b", "\f": "\\f"}
+
+
+class JSONRepairError(ValueError):
+    """Raised when a response cannot be turned into JSON locally."""
+
+
+@dataclass
+class RepairResult:
+    value: Any
+    text: str  # the JSON text ``value`` was decoded from
+    repairs: List[str] = field(default_factory=list)
+
+    @property
+    def repaired(self) -> bool:
+        return bool(self.repairs)
+
+
+def _closes_string(text: str, index: int, is_key: bool, in_object: bool) -> bool:
+    """Whether the quote at ``index`` ends the string rather than belonging to it."""
+    follower_index = index + 1
+    while follower_index < len(text) and text[follower_index].isspace():
+        follower_index += 1
+    if follower_index >= len(text):
+        return True
+    follower = text[follower_index]
+    if is_key:
+        return follower == ":"
+    if follower in "}]":
+        return True
+    if follower == ",":
+        after_index = follower_index + 1
+        while after_index < len(text) and text[after_index].isspace():
+            after_index += 1
+        after = text[after_index:after_index + 5]
+        if not after:
+            return True
+        if in_object:
+            # The next member must start with its key.
+            return after[0] in '"}'
+        return after[0] in _VALUE_STARTS or after[0] == "]" or after.startswith(_LITERALS)
+    return False
+
+
+def _scan(text: str, repairs: List[str]) -> str:
+    """Rewrite ``text`` into parseable JSON, appending a note per kind of repair."""
+    out: List[str] = []
+    stack: List[str] = []
+    in_string = is_key = False
+    expect_key = awaiting_colon = False
+    index = 0
+
+    def note(kind: str):
+        if kind not in repairs:
+            repairs.append(kind)
+
+    while index < len(text):
+        char = text[index]
+        if in_string:
+            if char == "\\" and index + 1 < len(text):
+                out.append(text[index:index + 2])
+                index += 2
+                continue
+            if char == '"':
+                if _closes_string(text, index, is_key, stack[-1] == "}" if stack else False):
+                    in_string = False
+                    awaiting_colon = is_key
+                    out.append(char)
+                else:
+                    note("unescaped_quote")
+                    out.append('\\"')
+            elif char in _CONTROL_ESCAPES:
+                note("control_character")
+                out.append(_CONTROL_ESCAPES[char])
+            else:
+                out.append(char)
+            index += 1
+            continue
+
+        if char == '"':
+            in_string, is_key = True, bool(stack) and stack[-1] == "}" and expect_key
+            expect_key = False
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+            expect_key = char == "{"
+        elif char in "}]":
+            if not stack:
+                # Anything after the outermost value is trailing text.
+                break
+            _drop_trailing_comma(out, note)
+            out.append(stack.pop())
+            index += 1
+            if not stack:
+                break
+            continue
+        elif char == ",":
+            expect_key = bool(stack) and stack[-1] == "}"
+        elif char == ":":
+            awaiting_colon = False
+        out.append(char)
+        index += 1
+
+    if text[index:].strip():
+        note("trailing_text")
+
+    if in_string or stack:
+        note("truncated")
+        if in_string:
+            if out and out[-1] == "\\":
+                out.pop()
+            out.append('"')
+            awaiting_colon = is_key
+        if awaiting_colon:
+            out.append(": null")
+        _complete_member(out)
+        while stack:
+            _drop_trailing_comma(out, note)
+            out.append(stack.pop())
+    return "".join(out)
+
+
+def _drop_trailing_comma(out: List[str], note):
+    position = len(out) - 1
+    while position >= 0 and out[position].isspace():
+        position -= 1
+    if position >= 0 and out[position] == ",":
+        note("trailing_comma")
+        del out[position:]
+
+
+def _complete_member(out: List[str]):
+    """Give a truncated ``"key":`` a value so the object can be closed."""
+    position = len(out) - 1
+    while position >= 0 and out[position].isspace():
+        position -= 1
+    if position >= 0 and out[position] == ":":
+        out.append(" null")
+
+
+def repair_json(response: str) -> RepairResult:
+    """Decode a model response as JSON, repairing common defects.
+
+    Handles code fences, prose before or after the JSON, raw control
+    characters and unescaped quotes inside strings, trailing commas, and
+    output truncated mid-string, mid-array or mid-object.
+
+    Args:
+        response: Raw model output.
+
+    Returns:
+        RepairResult: The decoded value, the JSON text and the repairs made.
+
+    Raises:
+        JSONRepairError: If no JSON value can be recovered.
+    """
+    repairs: List[str] = []
+    text = response.strip()
+
+    fenced = FENCE_RE.search(text)
+    if fenced and not text.startswith(("{", "[")):
+        repairs.append("code_fence")
+        text = fenced.group(1).strip()
+
+    starts = [position for position in (text.find("{"), text.find("[")) if position >= 0]
+    if not starts:
+        metrics.incr("json_repair.attempts", result="failed")
+        raise JSONRepairError("No JSON object in the response")
+    start = min(starts)
+    if text[:start].strip():
+        repairs.append("leading_text")
+    text = text[start:]
+
+    try:
+        value, end = json.JSONDecoder().raw_decode(text)
+        if text[end:].strip():
+            repairs.append("trailing_text")
+        text = text[:end]
+    except json.JSONDecodeError:
+        text = _scan(text, repairs)
+        try:
+            value = json.loads(text)
+        except json.JSONDecodeError as e:
+            metrics.incr("json_repair.attempts", result="failed")
+            raise JSONRepairError(f"Could not repair the JSON response: {e}") from e
+
+    metrics.incr("json_repair.attempts", result="repaired" if repairs else "clean")
+    for repair in repairs:
+        metrics.incr("json_repair.repairs", kind=repair)
+    return RepairResult(value=value, text=text, repairs=repairs)
@@ -0,0 +1,338 @@
+"""Near-duplicate cache for section edit requests.
+
+Users often repeat an edit in other words ("make it more concise", "make this
+shorter") on the same text. :class:`EditCache` answers such a request with
+the earlier result instead of another model call.
+
+A request is described by three fingerprints:
+
+- the *scope*, an exact digest of the context sections and the conversation
+  history, so a cached edit is only reused in the same editing state (asking
+  again after an answer is a new turn, so it is generated again);
+- a 64-bit SimHash of the normalised original text, which tolerates markup
+  and whitespace changes but not edited content;
+- a MinHash signature of the normalised query. Normalisation lowercases,
+  drops filler words ("please", "make it") and maps synonyms onto one term
+  ("shorter", "more concise", "trim" -> ``concise``), so paraphrases end up
+  with the same terms.
+
+A cached entry matches when the scope is equal, the SimHash distance is at
+most ``max_text_distance`` bits and the estimated query similarity is at
+least ``threshold``. Every hit is kept in a bounded log for review. With
+``audit_fraction`` set, that share of hits is generated anyway and the fresh
+output is compared with the cached one; low agreement marks a suspected false
+match.
+"""
+
+import hashlib
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from collections import deque
+from dataclasses import dataclass
+from typing import Dict
+from typing import FrozenSet
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+from models.section import SectionModel
+from models.section import SectionPromptsModel
+from services.metrics import metrics
+
+TAG_RE = re.compile(r"<[^>]+>")
+WORD_RE = re.compile(r"[a-z0-9']+")
+
+NUM_PERMUTATIONS = 64
+_MERSENNE_PRIME = (1 << 61) - 1
+_rng = random.Random(0x5EED)
+_PERMUTATIONS = [
+    (_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME)) for _ in range(NUM_PERMUTATIONS)
+]
+
+# Words that do not change what an edit asks for.
+FILLER = frozenset("""
+a an the it this that these its please can could would you me my make makes making just so bit little slightly
+much even lot more down text section paragraph part content version again and to be is are
+""".split())
+
+PHRASE_SYNONYMS = (
+    ("cut down", "concise"),
+    ("less wordy", "concise"),
+    ("fewer words", "concise"),
+    ("more detail", "expand"),
+    ("more details", "expand"),
+    ("less formal", "informal"),
+    ("less technical", "simplify"),
+    ("plain english", "simplify"),
+    ("bullet points", "bullets"),
+)
+
+SYNONYMS = {
+    **dict.fromkeys(
+        "shorter shorten shortened brief briefer succinct succinctly condense condensed trim tighten tighter "
+        "concise concisely compress".split(), "concise"),
+    **dict.fromkeys("longer lengthen expand expanded elaborate extend detailed fuller".split(), "expand"),
+    **dict.fromkeys("simpler simplify simplified clearer clarify clear easier readable".split(), "simplify"),
+    **dict.fromkeys("formal professional".split(), "formal"),
+    **dict.fromkeys("casual informal conversational friendlier".split(), "informal"),
+    **dict.fromkeys("rewrite rephrase reword redraft paraphrase".split(), "rewrite"),
+    **dict.fromkeys("grammar spelling typos typo proofread".split(), "grammar"),
+    **dict.fromkeys("bullet bullets list".split(), "bullets"),
+}
+
+
+def query_terms(query: str) -> FrozenSet[str]:
+    """Normalised terms of an edit query, with synonyms folded together."""
+    text = " ".join(WORD_RE.findall(query.lower()))
+    for phrase, term in PHRASE_SYNONYMS:
+        text = re.sub(rf"\b{phrase}\b", term, text)
+    terms, negate = [], False
+    for word in text.split():
+        if word in ("less", "not", "no", "don't"):
+            negate = True
+            continue
+        if word in FILLER:
+            continue
+        term = SYNONYMS.get(word, word)
+        terms.append(f"not_{term}" if negate else term)
+        negate = False
+    return frozenset(terms)
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def minhash(terms: FrozenSet[str]) -> Optional[Tuple[int, ...]]:
+    """MinHash signature of a set of terms; None for an empty set."""
+    if not terms:
+        return None
+    hashes = [_hash64(term) for term in terms]
+    return tuple(
+        min((a * value + b) % _MERSENNE_PRIME for value in hashes) for a, b in _PERMUTATIONS
+    )
+
+
+def signature_similarity(left: Tuple[int, ...], right: Tuple[int, ...]) -> float:
+    """Estimated Jaccard similarity of the sets behind two signatures."""
+    return sum(1 for a, b in zip(left, right) if a == b) / len(left)
+
+
+def normalise_text(text: str) -> List[str]:
+    return WORD_RE.findall(TAG_RE.sub(" ", text or "").lower())
+
+
+def simhash(text: str, shingle: int = 3) -> int:
+    """64-bit SimHash over word shingles of the normalised text."""
+    words = normalise_text(text)
+    shingles = [" ".join(words[i:i + shingle]) for i in range(max(1, len(words) - shingle + 1))]
+    weights = [0] * 64
+    for item in shingles:
+        value = _hash64(item)
+        for bit in range(64):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+
+def hamming(left: int, right: int) -> int:
+    return bin(left ^ right).count("1")
+
+
+def edit_scope(sections: Sequence[SectionModel], turns: Sequence[SectionPromptsModel]) -> str:
+    """Exact digest of the context an edit is made in."""
+    digest = hashlib.sha256()
+    for section in sections:
+        digest.update(f"{section.sectionID}\x00{section.content}\x00".encode("utf-8"))
+    digest.update(b"\x01")
+    for turn in turns:
+        sender = turn.sender.value if turn.sender else ""
+        digest.update(f"{sender}\x00{turn.text}\x00".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _output_similarity(left: str, right: str) -> float:
+    left_words, right_words = set(normalise_text(left)), set(normalise_text(right))
+    if not left_words and not right_words:
+        return 1.0
+    return len(left_words & right_words) / len(left_words | right_words)
+
+
+@dataclass
+class _Entry:
+    scope: str
+    query: str
+    signature: Optional[Tuple[int, ...]]
+    text_hash: int
+    response: str
+    created: float
+
+
+@dataclass
+class EditMatch:
+    query: str
+    matched_query: str
+    similarity: float
+    text_distance: int
+    response: str
+    audit: bool
+
+
+class EditCache:
+    """Bounded near-duplicate cache of edit results.
+
+    Args:
+        max_entries: Entries kept; the least recently used are evicted.
+        threshold: Minimum estimated query similarity of a match.
+        max_text_distance: Maximum SimHash distance, in bits, between the
+            original texts of a match.
+        ttl_seconds: How long an entry may be served.
+        audit_fraction: Share of hits that are generated anyway and compared.
+        audit_min_similarity: Output word overlap below which an audited hit
+            is counted as a suspected false match.
+        log_size: Recent hits and audits kept for :meth:`report`.
+        rng: Random source for audit sampling, replaceable in tests.
+    """
+
+    def __init__(
+            self,
+            max_entries: int = 1024,
+            threshold: float = 0.8,
+            max_text_distance: int = 3,
+            ttl_seconds: float = 3600,
+            audit_fraction: float = 0.0,
+            audit_min_similarity: float = 0.35,
+            log_size: int = 100,
+            rng: Optional[random.Random] = None,
+    ):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.max_text_distance = max_text_distance
+        self.ttl_seconds = ttl_seconds
+        self.audit_fraction = audit_fraction
+        self.audit_min_similarity = audit_min_similarity
+        self.rng = rng or random.Random()
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._scopes: Dict[str, List[int]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._lookups = 0
+        self._hits = 0
+        self._audits = 0
+        self._false_matches = 0
+        self._log: deque = deque(maxlen=log_size)
+
+    def lookup(self, scope: str, query: str, original_text: str) -> Optional[EditMatch]:
+        """Return the closest cached edit, or None when nothing is close enough.
+
+        A returned match with ``audit`` set must be generated anyway and
+        passed to :meth:`audit` with the fresh result.
+        """
+        terms = query_terms(query)
+        signature = minhash(terms)
+        text_hash = simhash(original_text)
+        now = time.monotonic()
+        best: Optional[Tuple[float, int, int, _Entry]] = None
+        with self._lock:
+            self._lookups += 1
+            for entry_id in list(self._scopes.get(scope, ())):
+                entry = self._entries[entry_id]
+                if now - entry.created > self.ttl_seconds:
+                    self._remove(entry_id)
+                    continue
+                distance = hamming(text_hash, entry.text_hash)
+                if distance > self.max_text_distance:
+                    continue
+                if signature is None or entry.signature is None:
+                    # Queries with no meaningful terms only match verbatim.
+                    verbatim = query.strip().lower() == entry.query.strip().lower()
+                    similarity = 1.0 if verbatim else 0.0
+                else:
+                    similarity = signature_similarity(signature, entry.signature)
+                if similarity >= self.threshold and (best is None or (similarity, -distance) > best[:2]):
+                    best = (similarity, -distance, entry_id, entry)
+            if best is not None:
+                self._hits += 1
+                self._entries.move_to_end(best[2])
+            hit_rate = self._hits / self._lookups
+
+        metrics.gauge("edit_cache.hit_rate", hit_rate)
+        if best is None:
+            metrics.incr("edit_cache.lookups", result="miss")
+            return None
+        similarity, negative_distance, _, entry = best
+        match = EditMatch(
+            query=query,
+            matched_query=entry.query,
+            similarity=similarity,
+            text_distance=-negative_distance,
+            response=entry.response,
+            audit=self.rng.random() < self.audit_fraction,
+        )
+        metrics.incr("edit_cache.lookups", result="hit")
+        metrics.observe("edit_cache.similarity", similarity)
+        self._log.append(dict(
+            query=match.query,
+            matchedQuery=match.matched_query,
+            similarity=round(similarity, 3),
+            textDistance=match.text_distance,
+            audited=match.audit,
+        ))
+        return match
+
+    def store(self, scope: str, query: str, original_text: str, response: str):
+        """Cache the result of an edit."""
+        terms = query_terms(query)
+        entry = _Entry(scope, query, minhash(terms), simhash(original_text), response, time.monotonic())
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = entry
+            self._scopes.setdefault(scope, []).append(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                metrics.incr("edit_cache.evictions")
+
+    def _remove(self, entry_id: int):
+        entry = self._entries.pop(entry_id)
+        ids = self._scopes[entry.scope]
+        ids.remove(entry_id)
+        if not ids:
+            del self._scopes[entry.scope]
+
+    def audit(self, match: EditMatch, fresh_response: str):
+        """Compare an audited hit's cached result with a fresh generation."""
+        agreement = _output_similarity(match.response, fresh_response)
+        false_match = agreement < self.audit_min_similarity
+        with self._lock:
+            self._audits += 1
+            self._false_matches += false_match
+        metrics.incr("edit_cache.audits", result="false_match" if false_match else "agreed")
+        self._log.append(dict(
+            query=match.query,
+            matchedQuery=match.matched_query,
+            similarity=round(match.similarity, 3),
+            textDistance=match.text_distance,
+            audited=True,
+            outputSimilarity=round(agreement, 3),
+            suspectedFalseMatch=false_match,
+        ))
+
+    def report(self) -> dict:
+        """Hit rate, audit results and the most recent hits."""
+        with self._lock:
+            return dict(
+                entries=len(self._entries),
+                lookups=self._lookups,
+                hits=self._hits,
+                hitRate=self._hits / self._lookups if self._lookups else 0.0,
+                audits=self._audits,
+                suspectedFalseMatches=self._false_matches,
+                falseMatchRate=self._false_matches / self._audits if self._audits else None,
+                threshold=self.threshold,
+                maxTextDistance=self.max_text_distance,
+                recent=list(self._log),
+            )
@@ -0,0 +1,158 @@
+"""Schema-constrained model output.
+
+JSON responses used to be requested in the prompt and recovered from the text
+with ``sanitise_json_string_response``. Here the expected pydantic model is
+turned into a tool definition instead; forcing the model to call that tool
+makes the Bedrock response the tool's JSON input, valid against the schema
+by construction and without any preamble.
+
+``STRUCTURED_OUTPUT`` selects the mode:
+
+- ``tool``: forced tool use with a schema derived from the pydantic model.
+- ``prefill``: the assistant turn is prefilled with ``{`` so the response
+  starts at the JSON object.
+- ``off`` (default): prompt instructions only (the original behaviour).
+
+Parse outcomes are counted per mode (``structured.parse``), so parse-failure
+rates can be compared before and after switching.
+
+:func:`load_json` decodes a response with the local repair parser and only
+asks the model again, for just the JSON fix, when that fails.
+"""
+
+import copy
+from typing import Any
+from typing import Dict
+from typing import Optional
+from typing import Type
+
+from pydantic import BaseModel
+
+from controllers.ai.base import BaseAIController
+from controllers.ai.context import GenerationContext
+from services.metrics import metrics
+from services.prompt.repair import JSONRepairError
+from services.prompt.repair import RepairResult
+from services.prompt.repair import repair_json
+from services.prompts import SYSTEM_REPAIR_JSON
+
+TOOL = "tool"
+PREFILL = "prefill"
+OFF = "off"
+
+JSON_PREFILL = "{"
+
+ERROR_PROPERTY = {
+    "type": "string",
+    "description": "Set instead of the content when the input is insufficient: the error message and the "
+                   "required information, as HTML (<p>, <li>).",
+}
+
+
+def _inline_refs(schema: Any, definitions: Dict[str, Any]) -> Any:
+    if isinstance(schema, dict):
+        ref = schema.get("$ref")
+        if ref is not None:
+            return _inline_refs(copy.deepcopy(definitions[ref.rsplit("/", 1)[-1]]), definitions)
+        return {key: _inline_refs(value, definitions) for key, value in schema.items() if key != "$defs"}
+    if isinstance(schema, list):
+        return [_inline_refs(item, definitions) for item in schema]
+    return schema
+
+
+def model_schema(model: Type[BaseModel]) -> Dict[str, Any]:
+    """JSON schema of ``model`` with ``$ref``s inlined and titles dropped."""
+    schema = model.model_json_schema()
+    schema = _inline_refs(schema, schema.get("$defs", {}))
+    return _drop_titles(schema)
+
+
+def _drop_titles(schema: Any) -> Any:
+    if isinstance(schema, dict):
+        return {
+            key: _drop_titles(value) for key, value in schema.items()
+            # "title" is only metadata unless it is a property name.
+            if not (key == "title" and isinstance(value, str))
+        }
+    if isinstance(schema, list):
+        return [_drop_titles(item) for item in schema]
+    return schema
+
+
+def response_tool(model: Type[BaseModel], allow_error: bool = False) -> Dict[str, Any]:
+    """Tool definition whose input is an instance of ``model``.
+
+    Args:
+        model: The pydantic model the response must validate against.
+        allow_error: Add an ``error`` property and make the model's fields
+            optional, for prompts that ask for ``{"error": ...}`` when the
+            input is insufficient.
+
+    Returns:
+        dict: ``name``, ``description`` and ``input_schema`` of the tool.
+    """
+    schema = model_schema(model)
+    if allow_error:
+        schema["properties"] = {**schema.get("properties", {}), "error": ERROR_PROPERTY}
+        schema.pop("required", None)
+    return {
+        "name": f"record_{model.__name__}",
+        "description": f"Record the response as a {model.__name__} object.",
+        "input_schema": schema,
+    }
+
+
+def structured_kwargs(mode: str, model: Type[BaseModel], allow_error: bool = False) -> Dict[str, Any]:
+    """Controller keyword arguments requesting ``model`` as output in ``mode``."""
+    if mode == TOOL:
+        return {"response_tool": response_tool(model, allow_error)}
+    if mode == PREFILL:
+        return {"prefill": JSON_PREFILL}
+    return {}
+
+
+def record_parse(kind: str, mode: str, ok: bool):
+    """Count a parse of a ``kind`` response produced in ``mode``."""
+    metrics.incr("structured.parse", kind=kind, mode=mode or "unknown", result="ok" if ok else "failed")
+
+
+def load_json(
+        response: str,
+        ai_controller: BaseAIController,
+        response_model: Type[BaseModel],
+        kind: str,
+        mode: str,
+        context: Optional[GenerationContext] = None,
+        allow_error: bool = False,
+) -> RepairResult:
+    """Decode a JSON model response, repairing it locally where possible.
+
+    When local repair fails, the model is asked once to fix the JSON only
+    (not to regenerate the content), constrained by ``mode`` as usual.
+
+    Args:
+        response: Raw model output.
+        ai_controller: Controller used for the re-request.
+        response_model: Model the JSON should validate against.
+        kind: Label for the metrics (e.g. ``"section"``).
+        mode: ``STRUCTURED_OUTPUT`` mode for the re-request.
+        context: The request's GenerationContext.
+        allow_error: Whether ``{"error": ...}`` is an acceptable answer.
+
+    Returns:
+        RepairResult: The decoded value and the repairs that were made.
+
+    Raises:
+        JSONRepairError: If the re-requested JSON cannot be decoded either.
+    """
+    try:
+        return repair_json(response)
+    except JSONRepairError as e:
+        metrics.incr("json_repair.rerequests", kind=kind)
+        fixed = ai_controller.generate_response(
+            user_prompt=f"Parser error: {e}\n\nResponse:\n{response}",
+            system_prompt=SYSTEM_REPAIR_JSON,
+            context=context,
+            **structured_kwargs(mode, response_model, allow_error),
+        )
+    return repair_json(fixed)
@@ -0,0 +1,233 @@
+"""Chunked, parallel (map-reduce) summarisation of long documents.
+
+Long supplementary documents are split on paragraph boundaries into chunks,
+the chunks are summarised concurrently, and the partial summaries are reduced
+into one final summary.
+
+Every model call, for a chunk or for a group of partial summaries, is a
+generation of the request: it is admitted by the scheduler, bounded by the
+request's deadline and cancelled with the request.
+
+Chunk boundaries are content-defined: a chunk ends at a paragraph whose digest
+matches a boundary condition (once the chunk is long enough), not at a fixed
+size. An edit therefore only changes the chunks around it, and because chunk
+summaries are cached by content digest, re-uploading an edited document only
+re-summarises the chunks that changed.
+"""
+
+import asyncio
+import hashlib
+import re
+from typing import Iterable
+from typing import Iterator
+from typing import List
+
+from controllers.ai.base import BaseAIController
+from services.cache import LRUCache
+from services.generation import GenerationRunner
+from services.generation import discard_result
+from services.metrics import metrics
+from services.prompts import SYSTEM_SUMMARISE_DOCUMENT_CHUNK
+from services.prompts import SYSTEM_SUMMARISE_SUPPLEMENTARY_INFORMATION
+
+PARAGRAPH_BOUNDARY_RE = re.compile(r"\n\s*\n|</p\s*>", re.IGNORECASE)
+TAG_RE = re.compile(r"<[^>]+>")
+
+_chunk_summary_cache = LRUCache(max_entries=4096)
+
+
+def strip_html(text: str) -> str:
+    return TAG_RE.sub(" ", text)
+
+
+class ParagraphChunker:
+    """Incrementally split text into content-defined, paragraph-aligned chunks.
+
+    Args:
+        min_chars: A chunk is never cut before reaching this size.
+        max_chars: A chunk is always cut once it reaches this size.
+        boundary_divisor: On average one paragraph in this many ends a chunk
+            once ``min_chars`` is reached.
+    """
+
+    def __init__(self, min_chars: int = 6000, max_chars: int = 24000, boundary_divisor: int = 4):
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self.boundary_divisor = boundary_divisor
+        self._pending = ""
+        self._chunk: List[str] = []
+        self._chunk_chars = 0
+
+    def feed(self, text: str) -> Iterator[str]:
+        """Add text and yield any chunks that are now complete."""
+        self._pending += text
+        last = 0
+        for match in PARAGRAPH_BOUNDARY_RE.finditer(self._pending):
+            yield from self._add_paragraph(self._pending[last:match.end()])
+            last = match.end()
+        self._pending = self._pending[last:]
+        # A single paragraph longer than max_chars is split on whitespace.
+        while len(self._pending) >= self.max_chars:
+            cut = self._pending.rfind(" ", 0, self.max_chars)
+            cut = cut if cut > 0 else self.max_chars
+            yield from self._add_paragraph(self._pending[:cut])
+            self._pending = self._pending[cut:]
+
+    def finish(self) -> Iterator[str]:
+        """Yield the remaining text as the last chunk."""
+        if self._pending:
+            yield from self._add_paragraph(self._pending)
+            self._pending = ""
+        if self._chunk_chars and "".join(self._chunk).strip():
+            yield "".join(self._chunk).strip()
+        self._chunk, self._chunk_chars = [], 0
+
+    def _add_paragraph(self, paragraph: str) -> Iterator[str]:
+        if self._chunk_chars and self._chunk_chars + len(paragraph) > self.max_chars:
+            yield from self._flush()
+        self._chunk.append(paragraph)
+        self._chunk_chars += len(paragraph)
+        if self._chunk_chars >= self.min_chars and self._is_boundary(paragraph):
+            yield from self._flush()
+
+    def _is_boundary(self, paragraph: str) -> bool:
+        digest = hashlib.blake2b(paragraph.strip().encode("utf-8"), digest_size=4).digest()
+        return int.from_bytes(digest, "big") % self.boundary_divisor == 0
+
+    def _flush(self) -> Iterator[str]:
+        chunk = "".join(self._chunk).strip()
+        self._chunk, self._chunk_chars = [], 0
+        if chunk:
+            yield chunk
+
+
+def chunk_text(text: str, **kwargs) -> List[str]:
+    chunker = ParagraphChunker(**kwargs)
+    return [*chunker.feed(text), *chunker.finish()]
+
+
+class MapReduceSummariser:
+    """Summarise chunks concurrently and reduce them to one summary.
+
+    Each model call is run by ``generation``, so it takes a scheduler slot of
+    its own; at most ``concurrency`` of them run or queue at once for the
+    request. Call :meth:`close` once done, so the calls of a failed or
+    abandoned summary are cancelled.
+
+    Args:
+        ai_controller: Controller used for the map and reduce calls.
+        generation: Runner of the request the summary is made for.
+        concurrency: Model calls of the request in flight at once.
+        reduce_batch_chars: Partial summaries are reduced in groups of at most
+            this many characters until a single group remains.
+    """
+
+    def __init__(
+            self,
+            ai_controller: BaseAIController,
+            generation: GenerationRunner,
+            concurrency: int = 4,
+            reduce_batch_chars: int = 24000,
+    ):
+        self.ai_controller = ai_controller
+        self.generation = generation
+        self.context = generation.context
+        self.reduce_batch_chars = reduce_batch_chars
+        self._slots = asyncio.Semaphore(concurrency)
+        self._calls: List[asyncio.Future] = []
+
+    def submit(self, chunk: str) -> asyncio.Future:
+        """Start summarising a chunk, reusing a cached summary if there is one."""
+        digest = hashlib.sha256(chunk.encode("utf-8")).hexdigest()
+        cached = _chunk_summary_cache.get(digest)
+        if cached is not None:
+            metrics.incr("summary.chunks", result="cached")
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(cached)
+            return future
+        metrics.incr("summary.chunks", result="summarised")
+        return self._call(self._summarise_chunk, digest, chunk)
+
+    def _call(self, func, *args) -> asyncio.Future:
+        call = asyncio.ensure_future(self._run(func, *args))
+        self._calls.append(call)
+        return call
+
+    async def _run(self, func, *args) -> str:
+        async with self._slots:
+            self.context.raise_if_cancelled()
+            return await self.generation.run(func, *args)
+
+    async def gather(self, futures: List[asyncio.Future]) -> List[str]:
+        """Results of ``futures`` in order, watching the deadline and the connection.
+
+        Raises:
+            GenerationCancelled: If the client disconnected.
+            Exception: The first error of a call.
+        """
+        pending = set(futures)
+        while pending:
+            if not await self.generation.wait_any(pending):
+                self.context.raise_if_cancelled()
+            for future in [future for future in pending if future.done()]:
+                pending.discard(future)
+                if future.exception() is not None:
+                    raise future.exception()
+        return [future.result() for future in futures]
+
+    def _summarise_chunk(self, digest: str, chunk: str) -> str:
+        summary = self.ai_controller.generate_response(
+            system_prompt=SYSTEM_SUMMARISE_DOCUMENT_CHUNK,
+            user_prompt=f"Summarise the following part of a document: {chunk}",
+            context=self.context,
+        ).strip()
+        _chunk_summary_cache.set(digest, summary)
+        return summary
+
+    async def reduce(self, partials: List[str]) -> str:
+        """Combine partial summaries into the final summary."""
+        if len(partials) == 1:
+            # A single chunk summary already satisfies the final word limit.
+            return partials[0]
+        while True:
+            groups = self._group(partials)
+            if len(groups) == 1:
+                return (await self.gather([self._call(self._reduce_group, groups[0])]))[0]
+            partials = await self.gather([self._call(self._reduce_group, group) for group in groups])
+
+    def _group(self, partials: List[str]) -> List[List[str]]:
+        groups, current, size = [], [], 0
+        for partial in partials:
+            if current and size + len(partial) > self.reduce_batch_chars:
+                groups.append(current)
+                current, size = [], 0
+            current.append(partial)
+            size += len(partial)
+        groups.append(current)
+        return groups
+
+    def _reduce_group(self, partials: List[str]) -> str:
+        joined = "\n\n".join(f"Part {i + 1}: {partial}" for i, partial in enumerate(partials))
+        return self.ai_controller.generate_response(
+            system_prompt=SYSTEM_SUMMARISE_SUPPLEMENTARY_INFORMATION,
+            user_prompt=f"Summarise the following document, given as summaries of its consecutive parts: {joined}",
+            context=self.context,
+        ).strip()
+
+    async def summarise(self, chunks: Iterable[str]) -> str:
+        try:
+            with metrics.timer("summary.map_reduce_seconds"):
+                return await self.reduce(await self.gather([self.submit(chunk) for chunk in chunks]))
+        finally:
+            self.close()
+
+    def close(self):
+        """Cancel the calls still running, e.g. after an error or a disconnect."""
+        calls, self._calls = self._calls, []
+        running = [call for call in calls if not call.done()]
+        if running:
+            # Cancelling the context ends the Bedrock streams of the abandoned calls.
+            self.context.cancel()
+        for call in calls:
+            call.cancel()
+            call.add_done_callback(discard_result)
@@ -0,0 +1,14 @@
+"""Cheap token estimates for prompt budgeting.
+
+Claude tokenises English prose at roughly four characters per token. The
+estimate is only used for thresholds and reporting, never for billing.
+"""
+
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of tokens in ``text``."""
+    if not text:
+        return 0
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
@@ -0,0 +1,213 @@
+"""Fair, priority-aware admission of generations to Bedrock.
+
+A worker only lets ``BEDROCK_MAX_CONCURRENCY`` generations run at once; the
+rest wait here. Waiting generations are ordered by:
+
+1. Priority class of the operation: ``interactive`` edits before
+   ``standard`` single-section work before ``bulk`` whole-case generation.
+   Waiting raises a generation by one class every ``aging_seconds``, so bulk
+   work is never starved.
+2. Weighted fair queuing between tenants (``X-Tenant-Id``, else
+   ``X-Project-Id``, else the client address): every tenant advances a
+   virtual clock by ``cost / weight`` per generation. A tenant with many
+   queued requests therefore takes turns with the others instead of
+   draining its own backlog first.
+
+``reserved_interactive`` slots are kept free for interactive work, so edits
+are never stuck behind a full set of multi-minute case generations.
+
+A slot is one model call. Routes that fan out, such as map-reduce summaries,
+are admitted once per call; a single admission for several concurrent calls
+would let them run beyond the cap.
+
+With a :class:`~services.shedding.LoadShedder`, a priority class whose queue
+is standing sheds new generations (see :meth:`GenerationScheduler.check`) and
+queued ones that have waited longer than the shedder's target.
+"""
+
+import asyncio
+import time
+from dataclasses import dataclass
+from dataclasses import field
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from services.metrics import metrics
+from services.shedding import LoadShed
+from services.shedding import LoadShedder
+
+INTERACTIVE = "interactive"
+STANDARD = "standard"
+BULK = "bulk"
+
+PRIORITY_RANKS = {INTERACTIVE: 0, STANDARD: 1, BULK: 2}
+
+# Relative Bedrock time of one generation, charged to the tenant's virtual clock.
+PRIORITY_COSTS = {INTERACTIVE: 1.0, STANDARD: 2.0, BULK: 8.0}
+
+OPERATION_PRIORITIES = {
+    "/api/ai/update/section/additional": INTERACTIVE,
+    "/api/ai/update/section/session": INTERACTIVE,
+    "/api/ai/policy-docs": INTERACTIVE,
+    "/api/ai/create/section": STANDARD,
+    "/api/ai/create/section/stream": STANDARD,
+    "/api/ai/summarise": STANDARD,
+    "/api/ai/summarise/stream": BULK,
+    "/api/ai/create/strategic-case": BULK,
+    "/api/ai/create/economic-case": BULK,
+    "/api/bedrock": STANDARD,
+    "/api/bedrock/batch": BULK,
+}
+
+
+def operation_priority(path: Optional[str]) -> str:
+    """Priority class of the route ``path``; unknown routes are ``standard``."""
+    return OPERATION_PRIORITIES.get(path, STANDARD)
+
+
+@dataclass(eq=False)
+class Ticket:
+    tenant: str
+    priority: str
+    start: float
+    finish: float
+    enqueued: float
+    granted: asyncio.Future = field(repr=False)
+
+
+class GenerationScheduler:
+    """Admission queue in front of the Bedrock controller.
+
+    Args:
+        max_concurrency: Generations allowed to run at once.
+        reserved_interactive: Slots only interactive generations may use.
+        aging_seconds: Waiting time that raises a generation by one class.
+        tenant_weights: Share of each tenant relative to the default of 1.
+        shedder: Optional load shedder fed with the queueing delays.
+    """
+
+    def __init__(
+            self,
+            max_concurrency: int = 8,
+            reserved_interactive: int = 2,
+            aging_seconds: float = 30,
+            tenant_weights: Optional[Dict[str, float]] = None,
+            shedder: Optional[LoadShedder] = None,
+    ):
+        self.max_concurrency = max_concurrency
+        self.reserved_interactive = min(reserved_interactive, max_concurrency - 1)
+        self.aging_seconds = aging_seconds
+        self.tenant_weights = tenant_weights or {}
+        self._waiting: List[Ticket] = []
+        self._running: Dict[str, int] = {priority: 0 for priority in PRIORITY_RANKS}
+        self._virtual_time = 0.0
+        self._tenant_finish: Dict[str, float] = {}
+        self.shedder = shedder
+        self._sweep: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def running(self) -> int:
+        return sum(self._running.values())
+
+    def enqueue(self, tenant: str, priority: str) -> Ticket:
+        """Queue a generation; ``ticket.granted`` resolves when it may start."""
+        start = max(self._virtual_time, self._tenant_finish.get(tenant, 0.0))
+        finish = start + PRIORITY_COSTS[priority] / self.tenant_weights.get(tenant, 1.0)
+        self._tenant_finish[tenant] = finish
+        ticket = Ticket(tenant, priority, start, finish, time.monotonic(), asyncio.get_running_loop().create_future())
+        self._waiting.append(ticket)
+        self._dispatch()
+        self._record_depth()
+        self._schedule_sweep()
+        return ticket
+
+    def check(self, priority: str) -> Optional[LoadShed]:
+        """The error to shed a new generation of ``priority`` with, or None to queue it."""
+        if self.shedder is None:
+            return None
+        self._shed_waiting()
+        if not self.shedder.overloaded(priority):
+            return None
+        return self.shedder.shed(priority, "arrival")
+
+    def _shed_waiting(self):
+        """Feed the age of the oldest waiting generations to the shedder and
+        shed those that have waited too long in an overloaded class."""
+        now = time.monotonic()
+        oldest: Dict[str, float] = {}
+        for ticket in self._waiting:
+            oldest[ticket.priority] = max(oldest.get(ticket.priority, 0.0), now - ticket.enqueued)
+        for priority, age in oldest.items():
+            # Only a lower bound of the final sojourn time, so only informative above target.
+            if age >= self.shedder.target:
+                self.shedder.observe(priority, age)
+        shed = [
+            ticket for ticket in self._waiting
+            if self.shedder.overloaded(ticket.priority) and now - ticket.enqueued > self.shedder.target
+        ]
+        for ticket in shed:
+            self._waiting.remove(ticket)
+            ticket.granted.set_exception(self.shedder.shed(ticket.priority, "queued"))
+        if shed:
+            self._record_depth()
+
+    def _schedule_sweep(self):
+        # Queued generations are also checked while nothing is admitted or
+        # released, e.g. when Bedrock stalls.
+        if self.shedder is None or self._sweep is not None or not self._waiting:
+            return
+        self._sweep = asyncio.get_running_loop().call_later(self.shedder.target / 2, self._run_sweep)
+
+    def _run_sweep(self):
+        self._sweep = None
+        self._shed_waiting()
+        self._schedule_sweep()
+
+    def _level(self, ticket: Ticket, now: float) -> int:
+        aged = int((now - ticket.enqueued) // self.aging_seconds) if self.aging_seconds else 0
+        return max(0, PRIORITY_RANKS[ticket.priority] - aged)
+
+    def _may_start(self, ticket: Ticket) -> bool:
+        running = self.running
+        if running >= self.max_concurrency:
+            return False
+        if ticket.priority == INTERACTIVE:
+            return True
+        return running - self._running[INTERACTIVE] < self.max_concurrency - self.reserved_interactive
+
+    def _dispatch(self):
+        now = time.monotonic()
+        while self._waiting and self.running < self.max_concurrency:
+            eligible = [ticket for ticket in self._waiting if self._may_start(ticket)]
+            if not eligible:
+                break
+            ticket = min(eligible, key=lambda t: (self._level(t, now), t.finish))
+            self._waiting.remove(ticket)
+            self._virtual_time = max(self._virtual_time, ticket.start)
+            self._running[ticket.priority] += 1
+            ticket.granted.set_result(True)
+            if self.shedder is not None:
+                self.shedder.observe(ticket.priority, now - ticket.enqueued)
+            metrics.observe("scheduler.wait_seconds", now - ticket.enqueued, priority=ticket.priority)
+            metrics.incr("scheduler.admitted", priority=ticket.priority)
+        metrics.gauge("scheduler.running", self.running)
+
+    def release(self, ticket: Ticket):
+        """Give back the slot of a granted ticket, or withdraw a waiting one."""
+        if not ticket.granted.done():
+            ticket.granted.cancel()
+            if ticket in self._waiting:
+                self._waiting.remove(ticket)
+                metrics.incr("scheduler.abandoned", priority=ticket.priority)
+        elif ticket.granted.exception() is None:
+            self._running[ticket.priority] -= 1
+        self._dispatch()
+        self._record_depth()
+
+    def _record_depth(self):
+        for priority in PRIORITY_RANKS:
+            depth = sum(1 for ticket in self._waiting if ticket.priority == priority)
+            metrics.gauge("scheduler.queue_depth", depth, priority=priority)
+            if depth == 0 and self.shedder is not None:
+                self.shedder.idle(priority)
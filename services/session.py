@@ -0,0 +1,217 @@
+"""Server-side store of case sessions.
+
+Clients create a case once with its ``initialParams`` and sections, then refer
+to it by ``caseId`` and send only the sections that changed. Sessions are kept
+zlib-compressed in an in-memory LRU.
+
+When a path is configured, a local SQLite database is the source of truth, so
+sessions survive restarts and are shared by the workers on one host. Each row
+carries a version; a read only reuses the LRU copy while its version is the
+stored one. Updates read, merge and write the row in one ``BEGIN IMMEDIATE``
+transaction, so concurrent deltas from different workers are not lost.
+"""
+
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from models.cases.session import CaseSession
+from models.section import SectionModel
+from services.cache import LRUCache
+from services.metrics import metrics
+
+
+class CaseNotFoundError(KeyError):
+    """Raised when a case id is not present in the store."""
+
+
+class CaseStore:
+    """LRU of compressed case sessions with optional SQLite persistence.
+
+    Args:
+        max_entries: Number of sessions kept in memory.
+        path: Optional SQLite database path for persistence.
+    """
+
+    def __init__(self, max_entries: int = 512, path: Optional[str] = None):
+        self._cache = LRUCache(max_entries)
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS cases ("
+                "case_id TEXT PRIMARY KEY, data BLOB NOT NULL, updated REAL NOT NULL, version INTEGER NOT NULL DEFAULT 0)"
+            )
+            columns = {row[1] for row in self._db.execute("PRAGMA table_info(cases)")}
+            if "version" not in columns:
+                self._db.execute("ALTER TABLE cases ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+            self._db.commit()
+
+    @staticmethod
+    def _encode(session: CaseSession) -> bytes:
+        return zlib.compress(session.model_dump_json().encode("utf-8"))
+
+    @staticmethod
+    def _decode(data: bytes) -> CaseSession:
+        return CaseSession.model_validate_json(zlib.decompress(data))
+
+    def _cache_session(self, session: CaseSession) -> bytes:
+        data = self._encode(session)
+        # Cached as (version, data); the version tells whether SQLite has moved on.
+        self._cache.set(session.caseId, (session.version, data))
+        metrics.observe("case_store.compressed_bytes", len(data))
+        return data
+
+    def get(self, case_id: str) -> CaseSession:
+        """Return the stored session.
+
+        With SQLite, the cached copy is only used while its version is the
+        stored one, so updates made by other workers are seen.
+
+        Raises:
+            CaseNotFoundError: If the case is unknown.
+        """
+        cached = self._cache.get(case_id)
+        if self._db is None:
+            data = cached[1] if cached is not None else None
+        else:
+            cached_version = cached[0] if cached is not None else None
+            with self._lock:
+                row = self._db.execute(
+                    "SELECT version, CASE WHEN version = ? THEN NULL ELSE data END FROM cases WHERE case_id = ?",
+                    (cached_version, case_id),
+                ).fetchone()
+            if row is None:
+                data = None
+                self._cache.pop(case_id)
+            elif row[1] is None:
+                data = cached[1]
+            else:
+                data = row[1]
+                self._cache.set(case_id, (row[0], data))
+                if cached is not None:
+                    metrics.incr("case_store.stale_reads")
+        if data is None:
+            metrics.incr("case_store.misses")
+            raise CaseNotFoundError(case_id)
+        metrics.incr("case_store.hits")
+        return self._decode(data)
+
+    def create(self, initial_params: str = "", sections: Iterable[SectionModel] = ()) -> CaseSession:
+        session = CaseSession(
+            caseId=uuid.uuid4().hex,
+            initialParams=initial_params,
+            sections={section.sectionID: section.content for section in sections},
+        )
+        data = self._cache_session(session)
+        if self._db is not None:
+            with self._lock:
+                self._db.execute(
+                    "INSERT INTO cases (case_id, data, updated, version) VALUES (?, ?, ?, ?)",
+                    (session.caseId, data, time.time(), session.version),
+                )
+                self._db.commit()
+        return session
+
+    def update(
+            self,
+            case_id: str,
+            sections: Iterable[SectionModel] = (),
+            removed: Iterable[str] = (),
+            initial_params: Optional[str] = None,
+    ) -> CaseSession:
+        """Apply a delta to a stored case and return the updated session.
+
+        With SQLite, the row is read, merged and written in one transaction
+        that holds the database's write lock, so a concurrent update from
+        another worker is merged with rather than overwritten.
+
+        Raises:
+            CaseNotFoundError: If the case is unknown.
+        """
+        sections = list(sections)
+        removed = list(removed)
+        if self._db is None:
+            # Updates run in the thread pool; the lock keeps concurrent deltas apart.
+            with self._lock:
+                session = self.get(case_id)
+                if self._apply(session, sections, removed, initial_params):
+                    self._cache_session(session)
+            return session
+
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute("SELECT data, version FROM cases WHERE case_id = ?", (case_id,)).fetchone()
+                if row is None:
+                    raise CaseNotFoundError(case_id)
+                session = self._decode(row[0])
+                session.version = row[1]
+                changed = self._apply(session, sections, removed, initial_params)
+                if changed:
+                    data = self._encode(session)
+                    self._db.execute(
+                        "UPDATE cases SET data = ?, updated = ?, version = ? WHERE case_id = ?",
+                        (data, time.time(), session.version, case_id),
+                    )
+                self._db.commit()
+            except BaseException:
+                self._db.rollback()
+                raise
+        if changed:
+            self._cache_session(session)
+        else:
+            self._cache.set(case_id, (session.version, row[0]))
+        return session
+
+    @staticmethod
+    def _apply(
+            session: CaseSession,
+            sections: List[SectionModel],
+            removed: List[str],
+            initial_params: Optional[str],
+    ) -> bool:
+        """Merge a delta into ``session``; bump and return True if it changed."""
+        changed = False
+        for section in sections:
+            if session.sections.get(section.sectionID) != section.content:
+                session.sections[section.sectionID] = section.content
+                changed = True
+        for section_id in removed:
+            changed = session.sections.pop(section_id, None) is not None or changed
+        if initial_params is not None and initial_params != session.initialParams:
+            session.initialParams = initial_params
+            changed = True
+        if changed:
+            session.version += 1
+        return changed
+
+    def resolve_sections(self, case_id: str, delta: List[SectionModel]) -> Tuple[CaseSession, List[SectionModel]]:
+        """Merge the request's changed sections into the stored case.
+
+        Returns:
+            tuple: The updated session and the full list of sections, with the
+            sections sent in the request first and in their original order.
+        """
+        session = self.update(case_id, delta)
+        sent = {section.sectionID for section in delta}
+        merged = list(delta) + [
+            SectionModel(sectionID=section_id, content=content)
+            for section_id, content in session.sections.items()
+            if section_id not in sent
+        ]
+        return session, merged
+
+    def close(self):
+        if self._db is not None:
+            with self._lock:
+                self._db.close()
+                self._db = None
@@ -0,0 +1,174 @@
+"""Runtime settings for the API workers.
+
+Settings are read from the environment (or a ``.env`` file via ``decouple``)
+when :func:`load_settings` is called, rather than at import time, so that
+importing the application never requires credentials and each worker reads
+its configuration after it has been forked.
+"""
+
+from dataclasses import dataclass
+from dataclasses import field
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+
+from decouple import Csv
+from decouple import config as envconfig
+
+
+@dataclass(frozen=True)
+class Settings:
+    """Immutable snapshot of the worker configuration."""
+
+    bedrock_access_key: Optional[str] = None
+    bedrock_secret_access_key: Optional[str] = None
+    region_name: str = "eu-west-2"
+    model_id: str = "anthropic.claude-3-7-sonnet-20250219-v1:0"
+    prewarm: bool = True
+    case_store_max_entries: int = 512
+    case_store_path: Optional[str] = None
+    history_keep_turns: int = 4
+    history_token_threshold: int = 1500
+    section_context_top_k: int = 12
+    summary_chunk_threshold_tokens: int = 8000
+    summary_concurrency: int = 4
+    idempotency_max_entries: int = 1024
+    idempotency_ttl_seconds: int = 86400
+    idempotency_store_path: Optional[str] = None
+    idempotency_lease_seconds: float = 60
+    request_timeout_seconds: float = 270
+    bedrock_connect_timeout: float = 10
+    bedrock_read_timeout: float = 280
+    bedrock_retry_mode: str = "standard"
+    bedrock_max_attempts: int = 3
+    bedrock_max_pool_connections: int = 50
+    bedrock_retry_min_budget_seconds: float = 10
+    bedrock_regions: Tuple[str, ...] = ()
+    bedrock_allowed_regions: Tuple[str, ...] = ()
+    bedrock_circuit_failures: int = 5
+    bedrock_circuit_open_seconds: float = 30
+    bedrock_probe_fraction: float = 0.05
+    structured_output: str = "off"
+    economic_prefetch: bool = False
+    economic_prefetch_max_load: int = 4
+    economic_prefetch_ttl_seconds: float = 1800
+    bedrock_max_concurrency: int = 8
+    scheduler_reserved_interactive: int = 2
+    scheduler_aging_seconds: float = 30
+    scheduler_tenant_weights: Dict[str, float] = field(default_factory=dict)
+    load_shedding: bool = True
+    shed_target_seconds: float = 5
+    shed_interval_seconds: float = 30
+    usage_store_path: Optional[str] = None
+    usage_flush_seconds: float = 30
+    usage_budgets: Dict[str, int] = field(default_factory=dict)
+    usage_default_budget: int = 0
+    usage_budget_period: str = "month"
+    bedrock_batch_concurrency: int = 4
+    bedrock_batch_max_prompts: int = 50
+    edit_cache: bool = True
+    edit_cache_max_entries: int = 1024
+    edit_cache_threshold: float = 0.8
+    edit_cache_max_text_distance: int = 3
+    edit_cache_ttl_seconds: float = 3600
+    edit_cache_audit_fraction: float = 0.0
+    prompt_token_budgets: Dict[str, int] = field(default_factory=dict)
+    policy_catalogue: bool = True
+    policy_catalogue_threshold: float = 0.8
+    policy_catalogue_path: Optional[str] = None
+    draft_model_id: str = "anthropic.claude-3-haiku-20240307-v1:0"
+    draft_max_tokens: int = 4000
+    edit_session_idle_seconds: float = 900
+    debug_token: Optional[str] = None
+    profile_max_seconds: float = 60
+    loop_monitor: bool = True
+    loop_monitor_interval_seconds: float = 0.05
+    loop_block_threshold_seconds: float = 0.1
+
+
+class KeyValues:
+    """decouple cast for ``key:value`` pairs, e.g. ``"team-a:2,team-b:0.5"``."""
+
+    def __init__(self, cast):
+        self.cast = cast
+
+    def __call__(self, value: str) -> dict:
+        pairs = {}
+        for item in Csv()(value):
+            key, _, item_value = item.rpartition(":")
+            pairs[key] = self.cast(item_value)
+        return pairs
+
+
+def load_settings() -> Settings:
+    """Read the worker settings from the environment.
+
+    Returns:
+        Settings: The settings for this worker.
+    """
+    return Settings(
+        bedrock_access_key=envconfig("BEDROCK_ACCESS_KEY", default=None),
+        bedrock_secret_access_key=envconfig("BEDROCK_SECRET_ACCESS_KEY", default=None),
+        region_name=envconfig("BEDROCK_REGION", default="eu-west-2"),
+        model_id=envconfig("BEDROCK_MODEL_ID", default="anthropic.claude-3-7-sonnet-20250219-v1:0"),
+        prewarm=envconfig("BEDROCK_PREWARM", default=True, cast=bool),
+        case_store_max_entries=envconfig("CASE_STORE_MAX_ENTRIES", default=512, cast=int),
+        case_store_path=envconfig("CASE_STORE_PATH", default=None),
+        history_keep_turns=envconfig("HISTORY_KEEP_TURNS", default=4, cast=int),
+        history_token_threshold=envconfig("HISTORY_TOKEN_THRESHOLD", default=1500, cast=int),
+        section_context_top_k=envconfig("SECTION_CONTEXT_TOP_K", default=12, cast=int),
+        summary_chunk_threshold_tokens=envconfig("SUMMARY_CHUNK_THRESHOLD_TOKENS", default=8000, cast=int),
+        summary_concurrency=envconfig("SUMMARY_CONCURRENCY", default=4, cast=int),
+        idempotency_max_entries=envconfig("IDEMPOTENCY_MAX_ENTRIES", default=1024, cast=int),
+        idempotency_ttl_seconds=envconfig("IDEMPOTENCY_TTL_SECONDS", default=86400, cast=int),
+        idempotency_store_path=envconfig("IDEMPOTENCY_STORE_PATH", default=None),
+        idempotency_lease_seconds=envconfig("IDEMPOTENCY_LEASE_SECONDS", default=60, cast=float),
+        request_timeout_seconds=envconfig("REQUEST_TIMEOUT_SECONDS", default=270, cast=float),
+        bedrock_connect_timeout=envconfig("BEDROCK_CONNECT_TIMEOUT", default=10, cast=float),
+        bedrock_read_timeout=envconfig("BEDROCK_READ_TIMEOUT", default=280, cast=float),
+        bedrock_retry_mode=envconfig("BEDROCK_RETRY_MODE", default="standard"),
+        bedrock_max_attempts=envconfig("BEDROCK_MAX_ATTEMPTS", default=3, cast=int),
+        bedrock_max_pool_connections=envconfig("BEDROCK_MAX_POOL_CONNECTIONS", default=50, cast=int),
+        bedrock_retry_min_budget_seconds=envconfig("BEDROCK_RETRY_MIN_BUDGET_SECONDS", default=10, cast=float),
+        bedrock_regions=envconfig("BEDROCK_REGIONS", default="", cast=Csv(post_process=tuple)),
+        bedrock_allowed_regions=envconfig("BEDROCK_ALLOWED_REGIONS", default="", cast=Csv(post_process=tuple)),
+        bedrock_circuit_failures=envconfig("BEDROCK_CIRCUIT_FAILURES", default=5, cast=int),
+        bedrock_circuit_open_seconds=envconfig("BEDROCK_CIRCUIT_OPEN_SECONDS", default=30, cast=float),
+        bedrock_probe_fraction=envconfig("BEDROCK_PROBE_FRACTION", default=0.05, cast=float),
+        structured_output=envconfig("STRUCTURED_OUTPUT", default="off"),
+        economic_prefetch=envconfig("ECONOMIC_PREFETCH", default=False, cast=bool),
+        economic_prefetch_max_load=envconfig("ECONOMIC_PREFETCH_MAX_LOAD", default=4, cast=int),
+        economic_prefetch_ttl_seconds=envconfig("ECONOMIC_PREFETCH_TTL_SECONDS", default=1800, cast=float),
+        bedrock_max_concurrency=envconfig("BEDROCK_MAX_CONCURRENCY", default=8, cast=int),
+        scheduler_reserved_interactive=envconfig("SCHEDULER_RESERVED_INTERACTIVE", default=2, cast=int),
+        scheduler_aging_seconds=envconfig("SCHEDULER_AGING_SECONDS", default=30, cast=float),
+        scheduler_tenant_weights=envconfig("SCHEDULER_TENANT_WEIGHTS", default="", cast=KeyValues(float)),
+        load_shedding=envconfig("LOAD_SHEDDING", default=True, cast=bool),
+        shed_target_seconds=envconfig("SHED_TARGET_SECONDS", default=5, cast=float),
+        shed_interval_seconds=envconfig("SHED_INTERVAL_SECONDS", default=30, cast=float),
+        usage_store_path=envconfig("USAGE_STORE_PATH", default=None),
+        usage_flush_seconds=envconfig("USAGE_FLUSH_SECONDS", default=30, cast=float),
+        usage_budgets=envconfig("USAGE_BUDGETS", default="", cast=KeyValues(int)),
+        usage_default_budget=envconfig("USAGE_DEFAULT_BUDGET", default=0, cast=int),
+        usage_budget_period=envconfig("USAGE_BUDGET_PERIOD", default="month"),
+        bedrock_batch_concurrency=envconfig("BEDROCK_BATCH_CONCURRENCY", default=4, cast=int),
+        bedrock_batch_max_prompts=envconfig("BEDROCK_BATCH_MAX_PROMPTS", default=50, cast=int),
+        edit_cache=envconfig("EDIT_CACHE", default=True, cast=bool),
+        edit_cache_max_entries=envconfig("EDIT_CACHE_MAX_ENTRIES", default=1024, cast=int),
+        edit_cache_threshold=envconfig("EDIT_CACHE_THRESHOLD", default=0.8, cast=float),
+        edit_cache_max_text_distance=envconfig("EDIT_CACHE_MAX_TEXT_DISTANCE", default=3, cast=int),
+        edit_cache_ttl_seconds=envconfig("EDIT_CACHE_TTL_SECONDS", default=3600, cast=float),
+        edit_cache_audit_fraction=envconfig("EDIT_CACHE_AUDIT_FRACTION", default=0.0, cast=float),
+        prompt_token_budgets=envconfig("PROMPT_TOKEN_BUDGETS", default="", cast=KeyValues(int)),
+        policy_catalogue=envconfig("POLICY_CATALOGUE", default=True, cast=bool),
+        policy_catalogue_threshold=envconfig("POLICY_CATALOGUE_THRESHOLD", default=0.8, cast=float),
+        policy_catalogue_path=envconfig("POLICY_CATALOGUE_PATH", default=None),
+        draft_model_id=envconfig("DRAFT_MODEL_ID", default="anthropic.claude-3-haiku-20240307-v1:0"),
+        draft_max_tokens=envconfig("DRAFT_MAX_TOKENS", default=4000, cast=int),
+        edit_session_idle_seconds=envconfig("EDIT_SESSION_IDLE_SECONDS", default=900, cast=float),
+        debug_token=envconfig("DEBUG_TOKEN", default=None),
+        profile_max_seconds=envconfig("PROFILE_MAX_SECONDS", default=60, cast=float),
+        loop_monitor=envconfig("LOOP_MONITOR", default=True, cast=bool),
+        loop_monitor_interval_seconds=envconfig("LOOP_MONITOR_INTERVAL_SECONDS", default=0.05, cast=float),
+        loop_block_threshold_seconds=envconfig("LOOP_BLOCK_THRESHOLD_SECONDS", default=0.1, cast=float),
+    )
@@ -0,0 +1,119 @@
+"""CoDel-style load shedding in front of the generation queue.
+
+When Bedrock slows down, generations queue in the worker until they time out,
+and the backlog keeps every later request waiting too. :class:`LoadShedder`
+watches the time generations spend queued (their sojourn time) and sheds
+work once a standing queue has formed, so callers get a fast 503 with
+``Retry-After`` instead of a slow 504.
+
+The controller follows CoDel (Controlled Delay): a queue is only *standing*
+when the sojourn time has stayed above ``target`` for a whole ``interval``.
+Short bursts that drain within the interval are not shed. Each priority
+class is controlled separately, so bulk work piling up does not shed
+interactive edits, which have slots of their own.
+
+While a class is overloaded, new requests of that class are shed on arrival,
+and queued ones are shed once they have waited longer than ``target``. The
+class recovers as soon as a generation is admitted within ``target`` or its
+queue empties.
+"""
+
+import math
+import random
+import time
+from dataclasses import dataclass
+from typing import Callable
+from typing import Dict
+from typing import Optional
+
+from services.metrics import metrics
+
+
+class LoadShed(RuntimeError):
+    """Raised for a request shed because the generation queue is overloaded."""
+
+    def __init__(self, priority: str, retry_after: int):
+        super().__init__(f"Too many {priority} generations are waiting; retry in {retry_after} s")
+        self.priority = priority
+        self.retry_after = retry_after
+
+
+@dataclass
+class _ClassState:
+    # When a sojourn time above target will have lasted a whole interval.
+    above_until: Optional[float] = None
+    overloaded: bool = False
+    # Latest sojourn time above target, the delay a new request would face.
+    standing: float = 0.0
+
+
+class LoadShedder:
+    """Per-priority CoDel controller over queue sojourn times.
+
+    Args:
+        target: Acceptable queueing delay in seconds.
+        interval: Seconds the delay must stay above ``target`` before
+            requests are shed.
+        clock: Monotonic clock, replaceable in tests.
+        rng: Random source for the ``Retry-After`` jitter.
+    """
+
+    def __init__(
+            self,
+            target: float = 5,
+            interval: float = 30,
+            clock: Callable[[], float] = time.monotonic,
+            rng: Optional[random.Random] = None,
+    ):
+        self.target = target
+        self.interval = interval
+        self.clock = clock
+        self.rng = rng or random.Random()
+        self._classes: Dict[str, _ClassState] = {}
+
+    def _state(self, priority: str) -> _ClassState:
+        return self._classes.setdefault(priority, _ClassState())
+
+    def observe(self, priority: str, sojourn: float):
+        """Record the time a generation of ``priority`` has spent queued.
+
+        Called when a generation is admitted, and with the age of the oldest
+        waiting one, which is a lower bound of its sojourn time.
+        """
+        state = self._state(priority)
+        if sojourn < self.target:
+            self._recover(priority, state)
+            return
+        now = self.clock()
+        state.standing = sojourn
+        if state.above_until is None:
+            state.above_until = now + self.interval
+        elif now >= state.above_until and not state.overloaded:
+            state.overloaded = True
+            metrics.incr("shedding.overloads", priority=priority)
+            metrics.gauge("shedding.overloaded", 1, priority=priority)
+
+    def idle(self, priority: str):
+        """The queue of ``priority`` is empty, so no queue is standing."""
+        self._recover(priority, self._state(priority))
+
+    def _recover(self, priority: str, state: _ClassState):
+        state.above_until = None
+        if state.overloaded:
+            state.overloaded = False
+            metrics.gauge("shedding.overloaded", 0, priority=priority)
+
+    def overloaded(self, priority: str) -> bool:
+        state = self._classes.get(priority)
+        return state is not None and state.overloaded
+
+    def retry_after(self, priority: str) -> int:
+        """Seconds a shed caller should wait: the standing delay, jittered so
+        shed callers do not all come back at once."""
+        delay = min(max(self._state(priority).standing, 1.0), self.interval)
+        return math.ceil(delay * self.rng.uniform(1.0, 1.5))
+
+    def shed(self, priority: str, stage: str) -> LoadShed:
+        """Count a shed request and return the error to answer it with."""
+        metrics.incr("shedding.shed", priority=priority, stage=stage)
+        return LoadShed(priority, self.retry_after(priority))
@@ -0,0 +1,299 @@
+"""Token usage ledger and per-project budgets.
+
+The Bedrock stream reports the tokens a call used: ``message_start`` carries
+the input and prompt-cache tokens, and ``message_delta`` the output tokens.
+The controller hands them to :class:`UsageLedger`, which aggregates them in
+memory per UTC day, project, operation and model. Aggregates are flushed
+every ``flush_seconds`` (and on shutdown) to an optional SQLite database
+shared by the workers on a host.
+
+Budgets are token limits per project and period (``day`` or ``month``).
+:meth:`UsageLedger.check` runs before every Bedrock call and rejects the call
+once the project's spend, plus the estimated input of the call, would exceed
+its budget, so a runaway project stops before tokens are spent. With SQLite,
+the spend of the other workers is picked up on every flush, so enforcement
+may lag them by up to ``flush_seconds``.
+"""
+
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from datetime import timezone
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from services.metrics import metrics
+
+DAY = "day"
+MONTH = "month"
+
+UNATTRIBUTED = "unattributed"
+
+GROUP_COLUMNS = ("day", "project", "operation", "model")
+COUNT_COLUMNS = ("requests", "input_tokens", "output_tokens", "cache_read_tokens", "cache_write_tokens")
+
+
+class BudgetExceeded(RuntimeError):
+    """Raised before a Bedrock call that would exceed the project's budget."""
+
+    def __init__(self, project: str, budget: int, spent: int, period: str):
+        super().__init__(f"Token budget of {budget} for project {project!r} exhausted in {period} ({spent} used)")
+        self.project = project
+        self.budget = budget
+        self.spent = spent
+        self.period = period
+
+
+@dataclass
+class Usage:
+    """Tokens used by one Bedrock call, as reported by the stream."""
+
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cache_read_input_tokens: int = 0
+    cache_creation_input_tokens: int = 0
+
+    def update(self, values: Dict[str, int]):
+        """Apply a ``usage`` object; ``output_tokens`` is cumulative in the stream."""
+        for name in ("input_tokens", "output_tokens", "cache_read_input_tokens", "cache_creation_input_tokens"):
+            if values.get(name) is not None:
+                setattr(self, name, values[name])
+
+    @classmethod
+    def combine(cls, usages: Iterable["Usage"]) -> "Usage":
+        """Sum the usage of several calls."""
+        combined = cls()
+        for usage in usages:
+            combined.input_tokens += usage.input_tokens
+            combined.output_tokens += usage.output_tokens
+            combined.cache_read_input_tokens += usage.cache_read_input_tokens
+            combined.cache_creation_input_tokens += usage.cache_creation_input_tokens
+        return combined
+
+    @property
+    def total(self) -> int:
+        return self.input_tokens + self.output_tokens + self.cache_read_input_tokens + self.cache_creation_input_tokens
+
+
+class UsageLedger:
+    """In-memory usage aggregates with periodic SQLite flushes and budgets.
+
+    Args:
+        path: Optional SQLite database path shared by the workers on a host.
+        flush_seconds: How often aggregates are written to the database.
+        budgets: Token budget per project.
+        default_budget: Budget of projects without their own; 0 is unlimited.
+        period: ``day`` or ``month``, the period a budget applies to.
+        clock: Wall clock, replaceable in tests.
+    """
+
+    def __init__(
+            self,
+            path: Optional[str] = None,
+            flush_seconds: float = 30,
+            budgets: Optional[Dict[str, int]] = None,
+            default_budget: int = 0,
+            period: str = MONTH,
+            clock: Callable[[], float] = time.time,
+    ):
+        if period not in (DAY, MONTH):
+            raise ValueError(f"Unknown budget period: {period}")
+        self.flush_seconds = flush_seconds
+        self.budgets = budgets or {}
+        self.default_budget = default_budget
+        self.period = period
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._pending: Dict[Tuple[str, str, str, str], List[int]] = {}
+        self._totals: Dict[Tuple[str, str, str, str], List[int]] = {}
+        self._spent: Dict[str, int] = {}
+        self._spent_period = self._period_key()
+        self._last_flush = clock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS token_usage ("
+                "day TEXT NOT NULL, project TEXT NOT NULL, operation TEXT NOT NULL, model TEXT NOT NULL, "
+                "requests INTEGER NOT NULL, input_tokens INTEGER NOT NULL, output_tokens INTEGER NOT NULL, "
+                "cache_read_tokens INTEGER NOT NULL, cache_write_tokens INTEGER NOT NULL, "
+                "PRIMARY KEY (day, project, operation, model))"
+            )
+            self._db.commit()
+            with self._lock:
+                self._reload_spent()
+
+    def _day(self) -> str:
+        return datetime.fromtimestamp(self.clock(), tz=timezone.utc).strftime("%Y-%m-%d")
+
+    def _period_key(self) -> str:
+        day = self._day()
+        return day if self.period == DAY else day[:7]
+
+    def budget(self, project: str) -> Optional[int]:
+        """Token budget of ``project``, or None when it is unlimited."""
+        budget = self.budgets.get(project, self.default_budget)
+        return budget or None
+
+    def _roll_period(self):
+        period = self._period_key()
+        if period != self._spent_period:
+            self._spent_period = period
+            self._spent = {}
+
+    def spent(self, project: str) -> int:
+        """Tokens ``project`` has used in the current budget period."""
+        with self._lock:
+            self._roll_period()
+            return self._spent.get(project, 0)
+
+    def check(self, project: str, estimated_tokens: int = 0):
+        """Reject a call that would take ``project`` over its budget.
+
+        Args:
+            project: The project the call is made for.
+            estimated_tokens: Estimated input tokens of the call.
+
+        Raises:
+            BudgetExceeded: If the budget is already used up, or would be by
+                the call's input.
+        """
+        project = project or UNATTRIBUTED
+        budget = self.budget(project)
+        if budget is None:
+            return
+        spent = self.spent(project)
+        if spent + estimated_tokens > budget:
+            metrics.incr("usage.budget_rejections", project=project)
+            raise BudgetExceeded(project, budget, spent, self._spent_period)
+
+    def record(self, project: str, operation: str, model: str, usage: Usage):
+        """Add the usage of one Bedrock call to the ledger."""
+        project = project or UNATTRIBUTED
+        operation = operation or "other"
+        key = (self._day(), project, operation, model)
+        counts = (1, usage.input_tokens, usage.output_tokens,
+                  usage.cache_read_input_tokens, usage.cache_creation_input_tokens)
+        with self._lock:
+            self._roll_period()
+            pending = self._pending.setdefault(key, [0] * len(COUNT_COLUMNS))
+            for index, count in enumerate(counts):
+                pending[index] += count
+            self._spent[project] = self._spent.get(project, 0) + usage.total
+            due = self.clock() - self._last_flush >= self.flush_seconds
+        metrics.incr("usage.input_tokens", usage.input_tokens, operation=operation)
+        metrics.incr("usage.output_tokens", usage.output_tokens, operation=operation)
+        metrics.incr("usage.cache_read_tokens", usage.cache_read_input_tokens, operation=operation)
+        metrics.incr("usage.cache_write_tokens", usage.cache_creation_input_tokens, operation=operation)
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Write the pending aggregates out and refresh the period's spend."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = self.clock()
+            if self._db is None:
+                for key, counts in pending.items():
+                    totals = self._totals.setdefault(key, [0] * len(COUNT_COLUMNS))
+                    for index, count in enumerate(counts):
+                        totals[index] += count
+                return
+            if pending:
+                self._db.executemany(
+                    "INSERT INTO token_usage (day, project, operation, model, requests, input_tokens, "
+                    "output_tokens, cache_read_tokens, cache_write_tokens) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (day, project, operation, model) DO UPDATE SET "
+                    + ", ".join(f"{column} = {column} + excluded.{column}" for column in COUNT_COLUMNS),
+                    [(*key, *counts) for key, counts in pending.items()],
+                )
+                self._db.commit()
+            self._reload_spent()
+        metrics.incr("usage.flushes")
+
+    def _reload_spent(self):
+        self._roll_period()
+        rows = self._db.execute(
+            "SELECT project, SUM(input_tokens + output_tokens + cache_read_tokens + cache_write_tokens) "
+            "FROM token_usage WHERE day LIKE ? GROUP BY project",
+            (self._spent_period + "%",),
+        ).fetchall()
+        self._spent = {project: total for project, total in rows}
+
+    def query(
+            self,
+            project: Optional[str] = None,
+            operation: Optional[str] = None,
+            since: Optional[str] = None,
+            until: Optional[str] = None,
+            group_by: Tuple[str, ...] = GROUP_COLUMNS,
+    ) -> List[dict]:
+        """Aggregated usage, optionally filtered and grouped.
+
+        Args:
+            project: Only this project.
+            operation: Only this operation.
+            since: First UTC day included (``YYYY-MM-DD``).
+            until: Last UTC day included (``YYYY-MM-DD``).
+            group_by: Subset of ``day``, ``project``, ``operation``, ``model``.
+
+        Returns:
+            list: One dict per group with the token counts.
+        """
+        group_by = tuple(column for column in GROUP_COLUMNS if column in group_by)
+        self.flush()
+        with self._lock:
+            if self._db is not None:
+                rows = self._db.execute(
+                    f"SELECT {', '.join(GROUP_COLUMNS + COUNT_COLUMNS)} FROM token_usage"
+                ).fetchall()
+            else:
+                rows = [(*key, *counts) for key, counts in self._totals.items()]
+
+        filters = dict(project=project, operation=operation)
+        groups: Dict[tuple, List[int]] = {}
+        for row in rows:
+            values = dict(zip(GROUP_COLUMNS, row))
+            if any(expected is not None and values[name] != expected for name, expected in filters.items()):
+                continue
+            if (since and values["day"] < since) or (until and values["day"] > until):
+                continue
+            totals = groups.setdefault(tuple(values[column] for column in group_by), [0] * len(COUNT_COLUMNS))
+            for index, count in enumerate(row[len(GROUP_COLUMNS):]):
+                totals[index] += count
+        return [
+            {**dict(zip(group_by, key)), **dict(zip(COUNT_COLUMNS, counts))}
+            for key, counts in sorted(groups.items())
+        ]
+
+    def budget_status(self) -> List[dict]:
+        """Budget, spend and remaining tokens of every budgeted or active project."""
+        with self._lock:
+            self._roll_period()
+            spent = dict(self._spent)
+        status = []
+        for project in sorted(set(spent) | set(self.budgets)):
+            budget = self.budget(project)
+            used = spent.get(project, 0)
+            status.append(dict(
+                project=project,
+                period=self._spent_period,
+                budget=budget,
+                spent=used,
+                remaining=None if budget is None else max(0, budget - used),
+            ))
+        return status
+
+    def close(self):
+        self.flush()
+        if self._db is not None:
+            with self._lock:
+                self._db.close()
+                self._db = None
@@ -0,0 +1,48 @@
+import json
+
+import pytest
+from botocore.exceptions import ClientError
+
+from controllers.ai.bedrock import AWSBedrockService
+
+
+class EventStream(list):
+    def close(self):
+        pass
+
+
+class StubClient:
+    def __init__(self, error: Exception = None):
+        self.error = error
+
+    def invoke_model_with_response_stream(self, **kwargs):
+        if self.error is not None:
+            raise self.error
+        events = [
+            {"type": "content_block_delta", "delta": {"type": "text_delta", "text": text}}
+            for text in ("Hello", " world")
+        ]
+        return {"body": EventStream({"chunk": {"bytes": json.dumps(event).encode()}} for event in events)}
+
+
+def service(client: StubClient) -> AWSBedrockService:
+    return AWSBedrockService({"model_id": "model", "client": client})
+
+
+def test_streamed_text_is_not_written_to_stdout(capsys):
+    assert list(service(StubClient()).stream_response("user", "system")) == ["Hello", " world"]
+    assert capsys.readouterr().out == ""
+
+
+def test_bedrock_errors_are_reported_as_api_errors():
+    error = ClientError({"Error": {"Code": "ValidationException", "Message": "bad"}}, "InvokeModelWithResponseStream")
+
+    with pytest.raises(RuntimeError, match="Bedrock API error") as raised:
+        service(StubClient(error)).generate_response("user", "system")
+
+    assert raised.value.__cause__ is error
+
+
+def test_other_errors_are_raised_as_they_are():
+    with pytest.raises(KeyError):
+        service(StubClient(KeyError("body"))).generate_response("user", "system")
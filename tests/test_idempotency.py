@@ -0,0 +1,43 @@
+import asyncio
+import time
+
+import pytest
+
+from services.idempotency import IdempotencyStore
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "idempotency.db")
+
+
+def begin(store: IdempotencyStore, key: str, fingerprint: str = "f"):
+    async def run():
+        return (await store.begin(key, fingerprint))[0]
+
+    return asyncio.run(run())
+
+
+def test_claim_of_a_worker_that_stops_renewing_expires_after_the_lease(path):
+    crashed = IdempotencyStore(path=path, lease_seconds=0.2)
+    retry = IdempotencyStore(path=path, lease_seconds=0.2)
+    assert begin(crashed, "k") == IdempotencyStore.CLAIMED
+    assert begin(retry, "k") == IdempotencyStore.PENDING_ELSEWHERE
+
+    time.sleep(0.3)
+
+    assert not retry.is_pending("k")
+    assert begin(retry, "k") == IdempotencyStore.CLAIMED
+
+
+def test_renewed_claim_is_kept_beyond_the_lease(path):
+    running = IdempotencyStore(path=path, lease_seconds=0.2)
+    retry = IdempotencyStore(path=path, lease_seconds=0.2)
+    assert begin(running, "k") == IdempotencyStore.CLAIMED
+
+    for _ in range(3):
+        time.sleep(0.1)
+        running.renew("k")
+
+    assert retry.is_pending("k")
+    assert begin(retry, "k") == IdempotencyStore.PENDING_ELSEWHERE
@@ -0,0 +1,68 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from models.cases.section import SectionGenerationResponse
+from services.prompt.manager import PromptManager
+from services.usage import BudgetExceeded
+
+INITIAL_PARAMS = json.dumps({
+    "projectTitle": "t",
+    "projectDescription": "d",
+    "keyFactsIssues": "",
+    "estimatedBudget": 1,
+    "location": "",
+    "projectSector": "",
+    "supplementaryInformation": [],
+})
+SECTION = {"sectionId": "1-1", "sections": [], "initialParams": INITIAL_PARAMS}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setenv("BEDROCK_PREWARM", "false")
+    monkeypatch.setenv("IDEMPOTENCY_STORE_PATH", "")
+    with TestClient(main.app) as client:
+        yield client
+
+
+def test_budget_rejection_is_not_replayed_to_a_retry(client, monkeypatch):
+    calls = []
+
+    def generate_section(self, section_generation):
+        calls.append(section_generation)
+        if len(calls) == 1:
+            raise BudgetExceeded("p", 10, 10, "2026-10")
+        return SectionGenerationResponse(content="<p>section</p>")
+
+    monkeypatch.setattr(PromptManager, "generate_section", generate_section)
+    headers = {"Idempotency-Key": "budget-retry"}
+
+    first = client.post("/api/ai/create/section", json=SECTION, headers=headers)
+    retry = client.post("/api/ai/create/section", json=SECTION, headers=headers)
+
+    assert first.status_code == 429
+    assert retry.status_code == 200
+    assert retry.headers.get("idempotency-replayed") is None
+    assert len(calls) == 2
+
+
+def test_client_error_is_replayed_to_a_retry(client, monkeypatch):
+    calls = []
+
+    def generate_section(self, section_generation):
+        calls.append(section_generation)
+        return SectionGenerationResponse(content="<p>section</p>")
+
+    monkeypatch.setattr(PromptManager, "generate_section", generate_section)
+    headers = {"Idempotency-Key": "unknown-case"}
+    body = {**SECTION, "caseId": "missing"}
+
+    first = client.post("/api/ai/create/section", json=body, headers=headers)
+    retry = client.post("/api/ai/create/section", json=body, headers=headers)
+
+    assert first.status_code == 404
+    assert retry.status_code == 404
+    assert retry.headers.get("idempotency-replayed") == "true"
@@ -0,0 +1,86 @@
+import asyncio
+import json
+import time
+
+import pytest
+from starlette.requests import Request
+
+from controllers.ai.context import GenerationCancelled
+from models.cases.economic import EconomicCase
+from models.cases.economic import EconomicCaseRequest
+from models.cases.strategic import StrategicCaseRequest
+from services.generation import GenerationLoad
+from services.generation import GenerationRunner
+from services.prefetch import EconomicPrefetcher
+
+STRATEGIC_CASE = json.dumps({"strategic": [{"id": "1-1", "name": "1.1", "body": "<p>Trees planted</p>"}]})
+STRATEGIC_REQUEST = StrategicCaseRequest(document={
+    "projectTitle": "t",
+    "projectDescription": "d",
+    "frameworks": ["Green Book"],
+    "supplementaryInformation": [],
+})
+ECONOMIC_REQUEST = EconomicCaseRequest(document=EconomicCase(
+    strategicCase=STRATEGIC_CASE,
+    criticalSuccessFactors=[],
+    frameworks=["Green Book"],
+    supplementaryInformation=[],
+))
+
+
+class SlowEconomicService:
+    """Generates for ``seconds`` unless its context is cancelled."""
+
+    seconds = 2.0
+
+    def __init__(self, context):
+        self.context = context
+
+    def generate_economic_response(self, request):
+        started = time.monotonic()
+        while time.monotonic() - started < self.seconds:
+            self.context.raise_if_cancelled()
+            time.sleep(0.01)
+        return '{"economic1": []}'
+
+
+def runner(timeout: float, connected: bool = True) -> GenerationRunner:
+    async def receive():
+        if connected:
+            await asyncio.sleep(3600)
+        return {"type": "http.disconnect"}
+
+    request = Request({"type": "http", "method": "POST", "path": "/", "headers": []}, receive)
+    return GenerationRunner(request, timeout=timeout, poll_interval=0.05)
+
+
+@pytest.fixture
+def prefetcher():
+    prefetcher = EconomicPrefetcher(SlowEconomicService, GenerationLoad())
+    yield prefetcher
+    prefetcher.close()
+
+
+def test_running_prefetch_is_waited_for_half_of_the_remaining_deadline(prefetcher):
+    async def take():
+        prefetcher.schedule(STRATEGIC_REQUEST, STRATEGIC_CASE)
+        started = time.monotonic()
+        response = await prefetcher.take(ECONOMIC_REQUEST, runner(timeout=1.0))
+        return response, time.monotonic() - started
+
+    response, waited = asyncio.run(take())
+
+    assert response is None
+    assert 0.4 < waited < 0.8
+    assert prefetcher._entries == {}
+
+
+def test_disconnect_stops_waiting_for_a_running_prefetch(prefetcher):
+    async def take():
+        prefetcher.schedule(STRATEGIC_REQUEST, STRATEGIC_CASE)
+        started = time.monotonic()
+        with pytest.raises(GenerationCancelled):
+            await prefetcher.take(ECONOMIC_REQUEST, runner(timeout=10.0, connected=False))
+        return time.monotonic() - started
+
+    assert asyncio.run(take()) < 0.5
@@ -0,0 +1,71 @@
+import asyncio
+import time
+
+from starlette.requests import Request
+
+from models.cases.section import SectionGenerationResponse
+from services.generation import GenerationRunner
+from services.progressive import COMPLETED
+from services.progressive import DONE
+from services.progressive import DRAFT
+from services.progressive import FINAL
+from services.progressive import SKIPPED
+from services.progressive import progressive_section
+from services.scheduler import GenerationScheduler
+
+
+class SectionService:
+    """Generates the final section in ``seconds`` and streams a short draft."""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.drafts = 0
+
+    def generate_section(self, request):
+        time.sleep(self.seconds)
+        return SectionGenerationResponse(content="<p>final</p>")
+
+    def stream_section_draft(self, request, controller, context, max_tokens):
+        self.drafts += 1
+        for piece in ("<p>draft</p>", "<p>more</p>"):
+            context.raise_if_cancelled()
+            yield piece
+
+
+def runner(scheduler: GenerationScheduler) -> GenerationRunner:
+    async def receive():
+        await asyncio.sleep(3600)
+
+    request = Request({"type": "http", "method": "POST", "path": "/", "headers": []}, receive)
+    return GenerationRunner(request, timeout=10, poll_interval=0.05, scheduler=scheduler)
+
+
+def generate(scheduler: GenerationScheduler, service: SectionService):
+    async def run():
+        return [event async for event in progressive_section(runner(scheduler), service, None, draft_controller=object())]
+
+    return asyncio.run(run())
+
+
+def test_draft_runs_in_a_free_slot_of_its_own():
+    scheduler = GenerationScheduler(max_concurrency=2, reserved_interactive=0)
+    service = SectionService(seconds=0.3)
+
+    events = generate(scheduler, service)
+
+    assert [event for event, _ in events] == [DRAFT, DRAFT, FINAL, DONE]
+    assert events[-1][1]["draft"] == COMPLETED
+    assert scheduler.running == 0
+
+
+def test_draft_is_skipped_without_a_free_slot():
+    scheduler = GenerationScheduler(max_concurrency=1, reserved_interactive=0)
+    service = SectionService(seconds=0.2)
+
+    events = generate(scheduler, service)
+
+    assert [event for event, _ in events] == [FINAL, DONE]
+    assert events[-1][1]["draft"] == SKIPPED
+    assert service.drafts == 0
+    assert scheduler.running == 0
+    assert scheduler._waiting == []
@@ -0,0 +1,159 @@
+import json
+import random
+import time
+
+import pytest
+from botocore.exceptions import ClientError
+
+from controllers.ai.bedrock import AWSBedrockService
+from controllers.ai.regions import CLOSED
+from controllers.ai.regions import HALF_OPEN
+from controllers.ai.regions import OPEN
+from controllers.ai.regions import RegionPool
+
+PRIMARY = "eu-west-2"
+SECONDARY = "eu-west-1"
+OPEN_SECONDS = 30
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class FixedRandom(random.Random):
+    """Probes a half-open region on every call when ``value`` is 0."""
+
+    def __init__(self, value: float):
+        super().__init__()
+        self.value = value
+
+    def random(self) -> float:
+        return self.value
+
+
+class EventStream(list):
+    def close(self):
+        pass
+
+
+class StubClient:
+    """A region's ``bedrock-runtime`` client that throttles while ``failing``."""
+
+    def __init__(self, region: str, latency: float = 0.0):
+        self.region = region
+        self.latency = latency
+        self.failing = False
+        self.calls = 0
+
+    def invoke_model_with_response_stream(self, **kwargs):
+        self.calls += 1
+        if self.failing:
+            raise ClientError(
+                {"Error": {"Code": "ThrottlingException"}, "ResponseMetadata": {"HTTPStatusCode": 429}},
+                "InvokeModelWithResponseStream",
+            )
+        time.sleep(self.latency)
+        chunk = {"type": "content_block_delta", "delta": {"type": "text_delta", "text": self.region}}
+        return {"body": EventStream([{"chunk": {"bytes": json.dumps(chunk).encode()}}])}
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def clients():
+    # The secondary is slower, so the primary is preferred whenever it is healthy.
+    return {PRIMARY: StubClient(PRIMARY), SECONDARY: StubClient(SECONDARY, latency=0.02)}
+
+
+def controller(clients, clock, rng_value: float = 0.0):
+    pool = RegionPool(
+        [PRIMARY, SECONDARY],
+        clients.__getitem__,
+        failure_threshold=2,
+        open_seconds=OPEN_SECONDS,
+        probe_fraction=0.05,
+        clock=clock,
+        rng=FixedRandom(rng_value),
+    )
+    return AWSBedrockService({"model_id": "model", "region_pool": pool}), pool
+
+
+def generate(service: AWSBedrockService) -> str:
+    return service.generate_response("user", "system")
+
+
+def trip_primary(service: AWSBedrockService, clients):
+    """Serve one call from the primary, then fail it until its circuit opens."""
+    assert generate(service) == PRIMARY
+    clients[PRIMARY].failing = True
+    assert [generate(service) for _ in range(2)] == [SECONDARY, SECONDARY]
+
+
+def test_consecutive_regional_failures_open_the_circuit(clients, clock):
+    service, pool = controller(clients, clock)
+
+    trip_primary(service, clients)
+    assert pool.health[PRIMARY].state == OPEN
+
+    assert generate(service) == SECONDARY
+    assert clients[PRIMARY].calls == 3
+
+
+def test_open_region_is_probed_once_after_open_seconds(clients, clock):
+    service, pool = controller(clients, clock)
+    trip_primary(service, clients)
+
+    clock.now += OPEN_SECONDS - 1
+    assert pool.choose() == SECONDARY
+
+    clock.now += 1
+    assert pool.choose() == PRIMARY
+    assert pool.health[PRIMARY].state == HALF_OPEN
+    # Only one probe at a time.
+    assert pool.choose() == SECONDARY
+    pool.release(PRIMARY)
+
+
+def test_failed_probe_reopens_the_circuit(clients, clock):
+    service, pool = controller(clients, clock)
+    trip_primary(service, clients)
+
+    clock.now += OPEN_SECONDS
+    assert generate(service) == SECONDARY
+
+    assert clients[PRIMARY].calls == 4
+    assert pool.health[PRIMARY].state == OPEN
+    assert pool.health[PRIMARY].opened_at == clock.now
+
+
+def test_successful_probe_closes_the_circuit_and_wins_traffic_back(clients, clock):
+    service, pool = controller(clients, clock)
+    trip_primary(service, clients)
+
+    clients[PRIMARY].failing = False
+    clock.now += OPEN_SECONDS
+    assert generate(service) == PRIMARY
+    assert pool.health[PRIMARY].state == CLOSED
+    assert pool.health[PRIMARY].consecutive_failures == 0
+
+    assert [generate(service) for _ in range(3)] == [PRIMARY] * 3
+
+
+def test_half_open_region_gets_only_the_probe_fraction_while_another_is_closed(clients, clock):
+    service, pool = controller(clients, clock, rng_value=0.5)
+    trip_primary(service, clients)
+
+    clients[PRIMARY].failing = False
+    clock.now += OPEN_SECONDS
+    assert generate(service) == SECONDARY
+    assert pool.health[PRIMARY].state == HALF_OPEN
@@ -0,0 +1,128 @@
+import asyncio
+import collections
+import json
+import threading
+import time
+
+import pytest
+from fastapi import Request
+from fastapi.testclient import TestClient
+
+import main
+from controllers.ai.bedrock import AWSBedrockService
+from services.generation import GenerationRunner
+from services.generation import generation_runner
+
+PARAGRAPH_CHARS = 2000
+MESSAGES = 6
+PARAGRAPHS_PER_MESSAGE = 4
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setenv("BEDROCK_PREWARM", "false")
+    monkeypatch.setenv("IDEMPOTENCY_STORE_PATH", "")
+
+    def get_generation(request: Request) -> GenerationRunner:
+        # Watch the connection continuously, so any poll made during the
+        # upload meets a body message that has arrived but not been read.
+        generation = generation_runner(request)
+        generation.poll_interval = 0.001
+        return generation
+
+    main.app.dependency_overrides[main.get_generation] = get_generation
+    try:
+        with TestClient(main.app) as client:
+            yield client
+    finally:
+        main.app.dependency_overrides.clear()
+
+
+@pytest.fixture
+def prompts(monkeypatch):
+    """Record the prompts of the model calls, each of which takes a while."""
+    recorded = []
+    lock = threading.Lock()
+
+    def generate_response(self, user_prompt, system_prompt, context=None, **kwargs):
+        with lock:
+            recorded.append(user_prompt)
+        time.sleep(0.3)
+        return f"summary {len(recorded)}"
+
+    monkeypatch.setattr(AWSBedrockService, "generate_response", generate_response)
+    return recorded
+
+
+async def post_in_messages(app, messages, delay):
+    """POST ``messages`` as separate ASGI body messages, ``delay`` seconds apart.
+
+    Like a server's receive channel, a message that has already arrived is
+    returned without suspending.
+    """
+    arrived = collections.deque()
+    received = asyncio.Event()
+    response = {}
+    done = asyncio.Event()
+
+    async def feed():
+        for index, body in enumerate(messages):
+            await asyncio.sleep(delay)
+            arrived.append({"type": "http.request", "body": body, "more_body": index < len(messages) - 1})
+            received.set()
+
+    async def receive():
+        while not arrived:
+            if feeder.done():
+                await done.wait()
+                return {"type": "http.disconnect"}
+            received.clear()
+            await received.wait()
+        return arrived.popleft()
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            response["body"] = response.get("body", b"") + message.get("body", b"")
+            if not message.get("more_body", False):
+                done.set()
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/api/ai/summarise/stream",
+        "raw_path": b"/api/ai/summarise/stream",
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"content-type", b"text/plain")],
+        "client": ("testclient", 50000),
+        "server": ("testserver", 80),
+    }
+    feeder = asyncio.ensure_future(feed())
+    try:
+        await asyncio.wait_for(app(scope, receive, send), timeout=30)
+    finally:
+        feeder.cancel()
+    return response
+
+
+def test_streamed_upload_keeps_every_body_message_while_chunks_are_summarised(client, prompts):
+    # Messages keep arriving while the summaries of earlier chunks run.
+    markers = [f"marker{message}x{paragraph}" for message in range(MESSAGES) for paragraph in range(PARAGRAPHS_PER_MESSAGE)]
+    messages = []
+    for message in range(MESSAGES):
+        paragraphs = markers[message * PARAGRAPHS_PER_MESSAGE:(message + 1) * PARAGRAPHS_PER_MESSAGE]
+        messages.append("".join(
+            f"{marker} " + "word " * (PARAGRAPH_CHARS // 5) + "\n\n" for marker in paragraphs
+        ).encode())
+
+    response = client.portal.call(post_in_messages, main.app, messages, 0.05)
+
+    assert response["status"] == 200, response
+    assert json.loads(response["body"])["data"]
+    summarised = "".join(prompts)
+    assert [marker for marker in markers if marker not in summarised] == []